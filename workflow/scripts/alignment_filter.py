@@ -21,6 +21,18 @@ from subprocess import Popen
 import itertools
 from Bio.Seq import Seq
 import os
+import hashlib
+import binding_pyramid as bp
+
+#the bowtie string settings used for running the alignment algorithm
+BOWTIE_STRING = "--local -N 1 -R 3 -D 20 -i C,4 --score-min G,1,4"
+
+#the strand concentrations for nupack predicted duplex score pDups
+STRAND_CONC_A = 1e-6
+STRAND_CONC_B = 1e-12
+
+#the sodium concentration (M) of the NUPACK model
+SODIUM = 0.39
 
 ##############################################################################
 
@@ -94,18 +106,59 @@ def read_probe_filter(p_file):
 
 ##############################################################################
 
+def read_phase_classes(class_file):
+    """
+    Function reads the phase classes file written by phase_classes, where
+    probes of the same tandem repeat phase class share a class id
+    Parameters
+    ----------
+    class_file : file
+        contains the probe sequence and phase class of each probe
+    Returns
+    -------
+    probe_classes : dictionary
+        probe sequence is key and phase class is value
+    """
+
+    colnames = ["probe","phase_class","period","phase"]
+
+    class_df = pd.read_csv(class_file, delimiter = '\t', names = colnames)
+
+    probe_classes = dict(zip(class_df['probe'].tolist(),
+                             class_df['phase_class'].tolist()))
+
+    return probe_classes
+
+##############################################################################
+
 def filter_thresh(probe_df,strand_conc_a,strand_conc_b,
                                bowtie_idx,r_thresh,bowtie_string,
                                NUPACK_MODEL,bt2_k_val,max_pdups_binding,
                                seed_length,max_probe_return,min_on_target,
-                               genomic_bins,thresh,pdups_p,ref_flag):
+                               genomic_bins,thresh,pdups_p,ref_flag,
+                               probe_classes=None,align_cache=None,
+                               time_budget=0,yield_order=False):
     """
     Function implements filter by returning probe cands until on target sum
-    for a target region is reached.
+    for a target region is reached. If phase classes are given, only the
+    first probe of a class to reach the top of the list is aligned and
+    scored, and its binding sums and bin check are reused for the other
+    members of the class under their own coordinates. If a time budget is
+    given, the loop stops once it has run for that many seconds and the
+    probes kept so far are returned.
     Parameters
     ----------
     probe_df : dataframe
         contains probes that have been filtered by mer count and uniqeness
+    probe_classes : dictionary
+        optional, probe sequence is key and phase class is value
+    align_cache : tuple
+        optional, the shared alignment cache directory and settings string
+    time_budget : float
+        optional, seconds the loop may run for, 0 runs without a budget
+    yield_order : bool
+        optional, if True candidates are taken in order of predicted yield,
+        the region k-mer count weighted by the k-mer binding proportion
     Returns
     -------
     on_target_dict : dictionary
@@ -117,8 +170,12 @@ def filter_thresh(probe_df,strand_conc_a,strand_conc_b,
     prop_target_dict : dictionary
         the proportion of on_target pdups binding sum/ all pdups binding
         for all probes
+    stop_reason : string
+        why the loop stopped
     """
 
+    budget_start = time.time()
+
     #need to make lists to store the probe names, on target, off target, prop
     keep_probe_names_list = []
     keep_on_target_list = []
@@ -132,6 +189,14 @@ def filter_thresh(probe_df,strand_conc_a,strand_conc_b,
 
     loop_count = 0
 
+    #candidates expected to add the most on target binding are taken first
+    if yield_order:
+        probe_df = probe_df.reset_index(drop=True)
+        predicted_yield = (probe_df['r_count'].astype(float) *
+                           probe_df['k_score'].astype(float))
+        probe_df = probe_df.loc[predicted_yield.sort_values(
+            ascending=False,kind='mergesort').index]
+
     #initiate groupby
 
     #this takes into account single instances of probe in repeat
@@ -147,6 +212,11 @@ def filter_thresh(probe_df,strand_conc_a,strand_conc_b,
     #keeps track of the on target threshold sum for the region
     threshold_count = 0
 
+    #on target proportion, sums and bin check of each scored phase class
+    class_results = {}
+
+    stop_reason = None
+
     #while the threshold count is below the param requested and 
     #the length of the probe list is greater than 1
     while (threshold_count <= r_thresh and 
@@ -155,34 +225,59 @@ def filter_thresh(probe_df,strand_conc_a,strand_conc_b,
 
         t0 = time.time()
 
-        #make the call for the top probe to get the pairwise df
-        top_probe_al = generate_pairwise_df(probe_list[0],
-                                                  probe_coords_list[0],
-                                                  bowtie_idx,
-                                                  bowtie_string,
-                                                  strand_conc_a,
-                                                  strand_conc_b,
-                                                  NUPACK_MODEL,
-                                                  bt2_k_val,seed_length,ref_flag)
-
-        #compute the on target sum for the top probe
-        prop_dict,on_target_dict,off_target_dict = nupack_sum(top_probe_al,
-                                                                  region_dict,ref_flag)
-
-        #function that makes a temp .bed of alignments and gets overlap
-        #embedded function that takes both overlap inputs to return pileup
-        #returns: agg by chrom, and pileup subset if pileup ok, then proceed
-        signal_pileup_subset,chrom_summ_df = get_bedtools_map(probe_regions_list[0],probe_coords_list[0],
-                                                                  genomic_bins,
-                                                                  top_probe_al,
-                                                                  thresh,ref_flag)
+        if time_budget > 0 and t0 - budget_start >= time_budget:
+            stop_reason = "Time budget"
+            break
+
+        if probe_classes is not None:
+            class_id = probe_classes.get(probe_list[0])
+        else:
+            class_id = None
+
+        if class_id is not None and class_id in class_results:
+
+            #another member of the phase class was already scored
+            prop_val,on_val,off_val,bins_on_target = class_results[class_id]
+
+            prop_dict = {probe_coords_list[0]: prop_val}
+            on_target_dict = {probe_coords_list[0]: on_val}
+            off_target_dict = {probe_coords_list[0]: off_val}
+
+        else:
+
+            #make the call for the top probe to get the pairwise df
+            top_probe_al = cached_pairwise_df(probe_list[0],
+                                                      probe_coords_list[0],
+                                                      bowtie_idx,
+                                                      bowtie_string,
+                                                      strand_conc_a,
+                                                      strand_conc_b,
+                                                      NUPACK_MODEL,
+                                                      bt2_k_val,seed_length,ref_flag,
+                                                      align_cache)
+
+            #compute the on target sum for the top probe
+            prop_dict,on_target_dict,off_target_dict = nupack_sum(top_probe_al,
+                                                                      region_dict,ref_flag)
+
+            #bins the alignments at the genomic bin width and checks that
+            #all bins passing thresh are in the target region
+            bins_on_target = bin_check(probe_regions_list[0],genomic_bins,
+                                       top_probe_al,thresh)
+
+            if class_id is not None:
+                class_results[class_id] = (prop_dict[probe_coords_list[0]],
+                                           on_target_dict[probe_coords_list[0]],
+                                           off_target_dict[probe_coords_list[0]],
+                                           bins_on_target)
+
         loop_count += 1
 
         #checks the items in the proportion dictionary
         #and this is the first item  to be added into the empty list
         #evals if any bins are off target
         for key,val in prop_dict.items():
-            if (val >= float(pdups_p) and ((signal_pileup_subset['bin_type'] == 1).all() == True) and
+            if (val >= float(pdups_p) and (bins_on_target == True) and
                 (on_target_dict[key] >= int(min_on_target))):
 
                 #append probe and it's relevant on target and off
@@ -211,6 +306,12 @@ def filter_thresh(probe_df,strand_conc_a,strand_conc_b,
 
                 #computes pdups between failed cand and all other probes following it
                 for top,cand,coord in zip(top_probe_list,probe_list[1:],probe_coords_list[1:]):
+
+                    #candidates not yet compared are left as not run
+                    if (time_budget > 0 and
+                        time.time() - budget_start >= time_budget):
+                        break
+
                     pdups_val = pdups(top,cand,strand_conc_a,strand_conc_b,NUPACK_MODEL)
                     pdups_val_list.append(pdups_val)
 
@@ -240,20 +341,28 @@ def filter_thresh(probe_df,strand_conc_a,strand_conc_b,
         total_n = t1-t0
         probe_times.append(total_n)
 
+    if stop_reason is None:
+        if threshold_count > r_thresh:
+            stop_reason = "Target sum"
+        elif len(keep_probe_names_list) >= int(max_probe_return):
+            stop_reason = "Max probe return"
+        else:
+            stop_reason = "No candidates"
+
     #make dictionaries of the on target, off target, prop
     on_target_dict = dict(zip(keep_probe_names_list,keep_on_target_list))
     off_target_dict = dict(zip(keep_probe_names_list,keep_off_target_list))
     prop_target_dict = dict(zip(keep_probe_names_list,keep_probe_prop_list))
     probe_run_times_dict = dict(zip(all_run_probes_names_list,probe_times))
 
-    return on_target_dict,off_target_dict,prop_target_dict,probe_run_times_dict,loop_count,keep_probe_names_list,skip_probe_names_list,fail_probe_names_list
+    return on_target_dict,off_target_dict,prop_target_dict,probe_run_times_dict,loop_count,keep_probe_names_list,skip_probe_names_list,fail_probe_names_list,stop_reason
 
 ##############################################################################
 
 def generate_final_df(probe_df,on_target_dict,off_target_dict,
                       prop_target_dict,probe_run_times_dict,
                       loop_count,keep_probe_names_list,skip_probe_names_list,
-                      fail_probe_names_list,o_file,ref_flag):
+                      fail_probe_names_list,stop_reason,o_file,ref_flag):
     """
     Function will make the dictionaries into pandas dataframes where the 
     cols are read as probe, on target, off target, on target pdups prop
@@ -270,6 +379,8 @@ def generate_final_df(probe_df,on_target_dict,off_target_dict,
     prop_target_dict : dictionary
         probes are key and on target pdups  binding proportion
         is the value
+    stop_reason : string
+        why filter_thresh stopped, written to the log of each probe
         
     Returns
     -------
@@ -345,6 +456,7 @@ def generate_final_df(probe_df,on_target_dict,off_target_dict,
         log_probes_df = pd.merge(probe_df,probe_run_times_df, on="probe_coords")
         log_probes_df['label'] = label_list
         log_probes_df['loop_count'] = total_loop_count
+        log_probes_df['stop_reason'] = stop_reason
 
         log_probes_df.to_csv(ref_file_name, header=False, index=False, sep="\t")
 
@@ -461,6 +573,129 @@ def generate_pairwise_df(probe_seq,probe_coords,bowtie_idx,bowtie_string,
 
 ##############################################################################
 
+def alignment_cache_tag(bowtie_idx,bowtie_string,bt2_k_val,seed_length,
+                        model_temp,sodium=SODIUM):
+    """
+    Function joins the alignment and NUPACK model settings that the cached
+    alignments and pdups scores of a probe sequence depend on
+    """
+
+    return "|".join([os.path.basename(str(bowtie_idx)),str(bowtie_string),
+                     str(bt2_k_val),str(seed_length),
+                     str(float(model_temp)),str(STRAND_CONC_A),
+                     str(STRAND_CONC_B),str(float(sodium))])
+
+##############################################################################
+
+def alignment_cache_file(probe_seq,align_cache):
+    """
+    Function returns the file of the shared alignment cache that holds the
+    pairwise alignments and pdups scores of a probe sequence. Files are
+    named by a hash of the sequence and the alignment and model settings,
+    so results are shared by every region and scaffold run with the same
+    settings.
+    Parameters
+    ----------
+    probe_seq : string
+        a probe sequence of interest
+    align_cache : tuple
+        the cache directory and the string of alignment and model settings
+    Returns
+    -------
+    cache_file : string
+        path of the cache file for the probe sequence
+    """
+
+    cache_dir,cache_tag = align_cache
+
+    cache_key = hashlib.sha1((cache_tag + "|" + probe_seq).encode()).hexdigest()
+
+    return os.path.join(cache_dir,cache_key[:2],cache_key + ".tsv")
+
+##############################################################################
+
+def cached_pairwise_df(probe_seq,probe_coords,bowtie_idx,bowtie_string,
+                       strand_conc_a,strand_conc_b,NUPACK_MODEL,
+                       bt2_k_val,seed_length,ref_flag,align_cache=None):
+    """
+    Function returns the pairwise df of a probe sequence from the shared
+    alignment cache, generating and storing it on a miss. Alignments and
+    pdups scores do not depend on the region a probe was designed from, so
+    only the probe_ID column is set to the probe coordinates.
+    Parameters
+    ----------
+    probe_seq : string
+        a probe sequence of interest from the filtered probe dataframe
+    probe_coords : string
+        the coordinates of the probe sequence
+    align_cache : tuple
+        optional, the cache directory and the string of alignment and model
+        settings
+    Returns
+    -------
+    pairwise_df : dataframe
+        includes parent seq, derived seq, and pdups score
+    """
+
+    #reference runs keep their per probe bam and pdups files
+    if align_cache is None or int(ref_flag) == 1:
+        return generate_pairwise_df(probe_seq,probe_coords,bowtie_idx,
+                                    bowtie_string,strand_conc_a,
+                                    strand_conc_b,NUPACK_MODEL,bt2_k_val,
+                                    seed_length,ref_flag)
+
+    cache_file = alignment_cache_file(probe_seq,align_cache)
+
+    if os.path.exists(cache_file):
+        pairwise_df = pd.read_csv(cache_file, sep="\t",
+                                  dtype={"parent": str, "derived": str,
+                                         "align_chr": str})
+        pairwise_df.insert(0,'probe_ID',str(probe_coords))
+
+        return pairwise_df
+
+    pairwise_df = generate_pairwise_df(probe_seq,probe_coords,bowtie_idx,
+                                       bowtie_string,strand_conc_a,
+                                       strand_conc_b,NUPACK_MODEL,bt2_k_val,
+                                       seed_length,ref_flag)
+
+    store_pairwise_df(pairwise_df,cache_file)
+
+    return pairwise_df
+
+##############################################################################
+
+def store_pairwise_df(pairwise_df,cache_file):
+    """
+    Function writes the pairwise df of a probe sequence to its file of the
+    shared alignment cache, without the probe_ID column
+    """
+
+    create_dir(os.path.dirname(cache_file))
+
+    #written under a temp name so parallel jobs never read a partial file
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(cache_file),
+                                     suffix=".tmp", delete=False) as tmp_f:
+        pairwise_df.drop(columns=['probe_ID']).to_csv(tmp_f, index=False,
+                                                      sep="\t")
+    os.replace(tmp_f.name,cache_file)
+
+##############################################################################
+
+def nupack_model(model_temp,sodium=SODIUM):
+    """
+    Function configures the NUPACK model used to compute pdups
+    """
+
+    return nupack.Model(
+        material = 'dna',
+        celsius = float(model_temp),
+        sodium = float(sodium),
+        magnesium = 0.0,
+        ensemble = 'stacking')
+
+##############################################################################
+
 def create_dir(dir):
    """
    Function creates directories without throwing an error
@@ -791,236 +1026,38 @@ def nupack_sum(pairwise_df,probe_region_dict,ref_flag):
 
 ##############################################################################
 
-def get_bedtools_map(probe_region,probe_coords,genome_bin_file,top_probe_al,thresh,ref_flag):
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-
-        #the file for the bed file overlap
-        repeat_filename = tmpdir + '/region.bed'
-        repeat_overlap_out = tmpdir + '/overlap_out.bed'
-        probe_overlap_out = tmpdir + '/probe_overlap_out.bed'
-
-
-        #write the repeat contents as a bed file
-        repeat_bed = open(repeat_filename, 'w')
-
-        #split the string on chars
-        probe_region = probe_region.replace(":","\t")
-        probe_region = probe_region.replace("-","\t")
-
-        #write repeat into file format
-        repeat_bed.write(str(probe_region))
-        repeat_bed.close()
-
-        #subprocess call to get overlap file
-        subprocess.call(['bedtools', 'intersect', '-wa', '-wb', '-a',
-                         repeat_filename, '-b', genome_bin_file],
-                    stdout=open(repeat_overlap_out,'w'))
-
-        #read repeat file as dataframe
-        colnames = ["chrom", "start", "stop", "chrom_b","start_b","stop_b"]
-        repeat_overlap_out_df = pd.read_csv(repeat_overlap_out,
-                                            names=colnames,header=None,
-                            sep='\t')
-
-
-        #the tmp file for the alignments
-        alignment_file = tmpdir + '/probe_alignments.tsv'
-
-
-        #drop cols
-        columns = ['probe_ID', 'parent', 'derived', 'pdups', 
-                   'repeat_coords', 'parent_chrom', 'region',
-                   'r_start', 'r_end']
-        
-        top_probe_al_coords = top_probe_al.drop(columns,axis=1)
-
-        #write contents of df to file
-        top_probe_al_coords.to_csv(alignment_file, header=False,
-                                   index=False, sep="\t")
-
-        #subprocess call to get overlap file
-        subprocess.call(['bedtools', 'intersect', '-wa', '-wb', '-a',
-                         alignment_file, '-b', genome_bin_file],
-                    stdout=open(probe_overlap_out,'w'))
-
-        #read probe overlap filer as dataframe
-        colnames = ["chrom", "start", "stop", "chrom_b","start_b","stop_b"]
-        probe_overlap_out_df = pd.read_csv(probe_overlap_out,
-                                           names=colnames,
-                                           header=None,sep='\t')
-
-        #format pDups file correctly for map function
-        columns = ['align_end','repeat_coords','parent_chrom',
-                   'region','r_start','r_end']
-        top_probe_al_map = top_probe_al.drop(columns,axis=1)
-
-        top_probe_al_map = top_probe_al_map[["probe_ID","parent","derived",
-                "align_chr","align_start","pdups"]]
-
-        #read repeat file as dataframe
-        colnames = ["chrom","bin_start","bin_stop"]
-        genome_bin_file_df = pd.read_csv(genome_bin_file, names=colnames,
-                                         header=None,sep='\t')
-
-        signal_pileup_subset,chrom_summ_df = map_alignments_by_bin(genome_bin_file_df,
-                                                                   probe_overlap_out_df,
-                                                                   repeat_overlap_out_df,
-                                                                   top_probe_al_map,thresh)
-
-        
-        return signal_pileup_subset,chrom_summ_df
-
-##############################################################################
-
-def map_alignments_by_bin(chr_track,chr_overlap,repeat_overlap,pairs_pdups,thresh):
-
+def bin_check(probe_region,genomic_bins,top_probe_al,thresh):
     """
-    Function takes the genome bin file, the bedtools intersect file, and
-    the pairwise file containing pdups computes to process them as 
-    dataframes.
-    
+    Function builds the binding pyramid of the alignments of a probe at the
+    width of the genomic bins and checks that every bin with an aggregate
+    pdups sum at or above thresh overlaps the target repeat region
     Parameters
     ----------
-    chr_track_file : file
-        file containing the 1Mb bins of the genome
-    chr_overlap_bed : file
-        bedtools intersect output over alignment coords
-    repeat_overlap_bed: file
-        bedtools intersect output over repeat region coords
-    pDups_scores : file
-        file from alignment output
+    probe_region : string
+        the target repeat region, as chrom:start-end
+    genomic_bins : tuple
+        scaffold sizes and bin width of the genome bin file
+    top_probe_al : dataframe
+        alignments of the probe with pdups and alignment ends
+    thresh : string
+        min pdups sum of a bin to be checked
     Returns
     -------
-    chr_track : dataframe
-        bed file containing the coordinates of 1Mb bins
-    chr_overlap : dataframe
-        contains the overlaps of bedtools intersect on alignments
-    repeat_overlap: dataframe
-        contains the overlaps of the bedtools intersect on repeat region
-    pairs_pdups : dataframe
-        contains the pairwise output
+    bins_on_target : bool
+        True if no bin outside of the target region passes thresh
     """
 
-    #label columns for ground file with the bed tracks
-    chr_track=chr_track[~chr_track.chrom.str.contains("M")]
+    chrom_sizes,bin_width = genomic_bins
 
-    #label columns for matching overlaps
-    chr_overlap=chr_overlap[~chr_overlap.chrom.str.contains("M")]
-    chr_overlap=chr_overlap[~chr_overlap.chrom_b.str.contains("M")]
+    top_probe_al = top_probe_al[~top_probe_al.derived.str.contains("M")]
 
-    #label columns for matching overlaps
-    repeat_overlap=repeat_overlap[~repeat_overlap.chrom.str.contains("M")]
-    repeat_overlap=repeat_overlap[~repeat_overlap.chrom_b.str.contains("M")]
+    pyramid = bp.build_pyramid(top_probe_al['align_chr'].tolist(),
+                               top_probe_al['align_start'].values,
+                               top_probe_al['align_end'].values,
+                               top_probe_al['pdups'].values,
+                               chrom_sizes,probe_region,(bin_width,))
 
-    #label columns for data where you have the nupack data
-    pairs_pdups=pairs_pdups[~pairs_pdups.derived.str.contains("M")]
-    pairs_pdups=pairs_pdups[~pairs_pdups.align_chr.str.contains("M")]
-
-    pairs_pdups = pairs_pdups.drop(['parent', 'derived'], axis = 1)
-
-    derived_coords_list = pairs_pdups['align_chr'].tolist()
-    starts_list = pairs_pdups['align_start'].tolist()
-    pdups_vals_list = pairs_pdups['pdups'].tolist()
-
-    pairs_pdups_dict = {}
-    bin_dict = {}
-    bin_coords_list = []
-
-    chrom_list = chr_overlap['chrom'].tolist()
-    start_list = chr_overlap['start'].tolist()
-    start_b_list = chr_overlap['start_b'].tolist()
-    stop_b_list = chr_overlap['stop_b'].tolist()
-
-    for chrom,start,pdups in zip(derived_coords_list,starts_list,pdups_vals_list):
-        coord_key = str(chrom) + "_" + str(start)
-        pairs_pdups_dict[coord_key]=pdups
-
-    coord_key_list = []
-    for chrom,start in zip(chrom_list,start_list):
-        coord_key = str(chrom) + "_" + str(start)
-        coord_key_list.append(coord_key)
-
-    chr_overlap['coord_key'] = coord_key_list
-
-    pdups_list = []
-    for coord in coord_key_list:
-        if coord in pairs_pdups_dict:
-            pdups_list.append(pairs_pdups_dict[coord])
-    
-    chr_overlap['pdups'] = pdups_list
-
-    #remove intermediate column
-    chr_overlap = chr_overlap.drop(['chrom', 'start', 'stop','coord_key'], axis=1)
-
-    chr_overlap.columns = ['chrom','bin_start','bin_stop','pdups']
-
-    bin_sums = chr_overlap.groupby(['chrom','bin_start','bin_stop'])['pdups'].sum().reset_index()
-
-    #subset items in chr_track not in bin sums
-
-    #drop pdups for now 
-    bins_w_vals = bin_sums.drop(['pdups'], axis = 1)
-
-    chr_track['bin_start']=chr_track['bin_start'].astype(int)
-    chr_track['bin_stop']=chr_track['bin_stop'].astype(int)
-    bins_w_vals['bin_start']=bins_w_vals['bin_start'].astype(int)
-    bins_w_vals['bin_stop']=bins_w_vals['bin_stop'].astype(int)
-
-    #subset rows not in bins with vals
-    common = bins_w_vals.merge(chr_track,on=['chrom', 'bin_start',
-                                             'bin_stop'],how='left')
-
-    not_overlapping = pd.merge(chr_track, common, how='left', indicator=True) \
-           .query("_merge == 'left_only'") \
-           .drop('_merge',1)
-
-    not_overlapping['pdups'] = 0.0
-
-    #now merge with nupack
-    frames = [bin_sums,not_overlapping]
-
-    merged = pd.concat(frames)
-
-    merged = merged.sort_values(by=['chrom','bin_start','bin_stop'])
-
-    #here you should read in the repeat dataframe to get the chrom_start_stops
-    chrom_list = repeat_overlap['chrom_b'].tolist()
-    start_list = repeat_overlap['start_b'].tolist()
-    stop_list = repeat_overlap['stop_b'].tolist()
-
-    #make a dictionary storing location as key lookup
-    repeat_dict = {}
-
-    for chrom,start,stop in zip(chrom_list,start_list,stop_list):
-        repeat_key = str(chrom) + "_" + str(start) + "_" + str(stop)
-        repeat_dict[repeat_key] = 1
-
-    #store values of bin type (target = 1, non = 0)
-    bin_type = []
-
-    #make lists to generate key lookups of all bins
-    bin_chrom_list = merged['chrom'].tolist()
-    bin_start_list = merged['bin_start'].tolist()
-    bin_stop_list = merged['bin_stop'].tolist()
-
-    for chrom,start,stop in zip(bin_chrom_list,bin_start_list,bin_stop_list):
-        location_key = str(chrom) + "_" + str(start) + "_" + str(stop)
-        if location_key in repeat_dict:
-            bin_type.append(1)
-        else:
-            bin_type.append(0)
-
-    #annotates whether bin is considered target or non-target
-    merged['bin_type'] = bin_type
-
-    #subset the signal over particular regions of interest
-    signal_pileup_subset = merged.loc[merged['pdups'] >= int(thresh)]
-
-    #summarize all signals by chromosome in table form 
-    chrom_summ_df = merged.groupby(['chrom'])['pdups'].sum().reset_index()
-
-    return signal_pileup_subset,chrom_summ_df
+    return bp.bins_on_target(pyramid,bin_width,int(thresh))
 
 ##############################################################################
                                                                           
@@ -1078,6 +1115,24 @@ def main():
                                required=True, help='pdups prop min')
     requiredNamed.add_argument('-rf', '--ref_flag', action='store',
                                required=True, help='reference flag',default = 0)
+    userInput.add_argument('-ac', '--align_cache', action='store',
+                           default=None, help='The shared alignment cache'
+                           ' directory, alignments and pdups scores of each'
+                           ' probe sequence are read from or added to it;'
+                           ' default is None')
+    userInput.add_argument('-pc', '--phase_classes', action='store',
+                           default=None, help='The phase classes file of the'
+                           ' repeat region, only one probe of each class is'
+                           ' aligned and scored; default is None')
+    userInput.add_argument('-tb', '--time_budget', action='store',
+                           default=0, type=float, help='Seconds the region'
+                           ' may be filtered for, the probes kept when it'
+                           ' runs out are written; default is 0, no budget')
+    userInput.add_argument('-yo', '--yield_order', action='store_true',
+                           default=False, help='Take candidates in order of'
+                           ' predicted yield, the region k-mer count weighted'
+                           ' by the k-mer binding proportion; default is'
+                           ' False')
 
     args = userInput.parse_args()
     p_file = args.probe_file
@@ -1090,33 +1145,46 @@ def main():
     model_temp = args.model_temp
     min_on_target = args.min_on_target
     max_probe_return = args.max_probe_return
-    genomic_bins = args.genomic_bin
+    genomic_bins = bp.read_genome_bins(args.genomic_bin)
     thresh = args.thresh
     pdups_p = args.pdups_p
     ref_flag = args.ref_flag
+    phase_classes = args.phase_classes
+    align_cache_dir = args.align_cache
+    time_budget = args.time_budget
+    yield_order = args.yield_order
 
     #the bowtie string settings used for running the alignment algorithm
-    bowtie_string = "--local -N 1 -R 3 -D 20 -i C,4 --score-min G,1,4"
+    bowtie_string = BOWTIE_STRING
 
     # configure nupack model for use
-    NUPACK_MODEL = nupack.Model(
-        material = 'dna',
-        celsius = float(model_temp),
-        sodium = 0.39,
-        magnesium = 0.0,
-        ensemble = 'stacking')
+    NUPACK_MODEL = nupack_model(model_temp)
 
     #configure the strand concentrations for nupack predicted duplex score
     #pDups
-    strand_conc_a=1e-6
-    strand_conc_b=1e-12
+    strand_conc_a=STRAND_CONC_A
+    strand_conc_b=STRAND_CONC_B
+
+    if align_cache_dir is not None:
+        align_cache = (align_cache_dir,alignment_cache_tag(bowtie_idx,
+                                                           bowtie_string,
+                                                           bt2_k_val,
+                                                           seed_length,
+                                                           model_temp))
+    else:
+        align_cache = None
 
 
     probe_df = read_probe_filter(p_file)
 
+    if phase_classes is not None:
+        probe_classes = read_phase_classes(phase_classes)
+    else:
+        probe_classes = None
+
     print("---%s seconds ---"%(time.time()-start_time))
 
-    on_target_d,off_target_d,prop_target_d,probe_run_times_dict,loop_count,keep_probe_names_list,skip_probe_names_list,fail_probe_names_list = filter_thresh(probe_df,
+    on_target_d,off_target_d,prop_target_d,probe_run_times_dict,loop_count,keep_probe_names_list,skip_probe_names_list,fail_probe_names_list,stop_reason = filter_thresh(probe_df,
                                                                strand_conc_a,
                                                                strand_conc_b,
                                                                bowtie_idx,
@@ -1129,11 +1197,18 @@ def main():
                                                                max_probe_return,
                                                                min_on_target,
                                                                genomic_bins,
-                                                               thresh,pdups_p,ref_flag)
+                                                               thresh,pdups_p,ref_flag,
+                                                               probe_classes,
+                                                               align_cache,
+                                                               time_budget,
+                                                               yield_order)
+
+    print("stopped: %s, %s of %s candidates run, %s probes kept" %
+          (stop_reason,loop_count,len(probe_df),len(keep_probe_names_list)))
 
     print("---%s seconds ---"%(time.time()-start_time))
 
-    generate_final_df(probe_df,on_target_d,off_target_d,prop_target_d,probe_run_times_dict,loop_count,keep_probe_names_list,skip_probe_names_list,fail_probe_names_list,o_file,ref_flag)
+    generate_final_df(probe_df,on_target_d,off_target_d,prop_target_d,probe_run_times_dict,loop_count,keep_probe_names_list,skip_probe_names_list,fail_probe_names_list,stop_reason,o_file,ref_flag)
 
     print("---%s seconds ---"%(time.time()-start_time))
 
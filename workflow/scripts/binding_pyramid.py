@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "binding_pyramid"
+
+#import libraries
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import get_alignments as ga
+
+#bin widths aggregated when a pyramid is built
+DEFAULT_LEVELS = (10000, 100000, 1000000, 5000000)
+
+##############################################################################
+
+def read_genome_bins(bin_file):
+    """
+    This function reads a genome bin file made by bedtools makewindows and
+    returns the scaffold sizes and the width of its bins
+
+    Parameters
+    ----------
+    bin_file : file
+        bed file of genomic bins
+
+    Returns
+    -------
+    chrom_sizes : dictionary
+        scaffold is key and its size is value, in file order
+    bin_width : int
+        width of the bins of the file
+    """
+
+    colnames = ["chrom","bin_start","bin_stop"]
+    bins_df = pd.read_csv(bin_file, names=colnames, header=None, sep='\t')
+
+    #the last bin of each scaffold ends at the scaffold size
+    chrom_sizes = bins_df.groupby('chrom',sort = False)['bin_stop'].max()
+
+    bin_width = int(bins_df['bin_stop'].iloc[0] - bins_df['bin_start'].iloc[0])
+
+    return dict(zip(chrom_sizes.index,chrom_sizes.astype(int))),bin_width
+
+##############################################################################
+
+def bin_signal(chrom_idx,starts,ends,pdups,sizes,width):
+    """
+    This function sums the pdups of alignments over bins of a given width.
+    An alignment adds its pdups to every bin it overlaps by at least one
+    base, as with bedtools intersect -wa -wb against makewindows bins.
+
+    Parameters
+    ----------
+    chrom_idx : numpy array
+        scaffold index of each alignment
+    starts : numpy array
+        start of each alignment
+    ends : numpy array
+        end of each alignment
+    pdups : numpy array
+        pdups of each alignment
+    sizes : numpy array
+        size of each scaffold
+    width : int
+        width of the bins
+
+    Returns
+    -------
+    signal : tuple
+        scaffold index, bin index and pdups sum of each bin with alignments
+    """
+
+    first = starts // width
+    last = (ends - 1) // width
+    n_bins = last - first + 1
+
+    offsets = np.arange(n_bins.sum()) - np.repeat(np.cumsum(n_bins) - n_bins,
+                                                  n_bins)
+
+    rows = np.repeat(np.arange(len(starts)),n_bins)
+    bins = np.repeat(first,n_bins) + offsets
+
+    #alignments running past the scaffold end have no bin there
+    in_scaffold = bins * width < sizes[chrom_idx[rows]]
+    rows = rows[in_scaffold]
+    bins = bins[in_scaffold]
+
+    #bins are summed in alignment order
+    bin_df = pd.DataFrame({'chrom': chrom_idx[rows], 'bin': bins,
+                           'pdups': pdups[rows]})
+    bin_sums = bin_df.groupby(['chrom','bin'])['pdups'].sum().reset_index()
+
+    return (bin_sums['chrom'].values.astype(np.int64),
+            bin_sums['bin'].values.astype(np.int64),
+            bin_sums['pdups'].values.astype(np.float64))
+
+##############################################################################
+
+def build_pyramid(chroms,starts,ends,pdups,chrom_sizes,region,
+                  levels=DEFAULT_LEVELS):
+    """
+    This function stores the binding signal of a probe set as its base
+    resolution alignments and the bin sums of each level. Scaffolds
+    containing M are left out. Alignments sharing a scaffold and start take
+    the pdups of the last of them, as in get_alignments.
+
+    Parameters
+    ----------
+    chroms : list
+        scaffold of each alignment
+    starts : list
+        start of each alignment
+    ends : list
+        end of each alignment
+    pdups : list
+        pdups of each alignment
+    chrom_sizes : dictionary
+        scaffold is key and its size is value
+    region : string
+        the target repeat region, as chrom:start-end
+    levels : tuple
+        bin widths summed when the pyramid is built
+
+    Returns
+    -------
+    pyramid : dictionary
+        scaffolds, sizes, target region, base alignments and bin sums of
+        each level
+    """
+
+    chrom_names = [c for c in chrom_sizes if "M" not in str(c)]
+    sizes = np.array([chrom_sizes[c] for c in chrom_names],dtype=np.int64)
+
+    align_df = pd.DataFrame({'chrom': list(chroms),
+                             'start': np.asarray(starts,dtype=np.int64),
+                             'end': np.asarray(ends,dtype=np.int64),
+                             'pdups': np.asarray(pdups,dtype=np.float64)})
+
+    align_df['pdups'] = align_df.groupby(['chrom','start'],
+                                         sort = False)['pdups'].transform('last')
+
+    chrom_lookup = dict(zip(chrom_names,range(len(chrom_names))))
+    align_df['chrom_idx'] = align_df['chrom'].map(chrom_lookup)
+    align_df = align_df.dropna(subset=['chrom_idx'])
+
+    pyramid = {'chroms': chrom_names,
+               'sizes': sizes,
+               'region': region,
+               'base': (align_df['chrom_idx'].values.astype(np.int64),
+                        align_df['start'].values,
+                        align_df['end'].values,
+                        align_df['pdups'].values),
+               'levels': {}}
+
+    for width in levels:
+        pyramid['levels'][int(width)] = bin_signal(*pyramid['base'],sizes,
+                                                   int(width))
+
+    return pyramid
+
+##############################################################################
+
+def level_signal(pyramid,width):
+    """
+    This function returns the bin sums of a level of the pyramid, summing
+    the base alignments if the level was not built
+
+    Parameters
+    ----------
+    pyramid : dictionary
+        binding signal of a probe set
+    width : int
+        width of the bins
+
+    Returns
+    -------
+    signal : tuple
+        scaffold index, bin index and pdups sum of each bin with alignments
+    """
+
+    width = int(width)
+
+    if width not in pyramid['levels']:
+        pyramid['levels'][width] = bin_signal(*pyramid['base'],
+                                              pyramid['sizes'],width)
+
+    return pyramid['levels'][width]
+
+##############################################################################
+
+def region_bins(pyramid,width):
+    """
+    This function returns the bins of a level overlapped by the target
+    repeat region of the pyramid
+
+    Parameters
+    ----------
+    pyramid : dictionary
+        binding signal of a probe set
+    width : int
+        width of the bins
+
+    Returns
+    -------
+    target_bins : set
+        scaffold index and bin index of each target bin
+    """
+
+    chrom,coords = pyramid['region'].split(':')
+    r_start,r_end = [int(c) for c in coords.split('-')]
+
+    if chrom not in pyramid['chroms']:
+        return set()
+
+    chrom_idx = pyramid['chroms'].index(chrom)
+    r_end = min(r_end,int(pyramid['sizes'][chrom_idx]))
+
+    return set((chrom_idx,b) for b in range(r_start // width,
+                                            (r_end - 1) // width + 1))
+
+##############################################################################
+
+def level_table(pyramid,width):
+    """
+    This function returns every bin of a level with its pdups sum and
+    whether it overlaps the target repeat region, with the columns and
+    order of the bin table made by get_alignments
+
+    Parameters
+    ----------
+    pyramid : dictionary
+        binding signal of a probe set
+    width : int
+        width of the bins
+
+    Returns
+    -------
+    merged : dataframe
+        chrom, bin_start, bin_stop, pdups sum and bin_type of each bin
+    """
+
+    width = int(width)
+    sizes = pyramid['sizes']
+
+    n_bins = -(-sizes // width)
+    chrom_idx = np.repeat(np.arange(len(sizes)),n_bins)
+    bins = np.arange(n_bins.sum()) - np.repeat(np.cumsum(n_bins) - n_bins,
+                                               n_bins)
+
+    signal_chrom,signal_bin,signal_pdups = level_signal(pyramid,width)
+
+    #bins without alignments have a sum of 0
+    bin_offsets = np.cumsum(n_bins) - n_bins
+    pdups = np.zeros(len(bins),dtype=np.float64)
+    pdups[bin_offsets[signal_chrom] + signal_bin] = signal_pdups
+
+    target_bins = region_bins(pyramid,width)
+    bin_type = [1 if (c,b) in target_bins else 0
+                for c,b in zip(chrom_idx.tolist(),bins.tolist())]
+
+    merged = pd.DataFrame({'chrom': np.array(pyramid['chroms'],
+                                             dtype=object)[chrom_idx],
+                           'bin_start': bins * width,
+                           'bin_stop': np.minimum((bins + 1) * width,
+                                                  sizes[chrom_idx]),
+                           'pdups': pdups,
+                           'bin_type': bin_type})
+
+    merged = merged.sort_values(by=['chrom','bin_start','bin_stop'])
+
+    return merged
+
+##############################################################################
+
+def bins_on_target(pyramid,width,thresh):
+    """
+    This function checks that every bin of a level with a pdups sum at or
+    above thresh overlaps the target repeat region
+
+    Parameters
+    ----------
+    pyramid : dictionary
+        binding signal of a probe set
+    width : int
+        width of the bins
+    thresh : float
+        min pdups sum of a bin to be checked
+
+    Returns
+    -------
+    on_target : bool
+        True if no bin outside of the target passes thresh
+    """
+
+    if thresh <= 0:
+        merged = level_table(pyramid,width)
+        return bool((merged.loc[merged['pdups'] >= thresh,
+                                'bin_type'] == 1).all())
+
+    signal_chrom,signal_bin,signal_pdups = level_signal(pyramid,width)
+
+    target_bins = region_bins(pyramid,int(width))
+    passing = signal_pdups >= thresh
+
+    return all((c,b) in target_bins for c,b in
+               zip(signal_chrom[passing].tolist(),signal_bin[passing].tolist()))
+
+##############################################################################
+
+def write_pyramid(pyramid,out_file):
+    """
+    This function writes the pyramid as a compressed numpy archive
+
+    Parameters
+    ----------
+    pyramid : dictionary
+        binding signal of a probe set
+    out_file : file
+        path of the .npz archive
+
+    Returns
+    -------
+    None. Writes the pyramid file.
+    """
+
+    arrays = {'chroms': np.array(pyramid['chroms'],dtype=str),
+              'sizes': pyramid['sizes'],
+              'region': np.array(pyramid['region'],dtype=str),
+              'levels': np.array(sorted(pyramid['levels']),dtype=np.int64)}
+
+    for name,values in zip(['chrom','start','end','pdups'],pyramid['base']):
+        arrays['base_%s' % name] = values
+
+    for width,signal in pyramid['levels'].items():
+        for name,values in zip(['chrom','bin','pdups'],signal):
+            arrays['level_%s_%s' % (width,name)] = values
+
+    #np.savez_compressed adds .npz to paths without it
+    with open(out_file,'wb') as out_f:
+        np.savez_compressed(out_f,**arrays)
+
+##############################################################################
+
+def read_pyramid(pyramid_file):
+    """
+    This function reads a pyramid written by write_pyramid
+
+    Parameters
+    ----------
+    pyramid_file : file
+        path of the .npz archive
+
+    Returns
+    -------
+    pyramid : dictionary
+        binding signal of a probe set
+    """
+
+    with np.load(pyramid_file) as arrays:
+
+        pyramid = {'chroms': arrays['chroms'].tolist(),
+                   'sizes': arrays['sizes'],
+                   'region': str(arrays['region']),
+                   'base': tuple(arrays['base_%s' % name] for name in
+                                 ['chrom','start','end','pdups']),
+                   'levels': {}}
+
+        for width in arrays['levels'].tolist():
+            pyramid['levels'][width] = tuple(arrays['level_%s_%s' %
+                                                    (width,name)]
+                                             for name in ['chrom','bin',
+                                                          'pdups'])
+
+    return pyramid
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Reads the binding pyramid of a repeat region and writes the genome
+    wide and thresholded binding summaries, and optionally the binding map,
+    at any bin width without aligning or intersecting again."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires a binding pyramid file written by post_alignment. Returns'
+        'the binding summaries of the repeat region at the bin width given.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--pyramid_file', action='store',
+                               required=True, help='The binding pyramid'
+                               'file of the repeat region')
+    requiredNamed.add_argument('-w', '--bin_width', action='store',
+                               required=True, type=int, help='The width of'
+                               'the bins summarized')
+    requiredNamed.add_argument('-t', '--thresh', action='store',
+                               required=True, help='pdups >= to subset')
+    requiredNamed.add_argument('-c_s', '--chrom_summ', action='store',
+                               required=True, help='chrom pdups summ file')
+    requiredNamed.add_argument('-t_s', '--thresh_summ', action='store',
+                               required=True, help='threshold summ file')
+    userInput.add_argument('-pl', '--out_plot', action='store',
+                           default=None, help='output genome plot; default'
+                           ' is None')
+
+    args = userInput.parse_args()
+
+    pyramid = read_pyramid(args.pyramid_file)
+
+    print("levels: %s" % sorted(pyramid['levels']))
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    merged = level_table(pyramid,args.bin_width)
+
+    ga.generate_summary_table(merged,args.thresh,args.thresh_summ,
+                              args.chrom_summ)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    if args.out_plot is not None:
+        ga.generate_plot(merged,args.out_plot)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
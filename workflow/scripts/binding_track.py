@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "binding_track"
+
+#import libraries
+import time
+import argparse
+import json
+import struct
+import zlib
+import numpy as np
+import pandas as pd
+import binding_pyramid as bp
+
+#file signature, version and header layout of a binding track
+TRACK_MAGIC = b'TFBT'
+TRACK_VERSION = 1
+TRACK_HEADER = struct.Struct('<4sHHIQ')
+
+##############################################################################
+
+def write_track(pyramid,out_file,block_size=1024):
+    """
+    This function writes the bin sums of every level of a binding pyramid
+    as an indexed binary track. The bins with signal of each scaffold and
+    level are split into blocks of block_size bins that are compressed
+    separately, and an index of the bin range and file offset of each block
+    is written at the end of the file, so that a window is read without
+    decompressing the rest of the track.
+
+    Parameters
+    ----------
+    pyramid : dictionary
+        binding signal of a probe set from binding_pyramid
+    out_file : file
+        path of the binding track
+    block_size : int
+        max number of bins in each compressed block
+
+    Returns
+    -------
+    None. Writes the binding track.
+    """
+
+    widths = sorted(int(w) for w in pyramid['levels'])
+    chroms = pyramid['chroms']
+
+    index = {'chroms': [[c,int(s)] for c,s in zip(chroms,pyramid['sizes'])],
+             'region': pyramid['region'],
+             'zooms': widths,
+             'blocks': {}}
+
+    with open(out_file,'wb') as out_f:
+
+        #the header is written again once the index offset is known
+        out_f.write(TRACK_HEADER.pack(TRACK_MAGIC,TRACK_VERSION,len(widths),
+                                      len(chroms),0))
+
+        for width in widths:
+
+            signal_chrom,signal_bin,signal_pdups = bp.level_signal(pyramid,
+                                                                   width)
+            zoom_blocks = {}
+
+            for chrom_idx in np.unique(signal_chrom).tolist():
+
+                in_chrom = signal_chrom == chrom_idx
+                bins = signal_bin[in_chrom]
+                pdups = signal_pdups[in_chrom]
+
+                chrom_blocks = []
+                for i in range(0,len(bins),block_size):
+
+                    block_bins = bins[i:i+block_size]
+                    payload = zlib.compress(
+                        block_bins.astype('<u4').tobytes() +
+                        pdups[i:i+block_size].astype('<f8').tobytes())
+
+                    chrom_blocks.append([int(block_bins[0]),
+                                         int(block_bins[-1]),
+                                         out_f.tell(),len(payload),
+                                         len(block_bins)])
+                    out_f.write(payload)
+
+                zoom_blocks[chroms[chrom_idx]] = chrom_blocks
+
+            index['blocks'][str(width)] = zoom_blocks
+
+        index_offset = out_f.tell()
+        out_f.write(zlib.compress(json.dumps(index).encode()))
+
+        out_f.seek(0)
+        out_f.write(TRACK_HEADER.pack(TRACK_MAGIC,TRACK_VERSION,len(widths),
+                                      len(chroms),index_offset))
+
+##############################################################################
+
+def read_track_index(track_file):
+    """
+    This function reads the header and index of a binding track
+
+    Parameters
+    ----------
+    track_file : file
+        path of the binding track
+
+    Returns
+    -------
+    index : dictionary
+        scaffolds, target region, zoom widths and blocks of the track
+    """
+
+    with open(track_file,'rb') as in_f:
+
+        magic,version,n_zooms,n_chroms,index_offset = TRACK_HEADER.unpack(
+            in_f.read(TRACK_HEADER.size))
+
+        if magic != TRACK_MAGIC or version != TRACK_VERSION:
+            raise ValueError("%s is not a binding track" % track_file)
+
+        in_f.seek(index_offset)
+        index = json.loads(zlib.decompress(in_f.read()).decode())
+
+    return index
+
+##############################################################################
+
+def fetch(track_file,chrom,start,end,width=None,index=None):
+    """
+    This function returns the bins with signal of a zoom level that overlap
+    a window of a scaffold, decompressing only the blocks that overlap it
+
+    Parameters
+    ----------
+    track_file : file
+        path of the binding track
+    chrom : string
+        scaffold of the window
+    start : int
+        start of the window
+    end : int
+        end of the window
+    width : int
+        bin width of the zoom level read; default is the finest level
+    index : dictionary
+        optional, the index of the track if already read
+
+    Returns
+    -------
+    window_df : dataframe
+        chrom, start, end and pdups sum of each bin with signal
+    """
+
+    colnames = ["chrom","start","end","pdups"]
+
+    if index is None:
+        index = read_track_index(track_file)
+
+    if width is None:
+        width = index['zooms'][0]
+
+    if int(width) not in index['zooms']:
+        raise ValueError("No zoom level of width %s in %s, levels are %s" %
+                         (width,track_file,index['zooms']))
+
+    chrom_sizes = dict((c,s) for c,s in index['chroms'])
+    blocks = index['blocks'][str(int(width))].get(chrom,[])
+
+    first = int(start) // int(width)
+    last = (int(end) - 1) // int(width)
+
+    bin_list = []
+    pdups_list = []
+
+    with open(track_file,'rb') as in_f:
+        for block_first,block_last,offset,length,n_bins in blocks:
+
+            if block_last < first or block_first > last:
+                continue
+
+            in_f.seek(offset)
+            payload = zlib.decompress(in_f.read(length))
+
+            bins = np.frombuffer(payload[:4*n_bins],dtype='<u4')
+            pdups = np.frombuffer(payload[4*n_bins:],dtype='<f8')
+
+            in_window = (bins >= first) & (bins <= last)
+            bin_list.append(bins[in_window].astype(np.int64))
+            pdups_list.append(pdups[in_window])
+
+    if not bin_list:
+        return pd.DataFrame(columns=colnames)
+
+    bins = np.concatenate(bin_list)
+
+    window_df = pd.DataFrame({'chrom': chrom,
+                              'start': bins * int(width),
+                              'end': np.minimum((bins + 1) * int(width),
+                                                chrom_sizes[chrom]),
+                              'pdups': np.concatenate(pdups_list)},
+                             columns=colnames)
+
+    return window_df
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Reads the bins of a binding track that overlap a window and writes
+    them as a bedGraph, reading only the blocks of the track that overlap
+    the window."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires a binding track written by post_alignment and a window'
+        'of the genome. Returns the pdups sum of each bin with signal in'
+        'the window as a bedGraph.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--track_file', action='store',
+                               required=True, help='The binding track of'
+                               'the repeat region')
+    requiredNamed.add_argument('-r', '--window', action='store',
+                               required=True, help='The window read, as'
+                               'chrom:start-end or chrom')
+    requiredNamed.add_argument('-o', '--out_file', action='store',
+                               required=True, help='The bedGraph file')
+    userInput.add_argument('-w', '--bin_width', action='store', default=None,
+                           type=int, help='The bin width of the zoom level'
+                           ' read; default is the finest level')
+
+    args = userInput.parse_args()
+
+    index = read_track_index(args.track_file)
+
+    print("zoom levels: %s" % index['zooms'])
+
+    if ':' in args.window:
+        chrom,coords = args.window.split(':')
+        start,end = [int(c) for c in coords.split('-')]
+    else:
+        chrom = args.window
+        start,end = 0,dict((c,s) for c,s in index['chroms'])[chrom]
+
+    window_df = fetch(args.track_file,chrom,start,end,args.bin_width,index)
+
+    window_df.to_csv(args.out_file, header=False, index=False, sep="\t")
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "bulk_probe_analysis"
+
+#import libraries
+import time
+import argparse
+import os
+import subprocess
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import alignment_filter as af
+import generate_alignments as gal
+import split_filter_region as sfr
+
+##############################################################################
+
+def bt2_batch_call(fq_file,sam_file,k_val,bowtie_idx,bowtie_string,
+                   seed_length,threads):
+    """
+    This function runs bowtie2 over a fastq file of many probes, keeping
+    the alignments of each probe together and in the order of the fastq
+
+    Parameters
+    ----------
+    fq_file : fastq file
+        fastq file of a batch of probe sequences
+    sam_file : sam file
+        the temp sam file to be generated
+    k_val : int
+        the max number of alignments to be returned per probe
+    bowtie_idx : path
+        the file path to the bt2 idx for a particular genome
+    bowtie_string : string
+        the string containing the params to run bowtie
+    seed_length : int
+        seed length when returning bt2 alignments
+    threads : int
+        number of bowtie2 threads
+
+    Returns
+    -------
+    sam_file : sam file
+        the temp sam file to be generated
+    """
+
+    subprocess.call(['bowtie2', '-x', bowtie_idx,
+         '-U', str(fq_file),
+         '-k',str(k_val),
+         bowtie_string,
+         '-S', str(sam_file),
+         '-L', str(seed_length),
+         '-p', str(max(1,threads)),
+         '--reorder'])
+
+    return sam_file
+
+##############################################################################
+
+def align_batch(probe_list,coords_list,bowtie_idx,bt2_k_val,seed_length,
+                threads):
+    """
+    This function aligns a batch of probes in a single bowtie2 call and
+    returns the pairwise alignments of every probe. Reads are named by the
+    probe coordinates, as in generate_alignments, so each probe returns the
+    same alignments as when aligned on its own.
+
+    Parameters
+    ----------
+    probe_list : list
+        probe sequences of the batch
+    coords_list : list
+        coordinates of each probe
+    bowtie_idx : string
+        the path to the bowtie index file
+    bt2_k_val : int
+        the max number of alignments to return per probe
+    seed_length : int
+        seed length when returning bt2 alignments
+    threads : int
+        number of bowtie2 threads
+
+    Returns
+    -------
+    pairwise_df : dataframe
+        probe coordinates, parent and derived sequence and alignment
+        position of each alignment
+    """
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        fastq_filename = tmpdir + '/batch.fastq'
+
+        with open(fastq_filename,'w') as fastq:
+            for probe_seq,probe_coords in zip(probe_list,coords_list):
+                fastq.write('@%s\n%s\n+\n%s\n' % (probe_coords,probe_seq,
+                                                  '~' * len(probe_seq)))
+
+        sam_file = bt2_batch_call(fastq_filename,tmpdir + '/derived.sam',
+                                  bt2_k_val,bowtie_idx,af.BOWTIE_STRING,
+                                  seed_length,threads)
+
+        bam_file = af.samtools_call(sam_file,tmpdir + '/derived.bam')
+
+        pairwise_file = tmpdir + '/derived.out'
+        with open(pairwise_file,'w') as pf:
+            pf.write(af.sam2pairwise_call(bam_file).decode('utf-8'))
+
+        pairwise_df,unique_df = gal.process_pairwise(pairwise_file)
+
+    return pairwise_df
+
+##############################################################################
+
+def init_worker(model_temp):
+    """
+    This function configures the NUPACK model once in each worker process
+    """
+
+    global NUPACK_MODEL
+    NUPACK_MODEL = af.nupack_model(model_temp)
+
+##############################################################################
+
+def score_pair(pair):
+    """
+    This function computes the pdups of a parent and derived sequence
+    """
+
+    parent,derived = pair
+
+    return af.pdups(parent,derived,af.STRAND_CONC_A,af.STRAND_CONC_B,
+                    NUPACK_MODEL)
+
+##############################################################################
+
+def add_pdups(pairwise_df,pdups_cache,pool):
+    """
+    This function adds the pdups of each alignment, scoring only the parent
+    and derived pairs not already in the pdups cache shared by all batches
+
+    Parameters
+    ----------
+    pairwise_df : dataframe
+        alignments of a batch of probes
+    pdups_cache : dictionary
+        parent and derived pair is key and pdups is value
+    pool : Pool
+        worker processes holding the NUPACK model
+
+    Returns
+    -------
+    pairwise_df : dataframe
+        alignments with the pdups of each alignment
+    n_scored : int
+        number of pairs scored for the batch
+    """
+
+    pairs = list(zip(pairwise_df['parent'].tolist(),
+                     pairwise_df['derived'].tolist()))
+
+    new_pairs = [pair for pair in dict.fromkeys(pairs)
+                 if pair not in pdups_cache]
+
+    if new_pairs:
+        pdups_cache.update(zip(new_pairs,pool.map(score_pair,new_pairs)))
+
+    pairwise_df['pdups'] = [pdups_cache[pair] for pair in pairs]
+
+    return pairwise_df,len(new_pairs)
+
+##############################################################################
+
+def classify_binding(pairwise_df,repeat_dict):
+    """
+    This function sums the pdups of the alignments of every probe that fall
+    within and outside of its repeat region, as computed for a single probe
+    by nupack_sum in alignment_filter
+
+    Parameters
+    ----------
+    pairwise_df : dataframe
+        alignments with pdups of a batch of probes
+    repeat_dict : dictionary
+        probe coordinates are key and repeat coordinates are value
+
+    Returns
+    -------
+    binding_df : dataframe
+        the on and off target pdups sums of each probe
+    """
+
+    repeat_coords = pairwise_df['probe_ID'].map(repeat_dict)
+    r_chrom = repeat_coords.str.split(':').str[0].values
+    r_start = repeat_coords.str.split(':').str[1].str.split('-').str[0]
+    r_end = repeat_coords.str.split('-').str[-1]
+
+    align_start = pairwise_df['align_start'].astype(int).values
+    align_end = align_start + pairwise_df['derived'].str.len().values
+
+    on_target = ((pairwise_df['align_chr'].values == r_chrom) &
+                 (align_start >= r_start.astype(int).values) &
+                 (align_end <= r_end.astype(int).values))
+
+    pdups = pairwise_df['pdups'].values.astype(float)
+
+    binding_df = pd.DataFrame({'probe_coords': pairwise_df['probe_ID'].values,
+                               'on_target_sum': np.where(on_target,pdups,0.0),
+                               'off_target_sum': np.where(on_target,0.0,
+                                                          pdups)})
+
+    return binding_df.groupby('probe_coords',sort=False).sum()
+
+##############################################################################
+
+def analyze_chrom(chrom_df,align_out,bowtie_idx,bt2_k_val,seed_length,
+                  threads,batch_size,pdups_cache,pool):
+    """
+    This function aligns and scores the probes of a scaffold in batches,
+    appending the alignments of each batch to the alignment file and
+    updating the on and off target binding of each probe
+
+    Parameters
+    ----------
+    chrom_df : dataframe
+        probes whose repeat region is on the scaffold
+    align_out : file
+        alignment file of the scaffold, as written by generate_alignments
+    batch_size : int
+        number of probes aligned in each bowtie2 call
+    pdups_cache : dictionary
+        parent and derived pair is key and pdups is value
+    pool : Pool
+        worker processes holding the NUPACK model
+
+    Returns
+    -------
+    chrom_df : dataframe
+        probes with the on target sum, off target sum and on target
+        proportion computed from their alignments
+    """
+
+    repeat_dict = dict(zip(chrom_df['probe_coords'],chrom_df['repeat_coords']))
+
+    #the alignment file is appended per batch, as per probe in generate_alignments
+    open(align_out,'w').close()
+
+    binding_list = []
+
+    for i in range(0,len(chrom_df),batch_size):
+
+        batch_df = chrom_df.iloc[i:i + batch_size]
+
+        pairwise_df = align_batch(batch_df['probe'].tolist(),
+                                  batch_df['probe_coords'].tolist(),
+                                  bowtie_idx,bt2_k_val,seed_length,threads)
+
+        pairwise_df,n_scored = add_pdups(pairwise_df,pdups_cache,pool)
+
+        pairwise_df.to_csv(align_out, header=False, index=False, sep="\t",
+                           mode='a')
+
+        binding_list.append(classify_binding(pairwise_df,repeat_dict))
+
+        print("%s probes, %s alignments, %s new pairs scored" % (
+            len(batch_df),len(pairwise_df),n_scored))
+
+    chrom_df = chrom_df.copy()
+
+    if binding_list:
+        binding_df = pd.concat(binding_list)
+        binding_df = binding_df.groupby(level=0,sort=False).sum()
+    else:
+        binding_df = pd.DataFrame(columns=['on_target_sum','off_target_sum'])
+
+    on_sum = chrom_df['probe_coords'].map(binding_df['on_target_sum'])
+    off_sum = chrom_df['probe_coords'].map(binding_df['off_target_sum'])
+
+    chrom_df['on_target_sum'] = on_sum.fillna(0.0).astype(float).values
+    chrom_df['off_target_sum'] = off_sum.fillna(0.0).astype(float).values
+
+    total = chrom_df['on_target_sum'] + chrom_df['off_target_sum']
+    chrom_df['on_target_prop'] = np.where(total > 0,
+                                          chrom_df['on_target_sum'] /
+                                          total.where(total > 0,1.0),0.0)
+
+    return chrom_df
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Scores a file of existing probes, such as an oligo library, in
+    probe_cand_binding mode. The probes of every scaffold are aligned in
+    batched bowtie2 calls and the pdups of each unique parent and derived
+    pair is computed once, by a pool of workers sharing one pdups cache
+    across batches and scaffolds. The on and off target binding of all
+    probes is then classified at once. For each scaffold the probe file
+    and alignment file of the split_filter_region and generate_alignments
+    jobs are written, with the binding columns of the probe file computed
+    from the alignments."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires a probe file in the alignment_filter format and the'
+        'bowtie2 index. Returns the probe file and alignment file of each'
+        'scaffold.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--file_path', action='store',
+                               required=True, help='The probe file of the'
+                               'probes to be scored')
+    requiredNamed.add_argument('-c', '--chroms', action='store', nargs='+',
+                               required=True, help='The scaffolds of the'
+                               'repeat regions of the probes')
+    requiredNamed.add_argument('-po', '--probe_dir', action='store',
+                               required=True, help='The directory where'
+                               'the probe file of each scaffold is written')
+    requiredNamed.add_argument('-ao', '--align_dir', action='store',
+                               required=True, help='The directory where'
+                               'the alignment file of each scaffold is'
+                               'written')
+    requiredNamed.add_argument('-b', '--bowtie_index', action='store',
+                               required=True, help='The path to the bowtie'
+                               'index to run the alignment algorithm')
+    requiredNamed.add_argument('-k', '--bt2_max_align', action='store',
+                               required=True, help='The max number of'
+                               'alignments to be returned by bowtie')
+    requiredNamed.add_argument('-l', '--seed_length', action='store',
+                               required=True, help='Seed length when'
+                               'returning bt2 alignments')
+    requiredNamed.add_argument('-t', '--model_temp', action='store',
+                               required=True, help='NUPACK model temp, (C)')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of bowtie2 threads and'
+                           ' pdups workers; default is 1')
+    userInput.add_argument('-bs', '--batch_size', action='store',
+                           default=1000, type=int, help='Number of probes'
+                           ' aligned in each bowtie2 call; default is 1000')
+
+    args = userInput.parse_args()
+
+    probe_df = sfr.read_probe_file(args.file_path)
+
+    for out_dir in [args.probe_dir,args.align_dir]:
+        af.create_dir(out_dir)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    pdups_cache = {}
+
+    with Pool(processes=max(1,args.threads),initializer=init_worker,
+              initargs=(args.model_temp,)) as pool:
+
+        for chrom in args.chroms:
+
+            chrom_df = probe_df[probe_df['repeat_coords'].str.contains(
+                str(chrom) + ":")]
+
+            align_out = os.path.join(args.align_dir,
+                                     "%s_probe_alignment.txt" % chrom)
+
+            chrom_df = analyze_chrom(chrom_df,align_out,args.bowtie_index,
+                                     args.bt2_max_align,args.seed_length,
+                                     args.threads,max(1,args.batch_size),
+                                     pdups_cache,pool)
+
+            chrom_df.to_csv(os.path.join(args.probe_dir,
+                                         "%s_probes.txt" % chrom),
+                            header=False, index=False, sep="\t")
+
+            print("%s: %s probes" % (chrom,len(chrom_df)))
+
+            print("---%s seconds ---"%(time.time()-start_time))
+
+    print("unique pairs scored: %s" % len(pdups_cache))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
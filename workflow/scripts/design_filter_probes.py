@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "design_filter_probes"
+
+#import libraries
+import time
+import argparse
+import os
+import shutil
+import tempfile
+import pandas as pd
+import design_probes as dp
+import kmer_filter as kf
+import probe_mer_filter as pmf
+import split_filter as sf
+
+##############################################################################
+
+def make_probe_df(probe_rows):
+    """
+    Builds the typed probe dataframe from the rows of designed probes, with
+    the columns and types read by kmer_filter from the design_probes file
+
+    Parameters
+    ----------
+    probe_rows : list
+        scaffold, start, stop, sequence, Tm and region of each probe
+
+    Returns
+    -------
+    probe_df : dataframe
+        dataframe of probes designed with labeled columns
+    """
+
+    colnames = ["chrom","p_start","p_stop","probe","Tm", "regions"]
+
+    probe_df = pd.DataFrame(probe_rows, columns=colnames)
+
+    probe_df = probe_df.astype({"p_start": int, "p_stop": int, "Tm": float})
+
+    probe_df = probe_df.drop_duplicates(subset=['probe'], keep='first')
+
+    return probe_df
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Runs design_probes, kmer_filter, probe_mer_filter and split_filter
+    within a single process. One probe dataframe is passed between the
+    steps, the k-mers of each probe are generated once and shared by the
+    k-mer count and shared k-mer filters, and only the probe file of each
+    repeat region is written.
+    """
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the bed file of repeat regions of a scaffold, the'
+        'genomic fasta reference and the jellyfish count file of the'
+        'scaffold. Returns the directory of filtered probes split by'
+        'repeat region.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+
+    requiredNamed.add_argument('-b', '--bed_name', action='store',
+                               required=True, help='The valid regions'
+                               'evaluated by Tigerfish as repetitive')
+    requiredNamed.add_argument('-r_o', '--region_out', action='store',
+                               required=True, help='Multi-entry fasta of'
+                               'mapped repetitive regions')
+    requiredNamed.add_argument('-g', '--genome_fasta', action='store',
+                               required=True, help='Genomic fasta reference'
+                               'used to generate region_out file')
+    requiredNamed.add_argument('-j', '--jf_file', action='store',
+                               required=True,help='The kmer count file'
+                               'from jellyfish')
+    requiredNamed.add_argument('-i', '--index_file', action='store',
+                               required=True, help='The index file of'
+                               'k-mer locations in the scaffold')
+    requiredNamed.add_argument('-c', '--chrom_name', action='store',
+                               required=True, help='The name of chromosome'
+                               'undergoing probe design')
+    requiredNamed.add_argument('-o', '--out_path', action='store',
+                               required=True, help='The directory where'
+                               'the split files will be located by repeat')
+    requiredNamed.add_argument('-l', '--min_len', action='store',
+                               required=True, help='min len of probe')
+    requiredNamed.add_argument('-L', '--max_len', action='store',
+                               required=True, help='max len of probe')
+    requiredNamed.add_argument('-t', '--min_temp', action='store',
+                               required=True, help='min Tm of probe')
+    requiredNamed.add_argument('-T', '--max_temp', action='store',
+                               required=True, help='max Tm of probe')
+    requiredNamed.add_argument('-m', '--merlength', action='store',
+                               default=18, type=int, help='The size of'
+                               'k-mers, should be same as jf build k-mer'
+                               'value; default is 18')
+    requiredNamed.add_argument('-c1', '--c1_value', action='store',
+                               required=True,type=int,help='weight 1 used'
+                               'to compute normalized binding score')
+    requiredNamed.add_argument('-c2', '--c2_value', action='store',
+                               required=True, type=int,help='weight 2 used'
+                               'to compute normalized binding score')
+    requiredNamed.add_argument('-e', '--enrich_score', action='store',
+                               required=True, type=float, help='The max #'
+                               'of times a given k-mer is found in a repeat'
+                               'region/entire HG')
+    requiredNamed.add_argument('-cn', '--copy_num', action='store',
+                               required=True, type=int, help='The minimum'
+                               'allowed number of times a k-mer is'
+                               'identified to be added to the final probe'
+                               'list')
+    requiredNamed.add_argument('-mc', '--mer_cutoff', action='store',
+                               required=True, type=float, help='The'
+                               'proportion of shared mers used to filter'
+                               'probes')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of chunks of probe start'
+                           ' positions scored, and of repeat regions counted'
+                           ' and filtered, at once; default is 1')
+    userInput.add_argument('-cs', '--chunk_size', action='store',
+                           default=1000000, type=int, help='The number of'
+                           ' probe start positions scored by each chunk, long'
+                           ' regions are split into several chunks; default'
+                           ' is 1000000')
+    userInput.add_argument('-dc', '--design_cache', action='store',
+                           default=None, help='The design cache directory,'
+                           ' probes of regions whose sequence and design are'
+                           ' unchanged are read from it; default is None')
+    userInput.add_argument('-ds', '--design_stats', action='store',
+                           default=None, help='File the number of regions'
+                           ' reused from and added to the design cache is'
+                           ' written to; default is None')
+    userInput.add_argument('-cb', '--candidate_budget', action='store',
+                           default=0, type=int, help='The max number of'
+                           ' candidate probes kept in each repeat region, 0'
+                           ' keeps every candidate; default is 0')
+    userInput.add_argument('-bs', '--budget_strata', action='store',
+                           default=10, type=int, help='The number of windows'
+                           ' across each repeat region the candidate budget'
+                           ' is spread over; default is 10')
+    userInput.add_argument('-bo', '--budget_out', action='store',
+                           default=None, help='File of candidates dropped'
+                           ' and lowest kept and highest dropped score of'
+                           ' each repeat region; default is None')
+
+    args = userInput.parse_args()
+    bed = args.bed_name
+    region_fa = args.region_out
+    genome_fa = args.genome_fasta
+    jf_file = args.jf_file
+    index_file = args.index_file
+    name = args.chrom_name
+    out_path = args.out_path
+    MERLENGTH = args.merlength
+
+    #design probes against each repeat region
+    dp.make_fasta_from_bed(bed,region_fa,genome_fa,name)
+
+    dict_name_seq = dp.read_region_fasta(region_fa)
+
+    probe_rows = dp.design_region_probes(dict_name_seq,name,args.min_len,
+                                         args.min_temp,args.max_len,
+                                         args.max_temp,args.threads,
+                                         args.chunk_size,args.design_cache,
+                                         args.design_stats)
+
+    probe_df = make_probe_df(probe_rows)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    seq_dict = {region : seq.upper() for region,seq in dict_name_seq.items()}
+
+    #memory mapped arrays are kept next to the split files
+    tmp_dir = tempfile.mkdtemp(prefix="kmer_filter_",
+                               dir=os.path.dirname(os.path.abspath(out_path)))
+
+    genome_counts = kf.genome_count_prefix(jf_file,index_file,name,MERLENGTH,
+                                           tmp_dir,10000000)
+
+    #the k-mer codes of each probe are shared by both k-mer filters
+    probe_codes = {}
+
+    all_repeat_counts,all_genome_counts = kf.repeat_count(probe_df,seq_dict,
+                                                          genome_counts,
+                                                          MERLENGTH,
+                                                          args.threads,
+                                                          probe_codes)
+
+    del genome_counts
+    shutil.rmtree(tmp_dir)
+
+    probe_df = kf.append_probe_df(probe_df,all_repeat_counts,
+                                  all_genome_counts)
+
+    probe_df = kf.compute_normalized_binding(probe_df,args.c1_value,
+                                             args.c2_value)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    #rename columns to those read by probe_mer_filter
+    probe_df.columns = ["chrom","p_start","p_end","probe","Tm","region",
+                        "r_count_total","h_count_total","k_score","k_norm"]
+    probe_df = probe_df.reset_index(drop=True)
+
+    region_df = pmf.filter_region(probe_df,args.enrich_score,args.copy_num)
+
+    #drop candidates beyond the budget before the shared k-mer filter
+    if args.candidate_budget > 0:
+
+        region_df,budget_df = pmf.budget_candidates(region_df,
+                                                    args.candidate_budget,
+                                                    args.budget_strata)
+
+        print("candidate budget: %s probes dropped" %
+              budget_df['dropped'].sum())
+
+        if args.budget_out is not None:
+            pmf.write_budget(budget_df,args.budget_out)
+
+    region_df = pmf.split_mers(region_df,MERLENGTH,probe_codes)
+
+    region_df = pmf.rm_shared_mer_probes(region_df,args.mer_cutoff,
+                                         args.threads)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    sf.split_file(region_df.reset_index(drop=True),out_path)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,10 @@ script_name = "design_probes"
 import time
 import argparse
 import subprocess
+import hashlib
+import os
+import tempfile
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 import refactoredBlockparse as bp
@@ -55,30 +59,170 @@ def make_fasta_from_bed(bed, region_fa, genome_fa, name):
     subprocess.call(['bedtools', 'getfasta', '-fi', genome_fa, '-bed',
                      bed, '-fo', region_fa], stderr=None, shell=False)
 
+#blockparse settings other than probe length and Tm used by make_crawler:
+#GC range, nearest neighbor table, prohibited sequences, sodium, formamide,
+#spacing and strand concentrations
+CRAWLER_SETTINGS = (20, 80, 'DNA_NN3', 'AAAAA,TTTTT,CCCCC,GGGGG', 390, 50, 0,
+                    25, 25)
+
+#version of the scan engine and cache file format, part of every design
+#cache key. Raise it whenever scanPositions, placeProbes or the cache file
+#layout changes, so probes placed by an older engine are not reused
+DESIGN_CACHE_VERSION = 2
+
 ##############################################################################
 
-def blockParse_run(region_fa,name,probe_out,min_len,min_temp,max_len,max_temp):
+def make_crawler(sequence,header,name,min_len,min_temp,max_len,max_temp):
     """
-    This function takes the provided fasta seqs derived from the bed file
-    and passes each repeat seq into the refactoredBlockParse script from
-    Oligominer. Here, probes are written and appended to an output dataframe.
-    runSequenceCrawler is run using parameters described in Oligominer for 
-    default probe generation. 
+    Builds a SequenceCrawler from the refactoredBlockParse script using the
+    parameters described in Oligominer for default probe generation.
 
     Parameters
     ----------
-    region_fa: fasta file
-    Contains fasta sequences from derived repeat regions
+    sequence: string
+    Sequence of the repeat region, or of a chunk of it.
+
+    header: string
+    The header of the fasta repeat the sequence was taken from.
 
     name: string
-    The header of each fasta repeat becomes a column specifying repeat name
-    that each probe was derived from.
+    The name of chromosome undergoing probe design.
 
     Returns
     -------
-    probe_out: tsv file
-    The output file name containing all designed probes for all provided
-    repeat region fasta sequences.
+    crawler: SequenceCrawler
+    Crawler scanning the provided sequence.
+    """
+
+    gc_min,gc_max,nn_table,prohibited,sal,form,sp,conc1,conc2 = \
+        CRAWLER_SETTINGS
+
+    return bp.SequenceCrawler(sequence,header,name, int(min_len), int(max_len),
+                              gc_min, gc_max, getattr(mt,nn_table),
+                              int(min_temp), int(max_temp), prohibited, sal,
+                              form, sp, conc1, conc2, None, True ,False,
+                              False, False, False, False, None)
+
+##############################################################################
+
+def design_cache_file(design_cache,sequence,min_len,min_temp,max_len,
+                      max_temp):
+    """
+    Returns the file of the design cache that holds the probes placed along
+    a repeat region sequence. Files are named by a hash of the sequence,
+    the probe length and Tm bounds, the blockparse settings and the design
+    cache version, so a region is only crawled again when its sequence, the
+    design or the scan engine changes.
+
+    Parameters
+    ----------
+    design_cache: string
+    The design cache directory.
+
+    sequence: string
+    Sequence of the repeat region.
+
+    Returns
+    -------
+    cache_file: string
+    Path of the cache file for the region.
+    """
+
+    design_key = "|".join(["v%s" % DESIGN_CACHE_VERSION,
+                           str(int(min_len)),str(int(max_len)),
+                           str(int(min_temp)),str(int(max_temp))] +
+                          [str(setting) for setting in CRAWLER_SETTINGS])
+
+    cache_key = hashlib.sha1((design_key + "|" + sequence).encode()).hexdigest()
+
+    return os.path.join(design_cache,cache_key[:2],cache_key + ".tsv")
+
+##############################################################################
+
+def read_design_cache(cache_file):
+    """
+    Reads the probes of a repeat region from the design cache, as tuples of
+    start, end, sequence and Tm relative to the region.
+    """
+
+    with open(cache_file) as f:
+        return [(int(start), int(end), seq, tm_val) for start,end,seq,tm_val
+                in (line.rstrip("\n").split("\t") for line in f)]
+
+##############################################################################
+
+def write_design_cache(cache_file,cands):
+    """
+    Writes the probes of a repeat region to the design cache. The file is
+    written under a temp name first so no run reads a partial file.
+    """
+
+    if not os.path.exists(os.path.dirname(cache_file)):
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(cache_file),
+                                     suffix=".tmp", delete=False) as tmp_f:
+        for cand in cands:
+            tmp_f.write("%s\t%s\t%s\t%s\n" % tuple(cand))
+
+    os.replace(tmp_f.name,cache_file)
+
+##############################################################################
+
+def write_design_stats(stats_file,name,n_hits,n_misses):
+    """
+    Writes the number of repeat regions of a scaffold whose probes were read
+    from the design cache and the number that were crawled, so the cache
+    use of each run is kept next to its designed probes.
+    """
+
+    with open(str(stats_file), 'w') as f:
+        f.write("chrom\tregions_reused\tregions_crawled\n")
+        f.write("%s\t%s\t%s\n" % (name,n_hits,n_misses))
+
+##############################################################################
+
+def scan_chunk(task):
+    """
+    Scores the probe start positions of one chunk of a repeat region. The
+    chunk sequence runs max_len bases past its last start so every probe
+    starting in the chunk is evaluated, making each start independent of
+    the chunk it falls in.
+
+    Parameters
+    ----------
+    task: tuple
+    The chunk sequence, header of the region, number of starts to score,
+    length of the region from the chunk start and the design parameters.
+
+    Returns
+    -------
+    scan: tuple
+    Arrays from SequenceCrawler.scanRange for the starts of the chunk.
+    """
+
+    sequence,header,n_starts,block_len,design_params = task
+
+    crawler = make_crawler(sequence,header,*design_params)
+
+    return crawler.scanRange(0,n_starts,block_len)
+
+##############################################################################
+
+def read_region_fasta(region_fa):
+    """
+    Reads the fasta sequences derived from the bed file into a dictionary.
+
+    Parameters
+    ----------
+    region_fa: fasta file
+    Contains fasta sequences from derived repeat regions
+
+    Returns
+    -------
+    dict_name_seq: dictionary
+    The header of each fasta repeat as key and its sequence as value, in
+    fasta order.
     """
 
     name_list = []
@@ -97,16 +241,151 @@ def blockParse_run(region_fa,name,probe_out,min_len,min_temp,max_len,max_temp):
     #then make into a dict
     zipped_list=zip(name_list,sequence_list)
     dict_name_seq=dict(zipped_list)
-    
-    #then run each item in the dict into the refactored blockParse script
-    #which can now handle multi-lined fastas
-    for names,sequences in dict_name_seq.items():
-        
-        probes=bp.runSequenceCrawler(sequences,names,name, int(min_len), int(max_len), 20, 80, 
-                                     mt.DNA_NN3, int(min_temp), int(max_temp),
-                                     'AAAAA,TTTTT,CCCCC,GGGGG', 390, 50, 0,
-                                     25, 25, None, True ,False, False, False,
-                                     False, False,(str(probe_out)))
+
+    return dict_name_seq
+
+##############################################################################
+
+def design_region_probes(dict_name_seq,name,min_len,min_temp,max_len,max_temp,
+                         threads=1,chunk_size=1000000,design_cache=None,
+                         stats_file=None):
+    """
+    This function passes each repeat seq into the refactoredBlockParse
+    script from Oligominer. Regions are split into chunks of start positions
+    that are scored by a pool of workers, then probes are placed along each
+    whole region in region order, giving the same probes as a serial scan.
+
+    Parameters
+    ----------
+    dict_name_seq: dictionary
+    The header of each fasta repeat as key and its sequence as value.
+
+    name: string
+    The name of chromosome undergoing probe design.
+
+    threads: int
+    Number of chunks scored at once.
+
+    chunk_size: int
+    Number of probe start positions scored by each chunk.
+
+    design_cache: string
+    Optional design cache directory. Regions found in the cache are not
+    crawled, and the probes of the other regions are added to it.
+
+    stats_file: string
+    Optional file the number of regions reused from and added to the design
+    cache is written to.
+
+    Returns
+    -------
+    probe_rows: list
+    The scaffold, start, stop, sequence, Tm and region of each probe.
+    """
+
+    design_params = (name,min_len,min_temp,max_len,max_temp)
+
+    crawlers = [make_crawler(sequences,names,*design_params)
+                for names,sequences in dict_name_seq.items()]
+
+    #probes of regions whose sequence and design are unchanged are reused
+    region_cands = [None for crawler in crawlers]
+    cache_files = [None for crawler in crawlers]
+    if design_cache is not None:
+        for region,crawler in enumerate(crawlers):
+            cache_files[region] = design_cache_file(design_cache,
+                                                    crawler.block,min_len,
+                                                    min_temp,max_len,max_temp)
+            if os.path.exists(cache_files[region]):
+                region_cands[region] = read_design_cache(cache_files[region])
+
+    #split the start positions of each region into chunks, keeping the
+    #region each chunk belongs to
+    tasks = []
+    task_region = []
+    for region,crawler in enumerate(crawlers):
+        if region_cands[region] is not None:
+            continue
+        block_len = len(crawler.block)
+        n_starts = max(block_len - int(min_len), 0)
+        for first in range(0,n_starts,chunk_size):
+            last = min(first + chunk_size,n_starts)
+            tasks.append((crawler.block[first:last + int(max_len)],
+                          crawler.fasta_scaffold,last - first,
+                          block_len - first,design_params))
+            task_region.append(region)
+
+    region_scans = [[] for crawler in crawlers]
+
+    with Pool(processes=max(1,threads)) as pool:
+        for region,scan in zip(task_region,pool.imap(scan_chunk,tasks)):
+            region_scans[region].append(scan)
+
+    #probes are placed along each region in the parent so that the spacing
+    #between probes carries across chunk boundaries
+    probe_rows = []
+    n_hits = 0
+    n_misses = 0
+    for crawler,scans,cands,cache_file in zip(crawlers,region_scans,
+                                              region_cands,cache_files):
+        chrom = crawler.parseHeader()
+        if cands is not None:
+            n_hits += 1
+        else:
+            if scans:
+                cands = crawler.placeProbes(*(np.concatenate(vals)
+                                              for vals in zip(*scans)))
+            else:
+                cands = []
+            if cache_file is not None:
+                n_misses += 1
+                write_design_cache(cache_file,cands)
+        probe_rows.extend(crawler.probeRows(chrom,cands))
+
+    if design_cache is not None:
+        print("design cache: %s regions reused, %s regions crawled" %
+              (n_hits,n_misses))
+        if stats_file is not None:
+            write_design_stats(stats_file,name,n_hits,n_misses)
+
+    return probe_rows
+
+##############################################################################
+
+def blockParse_run(region_fa,name,probe_out,min_len,min_temp,max_len,max_temp,
+                   threads=1,chunk_size=1000000,design_cache=None,
+                   stats_file=None):
+    """
+    This function takes the provided fasta seqs derived from the bed file
+    and designs probes against each repeat seq with design_region_probes.
+    Probes of all regions are written to one output file in region order.
+
+    Parameters
+    ----------
+    region_fa: fasta file
+    Contains fasta sequences from derived repeat regions
+
+    name: string
+    The header of each fasta repeat becomes a column specifying repeat name
+    that each probe was derived from.
+
+    Returns
+    -------
+    probe_out: tsv file
+    The output file name containing all designed probes for all provided
+    repeat region fasta sequences.
+    """
+
+    dict_name_seq = read_region_fasta(region_fa)
+
+    probe_rows = design_region_probes(dict_name_seq,name,min_len,min_temp,
+                                      max_len,max_temp,threads,chunk_size,
+                                      design_cache,stats_file)
+
+    output_df = pd.DataFrame(probe_rows)
+
+    with open(str(probe_out), 'w') as f:
+        output_df.to_csv(f, sep='\t',header=None, index=False)
         
 ##############################################################################
 
@@ -151,6 +430,22 @@ def main():
                                required=True, help='min Tm of probe')
     requiredNamed.add_argument('-T', '--max_temp', action='store',
                                required=True, help='max Tm of probe')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of chunks of probe start'
+                           ' positions scored at once; default is 1')
+    userInput.add_argument('-cs', '--chunk_size', action='store',
+                           default=1000000, type=int, help='The number of'
+                           ' probe start positions scored by each chunk, long'
+                           ' regions are split into several chunks; default'
+                           ' is 1000000')
+    userInput.add_argument('-dc', '--design_cache', action='store',
+                           default=None, help='The design cache directory,'
+                           ' probes of regions whose sequence and design are'
+                           ' unchanged are read from it; default is None')
+    userInput.add_argument('-ds', '--design_stats', action='store',
+                           default=None, help='File the number of regions'
+                           ' reused from and added to the design cache is'
+                           ' written to; default is None')
     
     args = userInput.parse_args()
     bed = args.bed_name
@@ -162,13 +457,18 @@ def main():
     max_len = args.max_len
     min_temp = args.min_temp
     max_temp = args.max_temp
+    threads = args.threads
+    chunk_size = args.chunk_size
+    design_cache = args.design_cache
+    stats_file = args.design_stats
     
     
     make_fasta_from_bed(bed,region_fa,genome_fa,name)
 
     print("---%s seconds ---"%(time.time()-start_time))
 
-    blockParse_run(region_fa,name,probe_out,min_len,min_temp,max_len,max_temp)
+    blockParse_run(region_fa,name,probe_out,min_len,min_temp,max_len,max_temp,
+                   threads,chunk_size,design_cache,stats_file)
     
     print("---%s seconds ---"%(time.time()-start_time))
 
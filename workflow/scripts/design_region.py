@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "design_region"
+
+#import libraries
+import time
+import argparse
+import os
+import sys
+import shutil
+import tempfile
+import pandas as pd
+from Bio import SeqIO
+import design_probes as dp
+import design_filter_probes as dfp
+import kmer_filter as kf
+import probe_mer_filter as pmf
+import alignment_filter as af
+import post_alignment as pa
+
+#the config.yml parameters used to design and filter the probes of a region,
+#with the values of the example runs. The type of each value is the type
+#main parses it as, so float valued parameters keep a float default
+DEFAULT_PARAMS = {"min_length": 25, "max_length": 50, "min_temp": 42,
+                  "max_temp": 52, "mer_val": 18, "c1_val": 1, "c2_val": 5,
+                  "candidate_budget": 0, "enrich_score": 0.70,
+                  "copy_num": 40, "mer_cutoff": 0.95,
+                  "genome_windows": 5000000, "thresh_window": 100000,
+                  "binding_prop": 0.70, "off_bin_thresh": 100,
+                  "target_sum": 20000, "bt2_alignments": 500000,
+                  "max_pdups_binding": 0.90, "seed_length": 15,
+                  "model_temp": 69.5, "min_on_target": 25,
+                  "max_probe_return": 20, "time_budget": 0.0,
+                  "align_thresh": 10}
+
+##############################################################################
+
+def read_chrom_sizes(chrom_sizes_file):
+    """
+    This function reads the scaffold sizes file of an assembly
+
+    Parameters
+    ----------
+    chrom_sizes_file : file
+        scaffold name and size of each scaffold
+
+    Returns
+    -------
+    chrom_sizes : dictionary
+        scaffold is key and its size is value, in file order
+    """
+
+    sizes_df = pd.read_csv(chrom_sizes_file, names=["chrom","size"],
+                           header=None, sep='\t', dtype={"chrom": str})
+
+    return dict(zip(sizes_df['chrom'],sizes_df['size'].astype(int)))
+
+##############################################################################
+
+def parse_region(region):
+    """
+    This function splits a region given as chrom:start-end
+
+    Parameters
+    ----------
+    region : string
+        the target region
+
+    Returns
+    -------
+    chrom : string
+        scaffold of the region
+    start : int
+        start of the region
+    end : int
+        end of the region
+    """
+
+    chrom,coords = region.strip().rsplit(':',1)
+    start,end = coords.replace(',','').split('-')
+
+    if int(end) <= int(start):
+        raise ValueError("Region %s ends before it starts" % region)
+
+    return chrom,int(start),int(end)
+
+##############################################################################
+
+class DesignSession:
+    """
+    Designs and filters the probes of single target regions of an assembly
+    within one process. The scaffold sequences, k-mer count arrays, NUPACK
+    models, genome bins and alignments read or computed by one region are
+    kept for the regions that follow, so repeated queries on the same
+    assembly skip the work already done.
+
+    Parameters
+    ----------
+    genome_fasta : string
+        genome fasta, or directory of scaffold fasta files named chrom.fa
+    jf_path : string
+        jellyfish query file, or directory of chrom_jf_temp.txt files
+    index_path : string
+        k-mer index file, or directory of chrom_index.txt files
+    bowtie_idx : string
+        the path to the bowtie2 index of the assembly
+    chrom_sizes_file : file
+        scaffold sizes of the assembly
+    work_dir : string
+        directory of the design and alignment caches of the session
+    params : dictionary
+        config.yml parameters overriding DEFAULT_PARAMS
+    threads : int
+        number of workers used to design and filter probes
+    """
+
+    def __init__(self,genome_fasta,jf_path,index_path,bowtie_idx,
+                 chrom_sizes_file,work_dir,params=None,threads=1):
+
+        self.genome_fasta = genome_fasta
+        self.jf_path = jf_path
+        self.index_path = index_path
+        self.bowtie_idx = bowtie_idx
+        self.threads = threads
+
+        self.params = dict(DEFAULT_PARAMS)
+        if params is not None:
+            self.params.update(params)
+
+        af.create_dir(work_dir)
+        self.design_cache = af.create_dir(os.path.join(work_dir,
+                                                       "design_cache"))
+        self.align_cache_dir = af.create_dir(os.path.join(work_dir,
+                                                          "align_cache"))
+        self.tmp_dir = tempfile.mkdtemp(prefix="design_region_",dir=work_dir)
+
+        #genome bins of the alignment filter and the binding summary
+        self.chrom_sizes = read_chrom_sizes(chrom_sizes_file)
+        self.filter_bins = (self.chrom_sizes,
+                            int(self.params["genome_windows"]))
+
+        self.fasta_index = {}
+        self.scaffolds = {}
+        self.genome_counts = {}
+        self.models = {}
+
+    def scaffold_seq(self,chrom):
+        """
+        Returns the sequence of a scaffold, read once from the genome fasta
+        """
+
+        if chrom not in self.scaffolds:
+
+            if os.path.isdir(self.genome_fasta):
+                fasta_file = os.path.join(self.genome_fasta,chrom + ".fa")
+            else:
+                fasta_file = self.genome_fasta
+
+            if fasta_file not in self.fasta_index:
+                self.fasta_index[fasta_file] = SeqIO.index(fasta_file,"fasta")
+
+            self.scaffolds[chrom] = str(self.fasta_index[fasta_file][chrom].seq)
+
+        return self.scaffolds[chrom]
+
+    def kmer_counts(self,chrom):
+        """
+        Returns the k-mer positions and genome count prefix sum of a
+        scaffold, built once from its jellyfish query and index files
+        """
+
+        if chrom not in self.genome_counts:
+            self.genome_counts[chrom] = kf.genome_count_prefix(
+                self.jf_path,self.index_path,chrom,
+                int(self.params["mer_val"]),self.tmp_dir,10000000)
+
+        return self.genome_counts[chrom]
+
+    def nupack_model(self):
+        """
+        Returns the NUPACK model at the model temperature of the session
+        """
+
+        model_temp = float(self.params["model_temp"])
+
+        if model_temp not in self.models:
+            self.models[model_temp] = af.nupack_model(model_temp)
+
+        return self.models[model_temp]
+
+    def align_cache(self):
+        """
+        Returns the alignment cache of the session, keyed by the alignment
+        and model settings
+        """
+
+        return (self.align_cache_dir,
+                af.alignment_cache_tag(self.bowtie_idx,af.BOWTIE_STRING,
+                                       self.params["bt2_alignments"],
+                                       self.params["seed_length"],
+                                       self.params["model_temp"]))
+
+    def candidate_probes(self,region):
+        """
+        Designs the probes of a region and filters them by k-mer counts and
+        shared k-mers, as in design_filter_probes
+
+        Parameters
+        ----------
+        region : string
+            the target region, as chrom:start-end
+
+        Returns
+        -------
+        region_df : dataframe
+            the filtered candidate probes of the region, rank sorted
+        """
+
+        p = self.params
+        chrom,start,end = parse_region(region)
+        mer_len = int(p["mer_val"])
+
+        region_name = "%s:%s-%s" % (chrom,start,end)
+        dict_name_seq = {region_name: self.scaffold_seq(chrom)[start:end]}
+
+        probe_rows = dp.design_region_probes(dict_name_seq,chrom,
+                                             p["min_length"],p["min_temp"],
+                                             p["max_length"],p["max_temp"],
+                                             self.threads,1000000,
+                                             self.design_cache)
+
+        probe_df = dfp.make_probe_df(probe_rows)
+
+        if len(probe_df) == 0:
+            return probe_df
+
+        seq_dict = {name : seq.upper() for name,seq in dict_name_seq.items()}
+
+        probe_codes = {}
+
+        all_repeat_counts,all_genome_counts = kf.repeat_count(
+            probe_df,seq_dict,self.kmer_counts(chrom),mer_len,self.threads,
+            probe_codes)
+
+        probe_df = kf.append_probe_df(probe_df,all_repeat_counts,
+                                      all_genome_counts)
+
+        probe_df = kf.compute_normalized_binding(probe_df,p["c1_val"],
+                                                 p["c2_val"])
+
+        probe_df.columns = ["chrom","p_start","p_end","probe","Tm","region",
+                            "r_count_total","h_count_total","k_score",
+                            "k_norm"]
+        probe_df = probe_df.reset_index(drop=True)
+
+        region_df = pmf.filter_region(probe_df,float(p["enrich_score"]),
+                                      int(p["copy_num"]))
+
+        if int(p["candidate_budget"]) > 0:
+            region_df,budget_df = pmf.budget_candidates(
+                region_df,int(p["candidate_budget"]),10)
+
+        region_df = pmf.split_mers(region_df,mer_len,probe_codes)
+
+        region_df = pmf.rm_shared_mer_probes(region_df,float(p["mer_cutoff"]),
+                                             self.threads)
+
+        return region_df.reset_index(drop=True)
+
+    def design(self,region,out_dir):
+        """
+        Designs the final probes of a region. Candidates are designed and
+        filtered, passed through alignment_filter, and the alignments of
+        the kept probes are summarized into the binding and probe files of
+        the region, as in post_alignment.
+
+        Parameters
+        ----------
+        region : string
+            the target region, as chrom:start-end
+        out_dir : string
+            directory the files of the region are written to
+
+        Returns
+        -------
+        probe_df : dataframe
+            the final probes of the region with their imaging target region
+            and on and off target binding, empty if no probe is kept
+        """
+
+        p = self.params
+        chrom,start,end = parse_region(region)
+        region_name = "%s:%s-%s" % (chrom,start,end)
+
+        af.create_dir(out_dir)
+        out_prefix = os.path.join(out_dir,region_name)
+
+        region_df = self.candidate_probes(region_name)
+
+        probe_cols = ["probe_coords","repeat_coords","align_region_coords",
+                      "probe","Tm","r_count","h_count","k_prop","rank",
+                      "on_target_sum","off_target_sum","on_target_prop"]
+
+        if len(region_df) == 0:
+            print("%s: no candidate probes" % region_name)
+            return pd.DataFrame(columns=probe_cols)
+
+        #candidate file in the make_chrom_dir format read by alignment_filter
+        cand_file = out_prefix + ".txt"
+        region_df.to_csv(cand_file, header=False, index=False, sep="\t")
+
+        probe_df = af.read_probe_filter(cand_file)
+
+        align_cache = self.align_cache()
+
+        filter_out = af.filter_thresh(probe_df,af.STRAND_CONC_A,
+                                      af.STRAND_CONC_B,self.bowtie_idx,
+                                      int(p["target_sum"]),af.BOWTIE_STRING,
+                                      self.nupack_model(),
+                                      p["bt2_alignments"],
+                                      p["max_pdups_binding"],
+                                      p["seed_length"],
+                                      p["max_probe_return"],
+                                      p["min_on_target"],self.filter_bins,
+                                      p["off_bin_thresh"],p["binding_prop"],
+                                      0,None,align_cache,
+                                      p["time_budget"])
+
+        filter_file = out_prefix + "_alignment.txt"
+        af.generate_final_df(probe_df,*filter_out,filter_file,0)
+
+        keep_probe_names_list = filter_out[5]
+
+        print("%s: %s candidates, %s probes kept" % (region_name,
+                                                     len(probe_df),
+                                                     len(keep_probe_names_list)))
+
+        if not keep_probe_names_list:
+            return pd.DataFrame(columns=probe_cols)
+
+        #alignments of the kept probes are read back from the alignment cache
+        kept_df = probe_df.loc[probe_df['probe_coords'].isin(
+            keep_probe_names_list)]
+
+        align_list = []
+        for probe,coords in zip(kept_df['probe'].tolist(),
+                                kept_df['probe_coords'].tolist()):
+            align_list.append(af.cached_pairwise_df(
+                probe,coords,self.bowtie_idx,af.BOWTIE_STRING,
+                af.STRAND_CONC_A,af.STRAND_CONC_B,self.nupack_model(),
+                p["bt2_alignments"],p["seed_length"],0,align_cache))
+
+        pairs_pdups = pd.concat(align_list, ignore_index=True)
+        pairs_pdups = pairs_pdups[['probe_ID','parent','derived','align_chr',
+                                   'align_start','pdups']]
+        pairs_pdups.columns = ["align_coords","parent","derived",
+                               "derived_chrom","align_start","pdups"]
+        pairs_pdups['align_start'] = pairs_pdups['align_start'].astype(int)
+
+        pairs_pdups.to_csv(out_prefix + "_probe_alignment.txt", header=False,
+                           index=False, sep="\t")
+
+        repeat_name,repeat_bed = pa.read_repeat_bed(filter_file)
+
+        pa.summarize_region(pairs_pdups,repeat_name,repeat_bed,filter_file,
+                            self.chrom_sizes,int(p["thresh_window"]),
+                            p["align_thresh"],
+                            out_prefix + "_alignment_binding.txt",
+                            out_prefix + "_thresh_binding.txt",
+                            out_prefix + "_probes.txt",
+                            out_prefix + "_binding_summ.txt")
+
+        probe_df = pd.read_csv(out_prefix + "_probes.txt", sep="\t",
+                               names=probe_cols)
+
+        return probe_df
+
+    def close(self):
+        """
+        Removes the k-mer count arrays of the session
+        """
+
+        self.genome_counts = {}
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Designs the final probes of single chrom:start-end target regions
+    within one process, running probe design, k-mer filtering, shared k-mer
+    filtering, alignment_filter and the binding summary of post_alignment
+    without the Snakemake workflow. Regions are read from the command line,
+    or one per line from stdin, and the session keeps its scaffold
+    sequences, k-mer counts, NUPACK model, genome bins and alignments
+    between regions."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the genome fasta, jellyfish query and index files and'
+        'bowtie2 index of an assembly. Returns the final probes and binding'
+        'summaries of each target region.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-g', '--genome_fasta', action='store',
+                               required=True, help='The genome fasta, or'
+                               'directory of scaffold fasta files')
+    requiredNamed.add_argument('-j', '--jf_path', action='store',
+                               required=True, help='The jellyfish query'
+                               'file, or directory of query files')
+    requiredNamed.add_argument('-i', '--index_path', action='store',
+                               required=True, help='The k-mer index file,'
+                               'or directory of index files')
+    requiredNamed.add_argument('-b', '--bowtie_index', action='store',
+                               required=True, help='The path to the bowtie'
+                               'index to run the alignment algorithm')
+    requiredNamed.add_argument('-cs', '--chrom_sizes', action='store',
+                               required=True, help='The scaffold sizes'
+                               'file of the assembly')
+    requiredNamed.add_argument('-o', '--out_dir', action='store',
+                               required=True, help='The directory the files'
+                               'of each region are written to')
+    userInput.add_argument('-r', '--regions', action='store', nargs='+',
+                           default=None, help='Target regions as'
+                           ' chrom:start-end, read from stdin if not given;'
+                           ' default is None')
+    userInput.add_argument('-w', '--work_dir', action='store',
+                           default='design_region_cache', help='Directory'
+                           ' of the design and alignment caches, kept'
+                           ' between sessions; default is'
+                           ' design_region_cache')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of workers used to design'
+                           ' and filter probes; default is 1')
+
+    for key,value in DEFAULT_PARAMS.items():
+        userInput.add_argument('--' + key, action='store', default=value,
+                               type=type(value), help='The %s config.yml'
+                               ' parameter; default is %s' % (key,value))
+
+    args = userInput.parse_args()
+
+    params = {key: getattr(args,key) for key in DEFAULT_PARAMS}
+
+    session = DesignSession(args.genome_fasta,args.jf_path,args.index_path,
+                            args.bowtie_index,args.chrom_sizes,
+                            args.work_dir,params,args.threads)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    if args.regions is not None:
+        regions = args.regions
+    else:
+        regions = (line for line in sys.stdin if line.strip())
+
+    try:
+        for region in regions:
+
+            region_time = time.time()
+
+            probe_df = session.design(region,args.out_dir)
+
+            print(probe_df.to_string(index=False))
+
+            print("---%s seconds ---"%(time.time()-region_time))
+
+            sys.stdout.flush()
+    finally:
+        session.close()
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
@@ -339,6 +339,58 @@ def generate_index_file(normal_ranges,index_out):
 
 ##############################################################################
 
+def compute_index_ranges(sequence,mer_l):
+    """
+    This function finds the same index ranges as map_coords(),
+    group_ranges(), create_df_ranges() and subtract_kmer_length() directly
+    from an array of sequence bytes, without building per base lists
+
+    Parameters
+    ----------
+    sequence : array
+        uint8 array of the scaffold sequence, as read from a buffer
+    mer_l : int
+        length of k-mers queried
+
+    Returns
+    -------
+    range_starts : array
+        start of each continuous range of ATCG bases
+    range_ends : array
+        last index value written for each range, so that each range
+        contributes range_starts..range_ends inclusive to the index file
+    """
+
+    #lower case the bytes so that soft masked bases are kept
+    lower_seq = np.bitwise_or(np.asarray(sequence,dtype=np.uint8),0x20)
+
+    is_base = np.isin(lower_seq,np.frombuffer(b"atcg",dtype=np.uint8))
+    is_n = (lower_seq == ord("n"))
+
+    def runs(mask):
+        edges = np.diff(np.concatenate([[0],mask.view(np.int8),[0]]))
+        return np.flatnonzero(edges == 1),np.flatnonzero(edges == -1)
+
+    range_starts,range_ends = runs(is_base)
+    n_starts,_ = runs(is_n)
+
+    #the range directly before an N range is shortened by the k-mer length
+    all_starts = np.concatenate([range_starts,n_starts])
+    is_n_range = np.concatenate([np.zeros(len(range_starts),dtype=bool),
+                                 np.ones(len(n_starts),dtype=bool)])
+    order = np.argsort(all_starts,kind="stable")
+
+    before_n = np.zeros(len(order),dtype=bool)
+    before_n[:-1] = is_n_range[order][1:]
+
+    shortened = order[before_n & ~is_n_range[order]]
+    range_ends = range_ends.copy()
+    range_ends[shortened] -= int(mer_l)
+
+    return range_starts,range_ends
+
+##############################################################################
+
 
 def main():
     
@@ -10,10 +10,12 @@ University of Washington | Department of Genome Sciences
 ##############################################################################
 
 #import libraries
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import re
-from sklearn import preprocessing
 import time
 import argparse
 
@@ -241,7 +243,86 @@ def generate_summary_table(merged,thresh,thresh_summ,chrom_summ):
 
 ##############################################################################
 
-def generate_plot(merged,out_plot):
+def write_bins(merged,bin_file):
+    """
+    Function writes the bins of the genome with their pdups sums, from
+    which the binding map is rendered later by plot_binding_maps.
+    Parameters
+    ----------
+    merged : dataframe
+        chrom, start, stop, pdups sum and bin type of all genomic bins
+    bin_file : file
+        the compressed bin array file
+    Returns
+    -------
+    None. Writes the bin arrays.
+    """
+
+    with open(bin_file,'wb') as out_f:
+        np.savez_compressed(out_f,
+                            chrom=merged['chrom'].values.astype(str),
+                            bin_start=merged['bin_start'].values.astype(int),
+                            bin_stop=merged['bin_stop'].values.astype(int),
+                            pdups=merged['pdups'].values.astype(float),
+                            bin_type=merged['bin_type'].values.astype(int))
+
+##############################################################################
+
+def read_bins(bin_file):
+    """
+    Function reads the bin arrays written by write_bins.
+    Parameters
+    ----------
+    bin_file : file
+        the compressed bin array file
+    Returns
+    -------
+    merged : dataframe
+        chrom, start, stop, pdups sum and bin type of all genomic bins
+    """
+
+    colnames = ['chrom','bin_start','bin_stop','pdups','bin_type']
+
+    with np.load(bin_file) as bins:
+        merged = pd.DataFrame(dict((col,bins[col]) for col in colnames),
+                              columns=colnames)
+
+    return merged
+
+##############################################################################
+
+def scale_pdups(pdups,feature_range=(0, 255)):
+    """
+    Function scales pdups sums linearly between the bounds of
+    feature_range, with all values set to the lower bound if they are equal.
+    Parameters
+    ----------
+    pdups : array
+        pdups sum of each bin
+    feature_range : tuple
+        the lower and upper bound of the scaled values
+    Returns
+    -------
+    scaled : array
+        the scaled pdups sums
+    """
+
+    pdups = np.asarray(pdups,dtype=float)
+
+    if len(pdups) == 0:
+        return pdups
+
+    data_range = pdups.max() - pdups.min()
+    if data_range == 0:
+        data_range = 1.0
+
+    scale = (feature_range[1] - feature_range[0]) / data_range
+
+    return pdups * scale + (feature_range[0] - pdups.min() * scale)
+
+##############################################################################
+
+def generate_plot(merged,out_plot,dpi=300):
     """
     Function takes the tracks of genomic regions and maps them
     accordingly based on scaffold.
@@ -249,6 +330,10 @@ def generate_plot(merged,out_plot):
     ----------
     merged : dataframe
         chrom, start, stop, and pdups sum
+    out_plot : file
+        the .png written
+    dpi : int
+        resolution of the .png, lower values write faster previews
     Returns
     -------
     .png of in silico predicted binding of oligo signal
@@ -287,10 +372,7 @@ def generate_plot(merged,out_plot):
     merged = merged.sort_values(by=['chrom_num','bin_start','bin_stop'])
         
     #scales the values of pdups between 0 - 255 using normalization
-    min_max_scaler = preprocessing.MinMaxScaler(feature_range=(0, 255))
-    y_transformed = min_max_scaler.fit_transform(merged[['pdups']])
-    y_transformed_list = y_transformed.ravel()
-    merged['nupack_trans'] = list(y_transformed_list)
+    merged['nupack_trans'] = scale_pdups(merged['pdups'].values)
     
     merged = merged.drop(['pdups'], axis=1)
     
@@ -366,9 +448,9 @@ def generate_plot(merged,out_plot):
     fig.subplots_adjust(bottom=0.10, right=0.6,top=0.9,hspace = 2.0,
                         wspace = 0.8)
     
-    plt.savefig(out_plot,transparent=True,dpi=300)
+    plt.savefig(out_plot,transparent=True,dpi=dpi)
     
-    plt.show()
+    plt.close(fig)
     
     
 ##############################################################################
@@ -394,14 +476,19 @@ def main():
     requiredNamed.add_argument('-p', '--pairwise_pdups', action='store',
                                required=True, help='file with pairwise'
                                'pdups vals')
-    requiredNamed.add_argument('-pl', '--out_plot', action='store',
-                               required=True, help='output genome plot')
     requiredNamed.add_argument('-t', '--thresh', action='store',
                                required=True, help='pdups >= to subset')
     requiredNamed.add_argument('-t_s', '--thresh_summ', action='store',
                                required=True, help='threshold summ file')
     requiredNamed.add_argument('-c_s', '--chrom_summ', action='store',
                                required=True, help='chrom pdups summ file')
+    userInput.add_argument('-pl', '--out_plot', action='store', default=None,
+                           help='output genome plot, not drawn if not given;'
+                           ' default is None')
+    userInput.add_argument('-ba', '--bin_arrays', action='store',
+                           default=None, help='file of bin arrays, from which'
+                           ' plot_binding_maps draws the genome plot later;'
+                           ' default is None')
 
     args = userInput.parse_args()
     chr_track_file = args.chrom_track
@@ -432,7 +519,11 @@ def main():
 
     print("---%s seconds ---"%(time.time()-start_time))
 
-    generate_plot(merged,out_plot)
+    if args.bin_arrays is not None:
+        write_bins(merged,args.bin_arrays)
+
+    if out_plot is not None:
+        generate_plot(merged,out_plot)
 
     print("---%s seconds ---"%(time.time()-start_time))
     
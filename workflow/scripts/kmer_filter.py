@@ -16,11 +16,14 @@ script_name = "kmer_filter"
 #first you should load the libraries
 import time
 import argparse
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+import numpy as np
 import pandas as pd
 from itertools import groupby
-from collections import Counter
 from Bio import SeqIO
-from Bio.Seq import reverse_complement as rev_comp
 
 ##############################################################################
 
@@ -76,7 +79,369 @@ def read_fasta_dict(fasta_file):
 
 ##############################################################################
 
-def repeat_count(probe_df,seq_dict,jf_file,MERLENGTH,chrom):
+def encode_kmers(kmers,k_size):
+    """
+    This function converts k-mer strings into 2-bit integer codes, with
+    A=0, C=1, G=2 and T=3 and the first base in the highest bits
+
+    Parameters
+    ----------
+    kmers : array
+        array of k-mer strings of length k_size
+    k_size : int
+        the size of k-mers
+
+    Returns
+    -------
+    codes : array
+        uint64 code of each k-mer
+    """
+
+    base_codes = np.zeros(256,dtype=np.uint64)
+    for code,base in enumerate("ACGT"):
+        base_codes[ord(base)] = code
+        base_codes[ord(base.lower())] = code
+
+    bases = np.frombuffer(np.asarray(kmers,dtype="S%d" % k_size).tobytes(),
+                          dtype=np.uint8).reshape(-1,k_size)
+
+    codes = np.zeros(len(bases),dtype=np.uint64)
+    for col in range(k_size):
+        codes = (codes << np.uint64(2)) | base_codes[bases[:,col]]
+
+    return codes
+
+##############################################################################
+
+def reverse_complement_codes(codes,k_size):
+    """
+    This function returns the codes of the reverse complement of k-mers
+    encoded by encode_kmers
+
+    Parameters
+    ----------
+    codes : array
+        uint64 codes of k-mers
+    k_size : int
+        the size of k-mers
+
+    Returns
+    -------
+    rc_codes : array
+        uint64 codes of the reverse complement k-mers
+    """
+
+    #complementing a base flips both of its bits
+    comp_codes = ~codes & np.uint64((1 << (2 * k_size)) - 1)
+
+    rc_codes = np.zeros(len(codes),dtype=np.uint64)
+    for col in range(k_size):
+        rc_codes = (rc_codes << np.uint64(2)) | (comp_codes & np.uint64(3))
+        comp_codes = comp_codes >> np.uint64(2)
+
+    return rc_codes
+
+##############################################################################
+
+def genome_count_prefix(jf_file,index_file,chrom,MERLENGTH,tmp_dir,
+                        chunk_size):
+    """
+    This function reads the jellyfish query file and the index file of a
+    scaffold in blocks of chunk_size k-mers, and builds memory mapped arrays
+    of the base location of each k-mer and the prefix sum of its genome
+    count. A k-mer contributes its count once, and once more if its reverse
+    complement is also listed in the query file, matching a lookup of both
+    strands in the query file.
+
+    Parameters
+    ----------
+    jf_file : file
+        file containing jellyfish k-mer and k-mer counts
+    index_file : file
+        file containing the index location of each k-mer in the query file
+    chrom : string
+        scaffold name
+    tmp_dir : directory
+        directory where the memory mapped arrays are written
+    chunk_size : int
+        number of k-mers read per block
+
+    Returns
+    -------
+    kmer_positions : memmap
+        base location of each k-mer in the query file
+    count_prefix : memmap
+        prefix sum of genome counts, count_prefix[i] sums the first i k-mers
+    """
+
+    if str(jf_file[-4:]) != ".txt":
+
+        jf_file = str(jf_file) + "/" + str(chrom) + "_jf_temp.txt"
+
+    if str(index_file[-4:]) != ".txt":
+
+        index_file = str(index_file) + "/" + str(chrom) + "_index.txt"
+
+    codes_file = os.path.join(tmp_dir,chrom + "_codes.bin")
+    counts_file = os.path.join(tmp_dir,chrom + "_counts.bin")
+    positions_file = os.path.join(tmp_dir,chrom + "_positions.bin")
+
+    jf_chunks = pd.read_csv(jf_file, sep=" ", header=None,
+                            names=["mer","count"],
+                            dtype={"mer": str, "count": np.int64},
+                            chunksize=chunk_size)
+
+    index_chunks = pd.read_csv(index_file, header=None, dtype=np.int64,
+                               chunksize=chunk_size)
+
+    #stream the k-mer codes, counts and positions to disk
+    with open(codes_file,"wb") as codes_f, open(counts_file,"wb") as counts_f, \
+        open(positions_file,"wb") as positions_f:
+
+        #the index file may hold a few more positions than there are k-mers
+        for jf_df,index_df in zip(jf_chunks,index_chunks):
+
+            block_len = min(len(jf_df),len(index_df))
+
+            codes_f.write(encode_kmers(jf_df["mer"].to_numpy()[:block_len],
+                                       MERLENGTH).tobytes())
+            counts_f.write(jf_df["count"].to_numpy()[:block_len].tobytes())
+            positions_f.write(index_df[0].to_numpy()[:block_len].tobytes())
+
+    n_kmers = os.path.getsize(codes_file) // 8
+
+    if n_kmers == 0:
+        return np.zeros(0,dtype=np.int64),np.zeros(1,dtype=np.int64)
+
+    kmer_codes = np.memmap(codes_file, dtype=np.uint64, mode='r')
+    kmer_counts = np.memmap(counts_file, dtype=np.int64, mode='r')
+
+    #sorted codes of every k-mer listed in the query file
+    listed_codes = np.unique(kmer_codes)
+
+    count_prefix = np.memmap(os.path.join(tmp_dir,chrom + "_prefix.bin"),
+                             dtype=np.int64, mode='w+', shape=(n_kmers + 1,))
+    count_prefix[0] = 0
+
+    for start in range(0,n_kmers,chunk_size):
+
+        end = min(start + chunk_size,n_kmers)
+
+        rc_codes = reverse_complement_codes(kmer_codes[start:end],MERLENGTH)
+        rc_idx = np.minimum(np.searchsorted(listed_codes,rc_codes),
+                            len(listed_codes) - 1)
+        rc_listed = listed_codes[rc_idx] == rc_codes
+
+        weights = kmer_counts[start:end] * (1 + rc_listed)
+
+        count_prefix[start + 1:end + 1] = count_prefix[start] + np.cumsum(weights)
+
+    count_prefix.flush()
+
+    del kmer_codes,kmer_counts,listed_codes
+    os.remove(codes_file)
+    os.remove(counts_file)
+
+    kmer_positions = np.memmap(positions_file, dtype=np.int64, mode='r')
+
+    return kmer_positions,count_prefix
+
+##############################################################################
+
+def probe_genome_counts(probe_df,kmer_positions,count_prefix,MERLENGTH):
+    """
+    This function sums the genome counts of the k-mers of each probe from
+    the prefix sum array. Probe starts are relative to the repeat region,
+    whose start is taken from the region header (chrom:start-end).
+
+    Parameters
+    ----------
+    probe_df : dataframe
+        dataframe of designed probes
+    kmer_positions : array
+        base location of each k-mer in the query file
+    count_prefix : array
+        prefix sum of genome counts of the k-mers in the query file
+
+    Returns
+    -------
+    hg_counts : array
+        sum of all k-mer counts in genome of each probe
+    """
+
+    region_start = probe_df["regions"].str.rsplit(":",n=1).str[1]
+    region_start = region_start.str.split("-").str[0].astype(np.int64)
+
+    first_kmer = (region_start + probe_df["p_start"].astype(np.int64)
+                  - 1).to_numpy()
+    n_kmers = (probe_df["probe"].str.len() - int(MERLENGTH) + 1).to_numpy()
+
+    #k-mers of a probe are consecutive in the query file
+    lo = np.searchsorted(kmer_positions,first_kmer)
+    hi = np.searchsorted(kmer_positions,first_kmer + n_kmers)
+
+    return count_prefix[hi] - count_prefix[lo]
+
+##############################################################################
+
+def sequence_kmer_codes(sequence,k_size):
+    """
+    This function converts every k-mer of a sequence into its 2-bit integer
+    code and the code of its reverse complement, rolling over the sequence
+    one base column at a time
+
+    Parameters
+    ----------
+    sequence : string
+        sequence to be split into mers of specified size
+    k_size : int
+        the size of k-mers
+
+    Returns
+    -------
+    codes : array
+        uint64 code of each k-mer, in order of the k-mer start
+    rc_codes : array
+        uint64 code of the reverse complement of each k-mer
+    valid : array
+        True for k-mers made only of A, C, G and T
+    """
+
+    k_size = int(k_size)
+    n_kmers = max(len(sequence) - k_size + 1,0)
+
+    base_codes = np.full(256,4,dtype=np.uint8)
+    for code,base in enumerate("ACGT"):
+        base_codes[ord(base)] = code
+
+    bases = base_codes[np.frombuffer(str(sequence).encode(),dtype=np.uint8)]
+
+    #k-mers holding any other base are flagged with a prefix sum
+    invalid = np.concatenate(([0],np.cumsum(bases == 4)))
+    valid = (invalid[k_size:k_size + n_kmers] - invalid[:n_kmers]) == 0
+
+    bases = np.minimum(bases,3).astype(np.uint64)
+
+    codes = np.zeros(n_kmers,dtype=np.uint64)
+    rc_codes = np.zeros(n_kmers,dtype=np.uint64)
+    for col in range(k_size):
+        codes = (codes << np.uint64(2)) | bases[col:col + n_kmers]
+        rc_codes = rc_codes | ((np.uint64(3) - bases[col:col + n_kmers])
+                               << np.uint64(2 * col))
+
+    return codes,rc_codes,valid
+
+##############################################################################
+
+def probe_kmer_codes(probes_list,codes,valid,k_size):
+    """
+    This function splits the k-mer codes of probes joined by a base that is
+    not coded into the k-mer code array of each probe, dropping every k-mer
+    that spans two probes. K-mers holding bases other than A, C, G and T are
+    given codes above those of any A, C, G and T k-mer, one per distinct
+    k-mer.
+
+    Parameters
+    ----------
+    probes_list : list
+        probes joined in this order
+    codes : array
+        uint64 code of each k-mer of the joined probes
+    valid : array
+        True for k-mers made only of A, C, G and T
+    k_size : int
+        the size of k-mers
+
+    Returns
+    -------
+    mer_codes : list
+        uint64 array of the k-mer codes of each probe, in probe order
+    """
+
+    k_size = int(k_size)
+
+    mer_codes = []
+    other_codes = {}
+    start = 0
+
+    for probe in probes_list:
+        n_mers = max(len(probe) - k_size + 1,0)
+        probe_codes = codes[start:start + n_mers].copy()
+
+        #rare k-mers with other bases are coded by their sequence
+        for i in np.flatnonzero(~valid[start:start + n_mers]).tolist():
+            probe_codes[i] = other_codes.setdefault(probe[i:i + k_size],
+                                                    2**62 + len(other_codes))
+
+        mer_codes.append(probe_codes)
+        start += len(probe) + 1
+
+    return mer_codes
+
+##############################################################################
+
+def region_repeat_counts(task):
+    """
+    This function sums the region k-mer counts of each probe designed
+    against one repeat region. Region k-mers are counted by their canonical
+    code, the smaller code of the k-mer and its reverse complement, so each
+    probe k-mer is looked up once for both strands.
+
+    Parameters
+    ----------
+    task : tuple
+        repeat region sequence, list of probes, the size of k-mers and
+        whether the k-mer codes of each probe are returned
+
+    Returns
+    -------
+    r_counts : array
+        sum of all k-mer counts in repeat of each probe, in probe order
+    mer_codes : list
+        uint64 array of the k-mer codes of each probe, or None
+    """
+
+    sequence,probes_list,k_size,keep_codes = task
+
+    codes,rc_codes,valid = sequence_kmer_codes(sequence,k_size)
+    region_codes,region_counts = np.unique(np.minimum(codes,rc_codes)[valid],
+                                           return_counts=True)
+
+    #probes are joined by a base that is not counted, so no k-mer spans two
+    probe_lens = np.array([len(probe) for probe in probes_list])
+    codes,rc_codes,valid = sequence_kmer_codes("N".join(probes_list),k_size)
+    probe_idx = np.repeat(np.arange(len(probes_list)),probe_lens + 1)
+    probe_idx = probe_idx[:len(codes)][valid]
+
+    if keep_codes:
+        mer_codes = probe_kmer_codes(probes_list,codes,valid,k_size)
+    else:
+        mer_codes = None
+
+    canon_codes = np.minimum(codes,rc_codes)[valid]
+    palindrome = codes[valid] == rc_codes[valid]
+
+    r_counts = np.zeros(len(probes_list),dtype=np.int64)
+
+    if len(region_codes) == 0 or len(canon_codes) == 0:
+        return r_counts,mer_codes
+
+    region_idx = np.minimum(np.searchsorted(region_codes,canon_codes),
+                            len(region_codes) - 1)
+    mer_counts = np.where(region_codes[region_idx] == canon_codes,
+                          region_counts[region_idx],0)
+
+    #a palindrome matches the region on both strands
+    mer_counts = mer_counts * (1 + palindrome)
+
+    np.add.at(r_counts,probe_idx,mer_counts)
+
+    return r_counts,mer_codes
+
+##############################################################################
+
+def repeat_count(probe_df,seq_dict,genome_counts,MERLENGTH,threads=1,
+                 probe_codes=None):
     
     """
     This function takes the probes from probes data, and generates indep.
@@ -89,8 +454,13 @@ def repeat_count(probe_df,seq_dict,jf_file,MERLENGTH,chrom):
         dataframe of designed probes
     seq_dict : dictionary
         dictionary of repeat region and repeat sequence
-    jf_file : file
-        file containing jellyfish k-mer and k-mer counts
+    genome_counts : tuple
+        k-mer positions and genome count prefix sum from genome_count_prefix
+    threads : int
+        number of repeat regions counted at once
+    probe_codes : dictionary
+        optional, filled with the probe seq as key and the uint64 array of
+        its k-mer codes, built while counting, as val
 
     Returns
     -------
@@ -102,79 +472,34 @@ def repeat_count(probe_df,seq_dict,jf_file,MERLENGTH,chrom):
         as val
     """    
 
-    #make dictionary ot read jellyfish file into k-mer (key) and count (val)
-    jf_dict = {}
-
-    if str(jf_file[-4:]) != ".txt":
-
-        jf_file = str(jf_file) + "/" + str(chrom) + "_jf_temp.txt"
-
-    #read jellyfish file into two lists
-    with open(jf_file) as jf:
-        rows = (line.split() for line in jf)
-        for row in rows:
-            jf_dict[row[0]] = int(row[1])
+    kmer_positions,count_prefix = genome_counts
 
     #make dictionaries for repeat counts and genome counts
     #probe (key) and sum of all k-mer counts (val)
-    all_hg_counts = {}
+    all_hg_counts = dict(zip(probe_df["probe"].tolist(),
+                             probe_genome_counts(probe_df,kmer_positions,
+                                                 count_prefix,
+                                                 MERLENGTH).tolist()))
     all_repeat_counts = {}
 
     #group over each repeat region
-    grouped_regions = probe_df.groupby(['regions'],sort = False)
-    
-    #iterate over each repeat region(name)
-    for name,group in grouped_regions:
-        
-        #make a list of the probes in this group
-        probes_list = group["probe"].tolist()
-        
-        #implement function to split region from the fasta dict(seq_dict)
-        #into mers of a given size
-        #region_mers is a list
-        region_mers = generate_kmers(str(seq_dict[name]),int(MERLENGTH))
-        
-        #Counter collapses list into dictionary where mer (key) and Counter
-        #appends count (val)
-        region_mers = Counter(region_mers)
-        
-        #iterates over probes within a repeat region
-        for probe in probes_list:
-            
-            #creates lists for each probe's k-mer counts in the list
-            probe_region_count_list = []
-            probe_genome_count_list = []
-            
-            #implement function to split probe into its k-mers of specified
-            #length, returns the mers as a list
-            probe_mers = generate_kmers(probe,int(MERLENGTH))
-            
-            #iterate over each mer in the probe_mers list for each probe
-            for mer in probe_mers:
-                
-                #implement function to generate RC
-                #if there are RC matches in repeat or genome, those counts
-                #are also considered
-                rev_mer = rev_comp(mer)
-                
-                #then check if mer or mer RC in region
-                #append that count value
-                if mer in region_mers:
-                    probe_region_count_list.append(region_mers[mer])
-                if rev_mer in region_mers:
-                    probe_region_count_list.append(region_mers[rev_mer])
-                    
-                #then check if the mer or mer RC is in genome
-                #append that count value
-                if mer in jf_dict:
-                    probe_genome_count_list.append(jf_dict[mer])
-                if rev_mer in jf_dict:
-                    probe_genome_count_list.append(jf_dict[rev_mer])
-            
-            #takes the sum of all k-mer counts identified for each probe
+    grouped_regions = probe_df.groupby('regions',sort = False)
+
+    #each repeat region is counted against its own probes
+    tasks = [(str(seq_dict[name]),group["probe"].tolist(),int(MERLENGTH),
+              probe_codes is not None)
+             for name,group in grouped_regions]
+
+    with Pool(processes=max(1,threads)) as pool:
+        for task,(r_counts,mer_codes) in zip(tasks,
+                                             pool.imap(region_repeat_counts,
+                                                       tasks)):
+
             #adds probe (key) and total sum of k-mer counts (val)
-            all_repeat_counts[probe] = sum(probe_region_count_list)
-            all_hg_counts[probe] = sum(probe_genome_count_list)
+            all_repeat_counts.update(zip(task[1],r_counts.tolist()))
+
+            if probe_codes is not None:
+                probe_codes.update(zip(task[1],mer_codes))
 
     return all_repeat_counts,all_hg_counts
 
@@ -414,6 +739,16 @@ def main():
                                'to compute normalized binding score')
     requiredNamed.add_argument('-c', '--chrom', action='store',
                                required=True,help='scaffold name')
+    requiredNamed.add_argument('-i', '--index_file', action='store',
+                               required=True, help='The index file of'
+                               'k-mer locations in the scaffold')
+    userInput.add_argument('-cs', '--chunk_size', action='store',
+                           default=10000000, type=int, help='The number of'
+                           ' k-mers of the jellyfish file held in memory at'
+                           ' once; default is 10000000')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of repeat regions counted'
+                           ' at once; default is 1')
 
     args = userInput.parse_args()
     
@@ -425,6 +760,9 @@ def main():
     c1_val = args.c1_value
     c2_val = args.c2_value
     chrom = args.chrom
+    index_file = args.index_file
+    chunk_size = args.chunk_size
+    threads = args.threads
 
 
     probe_df = read_probe_file(probe_file)
@@ -435,10 +773,23 @@ def main():
 
     print("---%s seconds ---"%(time.time()-start_time))
     
+    #memory mapped arrays are kept next to the output file
+    tmp_dir = tempfile.mkdtemp(prefix="kmer_filter_",
+                               dir=os.path.dirname(os.path.abspath(o_path)))
+
+    genome_counts = genome_count_prefix(jf_file,index_file,chrom,MERLENGTH,
+                                        tmp_dir,chunk_size)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
     all_repeat_counts,all_genome_counts = repeat_count(probe_df,
                                                              seq_dict,
-                                                             jf_file,
-                                                             MERLENGTH,chrom)
+                                                             genome_counts,
+                                                             MERLENGTH,
+                                                             threads)
+
+    del genome_counts
+    shutil.rmtree(tmp_dir)
 
     print("---%s seconds ---"%(time.time()-start_time))
     
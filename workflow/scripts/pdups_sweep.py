@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "pdups_sweep"
+
+#import libraries
+import time
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import alignment_filter as af
+import binding_pyramid as bp
+import bulk_probe_analysis as bpa
+
+##############################################################################
+
+def parse_conditions(conditions):
+    """
+    This function reads the NUPACK conditions of the sweep, each given as
+    model temp or model temp:sodium
+
+    Parameters
+    ----------
+    conditions : list
+        strings such as 69.5 or 74.5:0.39
+
+    Returns
+    -------
+    condition_list : list
+        model temp (C) and sodium (M) of each condition, in the order given
+    """
+
+    condition_list = []
+
+    for condition in conditions:
+
+        fields = str(condition).split(":")
+
+        if len(fields) > 2:
+            raise ValueError("Condition %s is not temp or temp:sodium" %
+                             condition)
+
+        model_temp = float(fields[0])
+        sodium = float(fields[1]) if len(fields) == 2 else af.SODIUM
+
+        if (model_temp,sodium) not in condition_list:
+            condition_list.append((model_temp,sodium))
+
+    return condition_list
+
+##############################################################################
+
+def read_regions(probe_paths):
+    """
+    This function reads the candidate probes of each repeat region
+
+    Parameters
+    ----------
+    probe_paths : list
+        probe files or make_chrom_dir directories of probe files
+
+    Returns
+    -------
+    region_list : list
+        the probe dataframe of each repeat region
+    """
+
+    region_list = []
+
+    for path in probe_paths:
+
+        if os.path.isdir(path):
+            region_files = sorted(glob.glob(os.path.join(path,"*.txt")))
+        else:
+            region_files = [path]
+
+        for region_file in region_files:
+
+            probe_df = af.read_probe_filter(region_file)
+
+            if len(probe_df) > 0:
+                region_list.append(probe_df)
+
+    return region_list
+
+##############################################################################
+
+def init_worker(condition_list):
+    """
+    This function configures the NUPACK model of every condition once in
+    each worker process
+    """
+
+    global NUPACK_MODELS
+    NUPACK_MODELS = [af.nupack_model(model_temp,sodium) for
+                     model_temp,sodium in condition_list]
+
+##############################################################################
+
+def score_pair(task):
+    """
+    This function computes the pdups of a parent and derived sequence under
+    one condition
+    """
+
+    condition,parent,derived = task
+
+    return af.pdups(parent,derived,af.STRAND_CONC_A,af.STRAND_CONC_B,
+                    NUPACK_MODELS[condition])
+
+##############################################################################
+
+def align_sweep(probe_coords,align_caches,bowtie_idx,bt2_k_val,seed_length,
+                threads,batch_size,pool):
+    """
+    This function aligns each probe sequence once, in batched bowtie2 calls,
+    and stores its alignments with the pdups of every condition in the
+    alignment cache of that condition. For each batch the unique parent and
+    derived pairs not yet scored are scored per condition by the pool.
+
+    Parameters
+    ----------
+    probe_coords : dictionary
+        probe sequence is key and the coordinates it is aligned under is value
+    align_caches : list
+        the alignment cache directory and settings string of each condition
+    batch_size : int
+        number of probes aligned in each bowtie2 call
+    pool : Pool
+        worker processes holding the NUPACK model of each condition
+
+    Returns
+    -------
+    n_pairs : int
+        number of unique pairs scored under each condition
+    """
+
+    pdups_caches = [{} for align_cache in align_caches]
+
+    probe_list = list(probe_coords)
+
+    for i in range(0,len(probe_list),batch_size):
+
+        batch_list = probe_list[i:i + batch_size]
+        coords_list = [probe_coords[probe] for probe in batch_list]
+
+        pairwise_df = bpa.align_batch(batch_list,coords_list,bowtie_idx,
+                                      bt2_k_val,seed_length,threads)
+
+        #alignments with N bases are dropped, as in alignment_filter
+        pairwise_df = pairwise_df[~pairwise_df.parent.str.contains("N")]
+        pairwise_df = pairwise_df[~pairwise_df.derived.str.contains("N")]
+
+        pairs = list(zip(pairwise_df['parent'].tolist(),
+                         pairwise_df['derived'].tolist()))
+        unique_pairs = list(dict.fromkeys(pairs))
+
+        probe_groups = pairwise_df.groupby('probe_ID',sort=False).indices
+
+        for condition,align_cache in enumerate(align_caches):
+
+            pdups_cache = pdups_caches[condition]
+
+            new_pairs = [pair for pair in unique_pairs
+                         if pair not in pdups_cache]
+
+            if new_pairs:
+                pdups_cache.update(zip(new_pairs,pool.map(
+                    score_pair,[(condition,parent,derived) for
+                                parent,derived in new_pairs])))
+
+            pairwise_df = pairwise_df.assign(
+                pdups=[pdups_cache[pair] for pair in pairs])
+
+            for probe,coords in zip(batch_list,coords_list):
+
+                cache_file = af.alignment_cache_file(probe,align_cache)
+
+                if not os.path.exists(cache_file):
+                    rows = probe_groups.get(coords,np.array([],dtype=int))
+                    af.store_pairwise_df(pairwise_df.iloc[rows],cache_file)
+
+        print("%s probes, %s alignments, %s unique pairs" % (
+            len(batch_list),len(pairwise_df),len(unique_pairs)))
+
+    return len(pdups_caches[0]) if pdups_caches else 0
+
+##############################################################################
+
+def filter_region(task):
+    """
+    This function sums the binding of every candidate probe of a repeat
+    region under one condition and runs the alignment_filter probe selection
+    on it, reading the alignments and pdups from the alignment cache of the
+    condition
+
+    Parameters
+    ----------
+    task : tuple
+        condition, probe dataframe, alignment cache and alignment_filter
+        parameters
+
+    Returns
+    -------
+    sweep_df : dataframe
+        on and off target binding of each candidate probe, whether it was
+        kept and why the probe selection stopped
+    """
+
+    (condition,probe_df,align_cache,bowtie_idx,bt2_k_val,seed_length,
+     r_thresh,max_pdups_binding,max_probe_return,min_on_target,genomic_bins,
+     thresh,pdups_p,time_budget) = task
+
+    NUPACK_MODEL = NUPACK_MODELS[condition]
+
+    repeat_dict = dict(zip(probe_df['probe_coords'],probe_df['region']))
+
+    binding_list = []
+    for probe,coords in zip(probe_df['probe'].tolist(),
+                            probe_df['probe_coords'].tolist()):
+
+        pairwise_df = af.cached_pairwise_df(probe,coords,bowtie_idx,
+                                            af.BOWTIE_STRING,
+                                            af.STRAND_CONC_A,
+                                            af.STRAND_CONC_B,NUPACK_MODEL,
+                                            bt2_k_val,seed_length,0,
+                                            align_cache)
+
+        binding_list.append(bpa.classify_binding(pairwise_df,repeat_dict))
+
+    binding_df = pd.concat(binding_list)
+
+    filter_out = af.filter_thresh(probe_df,af.STRAND_CONC_A,af.STRAND_CONC_B,
+                                  bowtie_idx,r_thresh,af.BOWTIE_STRING,
+                                  NUPACK_MODEL,bt2_k_val,max_pdups_binding,
+                                  seed_length,max_probe_return,min_on_target,
+                                  genomic_bins,thresh,pdups_p,0,None,
+                                  align_cache,time_budget)
+
+    keep_probe_names_list = filter_out[5]
+    stop_reason = filter_out[8]
+
+    sweep_df = probe_df[['probe_coords','region','probe']].copy()
+
+    on_sum = sweep_df['probe_coords'].map(binding_df['on_target_sum'])
+    off_sum = sweep_df['probe_coords'].map(binding_df['off_target_sum'])
+
+    sweep_df['on_target_sum'] = on_sum.fillna(0.0).astype(float).values
+    sweep_df['off_target_sum'] = off_sum.fillna(0.0).astype(float).values
+
+    total = sweep_df['on_target_sum'] + sweep_df['off_target_sum']
+    sweep_df['on_target_prop'] = np.where(total > 0,
+                                          sweep_df['on_target_sum'] /
+                                          total.where(total > 0,1.0),0.0)
+
+    sweep_df['kept'] = sweep_df['probe_coords'].isin(
+        keep_probe_names_list).astype(int)
+    sweep_df['stop_reason'] = stop_reason
+
+    return condition,sweep_df
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Compares probe selection under several NUPACK conditions, such as
+    model temps of 69.5 and 74.5, in a single job. Each candidate probe
+    sequence is aligned once and the pdups of its unique parent and derived
+    pairs are computed per condition, stored in an alignment cache per
+    condition. The alignment_filter probe selection then runs for every
+    repeat region and condition from the caches, without aligning again."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the make_chrom_dir probe files of a run and the bowtie2'
+        'index. Returns the on and off target binding of every candidate'
+        'probe and whether it was kept under each condition.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--probe_paths', action='store',
+                               nargs='+', required=True, help='The probe'
+                               'files or make_chrom_dir directories of the'
+                               'repeat regions')
+    requiredNamed.add_argument('-c', '--conditions', action='store',
+                               nargs='+', required=True, help='The NUPACK'
+                               'conditions compared, each as temp or'
+                               'temp:sodium, such as 69.5 74.5:0.39')
+    requiredNamed.add_argument('-ac', '--align_cache', action='store',
+                               required=True, help='The alignment cache'
+                               'directory of the conditions')
+    requiredNamed.add_argument('-o', '--out_file', action='store',
+                               required=True, help='The comparison table'
+                               'of all conditions')
+    requiredNamed.add_argument('-b', '--bowtie_index', action='store',
+                               required=True, help='The path to the bowtie'
+                               'index to run the alignment algorithm')
+    requiredNamed.add_argument('-k', '--bt2_max_align', action='store',
+                               required=True, help='The max number of'
+                               'alignments to be returned by bowtie')
+    requiredNamed.add_argument('-l', '--seed_length', action='store',
+                               required=True, help='Seed length when'
+                               'returning bt2 alignments')
+    requiredNamed.add_argument('-r', '--region_threshold', action='store',
+                               required=True, type=int, help='The total'
+                               'on-target binding sum to reach by repeat'
+                               'region')
+    requiredNamed.add_argument('-pb', '--max_pdups_binding', action='store',
+                               required=True, help='The max pdups binding'
+                               'val between kept probes')
+    requiredNamed.add_argument('-moT', '--min_on_target', action='store',
+                               required=True, help='The min on target'
+                               'aggregate pdups binding sum to consider a'
+                               'probe')
+    requiredNamed.add_argument('-Mr', '--max_probe_return', action='store',
+                               required=True, help='The max number of'
+                               'probes kept by repeat region')
+    requiredNamed.add_argument('-gb', '--genomic_bin', action='store',
+                               required=True, help='genome binned file')
+    requiredNamed.add_argument('-th', '--thresh', action='store',
+                               required=True, help='pdups >= to subset')
+    requiredNamed.add_argument('-p', '--pdups_p', action='store',
+                               required=True, help='pdups prop min')
+    userInput.add_argument('-tb', '--time_budget', action='store',
+                           default=0, type=float, help='Seconds each region'
+                           ' and condition may be filtered for; default is'
+                           ' 0, no budget')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of bowtie2 threads and'
+                           ' pdups workers; default is 1')
+    userInput.add_argument('-bs', '--batch_size', action='store',
+                           default=1000, type=int, help='Number of probes'
+                           ' aligned in each bowtie2 call; default is 1000')
+
+    args = userInput.parse_args()
+
+    condition_list = parse_conditions(args.conditions)
+
+    align_caches = [(args.align_cache,af.alignment_cache_tag(
+        args.bowtie_index,af.BOWTIE_STRING,args.bt2_max_align,
+        args.seed_length,model_temp,sodium)) for
+        model_temp,sodium in condition_list]
+
+    region_list = read_regions(args.probe_paths)
+
+    genomic_bins = bp.read_genome_bins(args.genomic_bin)
+
+    #each probe sequence is aligned once, under its first coordinates
+    probe_coords = {}
+    for probe_df in region_list:
+        for probe,coords in zip(probe_df['probe'].tolist(),
+                                probe_df['probe_coords'].tolist()):
+            probe_coords.setdefault(probe,coords)
+
+    #probes already in the cache of every condition are not aligned again
+    align_coords = {probe: coords for probe,coords in probe_coords.items()
+                    if not all(os.path.exists(af.alignment_cache_file(
+                        probe,align_cache)) for align_cache in align_caches)}
+
+    print("%s candidate probes, %s unique sequences, %s to align" % (
+        sum(len(probe_df) for probe_df in region_list),len(probe_coords),
+        len(align_coords)))
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    with Pool(processes=max(1,args.threads),initializer=init_worker,
+              initargs=(condition_list,)) as pool:
+
+        n_pairs = align_sweep(align_coords,align_caches,args.bowtie_index,
+                              args.bt2_max_align,args.seed_length,
+                              args.threads,max(1,args.batch_size),pool)
+
+        print("unique pairs scored per condition: %s" % n_pairs)
+
+        print("---%s seconds ---"%(time.time()-start_time))
+
+        tasks = [(condition,probe_df,align_caches[condition],
+                  args.bowtie_index,args.bt2_max_align,args.seed_length,
+                  args.region_threshold,args.max_pdups_binding,
+                  args.max_probe_return,args.min_on_target,genomic_bins,
+                  args.thresh,args.pdups_p,args.time_budget) for
+                 condition in range(len(condition_list)) for
+                 probe_df in region_list]
+
+        sweep_list = []
+        for condition,sweep_df in pool.imap(filter_region,tasks):
+
+            model_temp,sodium = condition_list[condition]
+            sweep_df.insert(0,'sodium',sodium)
+            sweep_df.insert(0,'model_temp',model_temp)
+
+            sweep_list.append(sweep_df)
+
+    sweep_df = pd.concat(sweep_list, ignore_index=True)
+    sweep_df.to_csv(args.out_file, index=False, sep="\t")
+
+    summ_df = sweep_df.assign(
+        kept_on_target_sum=sweep_df['on_target_sum'] * sweep_df['kept'])
+    summ_df = summ_df.groupby(['model_temp','sodium'],sort=False).agg(
+        candidates=('probe','size'),kept=('kept','sum'),
+        kept_on_target_sum=('kept_on_target_sum','sum'))
+
+    print(summ_df.to_string())
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "phase_classes"
+
+#import libraries
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import kmer_filter as kf
+from Bio import SeqIO
+
+##############################################################################
+
+def read_region_probes(file_path):
+    """
+    This function reads the probe file of a repeat region written by the
+    make_chrom_dir checkpoint
+
+    Parameters
+    ----------
+    file_path : file
+        probe file of a single repeat region
+
+    Returns
+    -------
+    probe_df : dataframe
+        probes of the repeat region in rank order
+    """
+
+    colnames = ["chrom","p_start","p_end","probe","Tm","region",
+                "r_count_total","h_count_total","k_score","k_norm"]
+
+    probe_df = pd.read_csv(file_path, delimiter = '\t', names = colnames)
+
+    return probe_df
+
+##############################################################################
+
+def read_region_seq(fasta_file,region):
+    """
+    This function returns the sequence of a repeat region from the multi
+    entry fasta written by design_probes
+
+    Parameters
+    ----------
+    fasta_file : fasta file
+        multi entry fasta of the repeat regions of a scaffold
+    region : string
+        header of the repeat region, as chrom:start-end
+
+    Returns
+    -------
+    sequence : string
+        upper case sequence of the repeat region
+    """
+
+    for rec in SeqIO.parse(fasta_file,"fasta"):
+        if rec.id == region:
+            return str(rec.seq).upper()
+
+    raise ValueError("Region %s not found in %s" % (region,fasta_file))
+
+##############################################################################
+
+def estimate_period(sequence,k_size,min_period,max_period):
+    """
+    This function estimates the monomer period of a tandem repeat from the
+    autocorrelation of its k-mers. For every k-mer, the distance back to the
+    previous copy of the same k-mer is taken, and the most frequent distance
+    between min_period and max_period is returned as the period.
+
+    Parameters
+    ----------
+    sequence : string
+        sequence of the repeat region
+    k_size : int
+        size of k-mers compared
+    min_period : int
+        smallest period considered
+    max_period : int
+        largest period considered
+
+    Returns
+    -------
+    period : int
+        estimated monomer period, 0 if no k-mer recurs within range
+    score : float
+        proportion of k-mers whose previous copy is one period upstream
+    """
+
+    codes,rc_codes,valid = kf.sequence_kmer_codes(sequence,k_size)
+
+    positions = np.flatnonzero(valid)
+
+    if len(positions) < 2:
+        return 0,0.0
+
+    #copies of the same k-mer are adjacent once sorted, in sequence order
+    order = np.argsort(codes[positions],kind='stable')
+    sorted_codes = codes[positions][order]
+    sorted_positions = positions[order]
+
+    repeated = sorted_codes[1:] == sorted_codes[:-1]
+    distances = (sorted_positions[1:] - sorted_positions[:-1])[repeated]
+    distances = distances[(distances >= min_period) &
+                          (distances <= max_period)]
+
+    if len(distances) == 0:
+        return 0,0.0
+
+    distance_counts = np.bincount(distances)
+    period = int(np.argmax(distance_counts))
+    score = float(distance_counts[period]) / len(positions)
+
+    return period,score
+
+##############################################################################
+
+def assign_classes(probe_df,period,max_mismatch):
+    """
+    This function groups the probes of a repeat region into phase classes.
+    Probes of a class share their offset within the monomer (p_start modulo
+    period) and their length, and differ from the first ranked probe of the
+    class at no more than max_mismatch bases. Without a period, each probe
+    is its own class.
+
+    Parameters
+    ----------
+    probe_df : dataframe
+        probes of the repeat region in rank order
+    period : int
+        estimated monomer period
+    max_mismatch : int
+        largest number of mismatches to the class representative
+
+    Returns
+    -------
+    probe_df : dataframe
+        probes with the phase and phase_class columns added
+    """
+
+    if period > 0:
+        phases = (probe_df['p_start'] % period).tolist()
+    else:
+        phases = list(range(len(probe_df)))
+
+    #representative sequences of each phase and length
+    phase_reps = {}
+    classes = []
+    n_classes = 0
+
+    for phase,probe in zip(phases,probe_df['probe'].tolist()):
+
+        bases = np.frombuffer(probe.encode(),dtype=np.uint8)
+        reps,rep_classes = phase_reps.setdefault((phase,len(probe)),([],[]))
+
+        class_id = None
+        if reps:
+            mismatches = (np.vstack(reps) != bases).sum(axis=1)
+            best = int(np.argmin(mismatches))
+            if mismatches[best] <= max_mismatch:
+                class_id = rep_classes[best]
+
+        #the first ranked probe of a new class is its representative
+        if class_id is None:
+            class_id = n_classes
+            n_classes += 1
+            reps.append(bases)
+            rep_classes.append(class_id)
+
+        classes.append(class_id)
+
+    probe_df['phase'] = phases if period > 0 else 0
+    probe_df['phase_class'] = classes
+
+    return probe_df
+
+##############################################################################
+
+def write_classes(probe_df,period,out_file):
+    """
+    This function writes the probe sequence, phase class, period and phase
+    of each probe of the repeat region
+
+    Parameters
+    ----------
+    probe_df : dataframe
+        probes with the phase and phase_class columns
+    period : int
+        estimated monomer period
+    out_file : file
+        tab separated file of phase classes
+
+    Returns
+    -------
+    None. Writes the phase classes file.
+    """
+
+    probe_df['period'] = period
+
+    probe_df[['probe','phase_class','period','phase']].to_csv(out_file,
+                                                             header=False,
+                                                             index=False,
+                                                             sep="\t")
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Estimates the monomer period of a tandem repeat region and groups
+    its candidate probes into phase classes, so that alignment_filter
+    evaluates one probe per class and passes the result on to the other
+    members of the class."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the probe file of a repeat region and the fasta file of'
+        'repeat regions. Returns the phase class of each candidate probe.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--probe_file', action='store',
+                               required=True, help='The probe file of a'
+                               'repeat region')
+    requiredNamed.add_argument('-r', '--region_fa', action='store',
+                               required=True, help='Multi-entry fasta of'
+                               'repeat regions')
+    requiredNamed.add_argument('-o', '--out_file', action='store',
+                               required=True, help='The phase classes file')
+    userInput.add_argument('-k', '--merlength', action='store', default=12,
+                           type=int, help='The size of k-mers used to'
+                           ' estimate the period; default is 12')
+    userInput.add_argument('-p', '--min_period', action='store', default=2,
+                           type=int, help='The smallest period considered;'
+                           ' default is 2')
+    userInput.add_argument('-P', '--max_period', action='store',
+                           default=10000, type=int, help='The largest'
+                           ' period considered; default is 10000')
+    userInput.add_argument('-s', '--min_score', action='store', default=0.1,
+                           type=float, help='The min proportion of k-mers'
+                           ' found one period upstream for the region to be'
+                           ' treated as a tandem repeat; default is 0.1')
+    userInput.add_argument('-mm', '--max_mismatch', action='store',
+                           default=1, type=int, help='The max number of'
+                           ' mismatches between members of a phase class;'
+                           ' default is 1')
+
+    args = userInput.parse_args()
+
+    probe_df = read_region_probes(args.probe_file)
+
+    period = 0
+    score = 0.0
+
+    if len(probe_df) > 0:
+
+        sequence = read_region_seq(args.region_fa,probe_df['region'].iloc[0])
+
+        period,score = estimate_period(sequence,args.merlength,
+                                       args.min_period,args.max_period)
+
+    print("period: %s, score: %s" % (period,score))
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    #regions without a clear period keep every probe in its own class
+    if score < args.min_score:
+        period = 0
+
+    probe_df = assign_classes(probe_df,period,args.max_mismatch)
+
+    print("%s probes in %s classes" % (len(probe_df),
+                                       probe_df['phase_class'].nunique()))
+
+    write_classes(probe_df,period,args.out_file)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "plot_binding_maps"
+
+#import libraries
+import time
+import argparse
+import os
+from multiprocessing import Pool
+import get_alignments as ga
+
+##############################################################################
+
+def find_bin_arrays(bins_dir,out_dir):
+    """
+    This function pairs each bin array file under a directory with the path
+    of its binding map, keeping the scaffold directories of the bin files
+
+    Parameters
+    ----------
+    bins_dir : string
+        directory of bin arrays written by get_alignments or post_alignment
+    out_dir : string
+        directory the binding maps are written to
+
+    Returns
+    -------
+    plot_jobs : list
+        bin array file and binding map path of each repeat region
+    """
+
+    plot_jobs = []
+
+    for root,dirs,files in os.walk(bins_dir):
+
+        dirs.sort()
+
+        for file_name in sorted(files):
+
+            if not file_name.endswith("_bins.npz"):
+                continue
+
+            region = file_name[:-len("_bins.npz")]
+            plot_dir = os.path.join(out_dir,os.path.relpath(root,bins_dir))
+
+            plot_jobs.append((os.path.join(root,file_name),
+                              os.path.join(os.path.normpath(plot_dir),
+                                           region + "_genome_view.png")))
+
+    return plot_jobs
+
+##############################################################################
+
+def plot_region(plot_job):
+    """
+    This function draws the binding map of a repeat region from its bin
+    arrays
+
+    Parameters
+    ----------
+    plot_job : tuple
+        bin array file, binding map path and resolution of the map
+
+    Returns
+    -------
+    out_plot : string
+        the binding map written
+    """
+
+    bin_file,out_plot,dpi = plot_job
+
+    os.makedirs(os.path.dirname(out_plot), exist_ok=True)
+
+    ga.generate_plot(ga.read_bins(bin_file),out_plot,dpi)
+
+    return out_plot
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Draws the binding maps of every repeat region from the bin arrays
+    written by get_alignments or post_alignment, in one job after all
+    repeat regions are aligned, so that the summaries of each region are
+    not held up by plotting."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the directory of bin arrays written by get_alignments or'
+        'post_alignment. Returns the binding map of each repeat region.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-b', '--bins_dir', action='store',
+                               required=True, help='The directory of bin'
+                               'arrays of the repeat regions')
+    requiredNamed.add_argument('-o', '--out_dir', action='store',
+                               required=True, help='The directory the'
+                               'binding maps are written to')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of binding maps drawn at'
+                           ' once; default is 1')
+    userInput.add_argument('-dpi', '--dpi', action='store', default=300,
+                           type=int, help='Resolution of the binding maps,'
+                           ' lower values draw faster previews; default is'
+                           ' 300')
+
+    args = userInput.parse_args()
+
+    plot_jobs = [(bin_file,out_plot,args.dpi) for bin_file,out_plot in
+                 find_bin_arrays(args.bins_dir,args.out_dir)]
+
+    print("binding maps: %s" % len(plot_jobs))
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    with Pool(processes=max(1,args.threads)) as pool:
+        for out_plot in pool.imap_unordered(plot_region,plot_jobs):
+            print(out_plot)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
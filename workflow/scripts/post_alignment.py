@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "post_alignment"
+
+#import libraries
+import time
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import get_alignments as ga
+import collapse_repeat as cr
+import binding_pyramid as bp
+import binding_track as bt
+
+##############################################################################
+
+def read_alignments(align_file):
+    """
+    This function reads the alignments of the final probes of a repeat
+    region written by align_probes
+
+    Parameters
+    ----------
+    align_file : file
+        file of probe alignments with computed pdups
+
+    Returns
+    -------
+    pairs_pdups : dataframe
+        alignments with the columns read by get_alignments
+    """
+
+    colnames = ["align_coords","parent","derived",
+                "derived_chrom","align_start","pdups"]
+
+    pairs_pdups = pd.read_csv(align_file, names=colnames, header=None,
+                              sep='\t')
+
+    return pairs_pdups
+
+##############################################################################
+
+def read_repeat_bed(probe_file):
+    """
+    This function returns the coordinates of the repeat region from the
+    probe file written by alignment_filter, in place of get_region_bed
+
+    Parameters
+    ----------
+    probe_file : file
+        probe file of the repeat region from alignment_filter
+
+    Returns
+    -------
+    repeat_name : string
+        the repeat region, as chrom:start-end
+    repeat_bed : dataframe
+        chrom, start and end of the repeat region
+    """
+
+    colnames = ["probe_coords","repeat_coords","probe","Tm","repeat_count",
+                "genome_count","k-binding","k_norm","on_target_sum",
+                "off_target_sum","on_target_prop"]
+
+    probe_df = pd.read_csv(probe_file, delimiter = '\t', names = colnames)
+
+    repeat_coords = list(dict.fromkeys(probe_df['repeat_coords'].tolist()))
+
+    bed_rows = []
+    for coords in repeat_coords:
+        chrom,region = coords.split(':')
+        r_start,r_end = region.split('-')
+        bed_rows.append([chrom,int(r_start),int(r_end)])
+
+    repeat_bed = pd.DataFrame(bed_rows, columns=["chrom","start","stop"])
+
+    return repeat_coords[0],repeat_bed
+
+##############################################################################
+
+def derived_bed(pairs_pdups):
+    """
+    This function returns the bed coordinates of each alignment, in place
+    of make_derived_beds
+
+    Parameters
+    ----------
+    pairs_pdups : dataframe
+        alignments with the derived sequence and its start
+
+    Returns
+    -------
+    derived_df : dataframe
+        chrom, start and end of each alignment
+    """
+
+    starts = pairs_pdups['align_start'].astype(int).values
+    ends = starts + pairs_pdups['derived'].str.len().values
+
+    derived_df = pd.DataFrame({"chrom": pairs_pdups['derived_chrom'].values,
+                               "start": starts, "stop": ends})
+
+    return derived_df
+
+##############################################################################
+
+def intersect_bins(bed_df,chr_track):
+    """
+    This function pairs each interval with every genomic bin it overlaps by
+    at least one base, in the order written by bedtools intersect -wa -wb
+
+    Parameters
+    ----------
+    bed_df : dataframe
+        chrom, start and stop of each interval
+    chr_track : dataframe
+        chrom, bin_start and bin_stop of the genomic bins
+
+    Returns
+    -------
+    overlap_df : dataframe
+        the interval and the overlapped bin of each overlap
+    """
+
+    colnames = ["chrom", "start", "stop", "chrom_b","start_b","stop_b"]
+
+    row_list = []
+    bin_list = []
+
+    bed_df = bed_df.reset_index(drop=True)
+    chr_track = chr_track.reset_index(drop=True)
+
+    for chrom,group in bed_df.groupby('chrom',sort = False):
+
+        chrom_bins = chr_track.loc[chr_track['chrom'] == chrom]
+        chrom_bins = chrom_bins.sort_values(by=['bin_start'], kind='mergesort')
+
+        if len(chrom_bins) == 0:
+            continue
+
+        bin_starts = chrom_bins['bin_start'].values
+        bin_stops = chrom_bins['bin_stop'].values
+
+        #first bin ending after the start, last bin starting before the end
+        first = np.searchsorted(bin_stops,group['start'].values,side='right')
+        last = np.searchsorted(bin_starts,group['stop'].values,side='left')
+        n_bins = np.maximum(last - first,0)
+
+        offsets = np.arange(n_bins.sum()) - np.repeat(np.cumsum(n_bins) -
+                                                      n_bins,n_bins)
+
+        row_list.append(np.repeat(group.index.values,n_bins))
+        bin_list.append(chrom_bins.index.values[np.repeat(first,n_bins) +
+                                                offsets])
+
+    if not row_list:
+        return pd.DataFrame(columns=colnames)
+
+    rows = np.concatenate(row_list)
+    bins = np.concatenate(bin_list)
+
+    #keep the interval order of the bed file
+    order = np.argsort(rows,kind='stable')
+    rows = rows[order]
+    bins = bins[order]
+
+    overlap_df = pd.concat([bed_df.loc[rows,["chrom","start","stop"]]
+                            .reset_index(drop=True),
+                            chr_track.loc[bins,["chrom","bin_start",
+                                                "bin_stop"]]
+                            .reset_index(drop=True)], axis=1)
+    overlap_df.columns = colnames
+
+    return overlap_df
+
+##############################################################################
+
+def write_intermediates(intermediate_dir,repeat_name,derived_df,repeat_bed,
+                        chr_overlap,repeat_overlap):
+    """
+    This function writes the files of the derived_beds, get_region_bed and
+    bedtools_intersect steps, for inspection of a repeat region
+
+    Parameters
+    ----------
+    intermediate_dir : string
+        directory the intermediate files are written to
+    repeat_name : string
+        the repeat region, as chrom:start-end
+    derived_df : dataframe
+        bed coordinates of each alignment
+    repeat_bed : dataframe
+        bed coordinates of the repeat region
+    chr_overlap : dataframe
+        overlaps of the alignments with the genomic bins
+    repeat_overlap : dataframe
+        overlaps of the repeat region with the genomic bins
+
+    Returns
+    -------
+    None. Writes the intermediate files.
+    """
+
+    if not os.path.exists(intermediate_dir):
+        os.makedirs(intermediate_dir)
+
+    out_files = [(derived_df,"%s_derived.bed"),(repeat_bed,"%s.bed"),
+                 (chr_overlap,"%s_intersect.txt"),
+                 (repeat_overlap,"%s_repeat_intersect.txt")]
+
+    for out_df,file_name in out_files:
+        out_df.to_csv(os.path.join(intermediate_dir,file_name % repeat_name),
+                      header=False, index=False, sep="\t")
+
+##############################################################################
+
+def summarize_region(pairs_pdups,repeat_name,repeat_bed,probe_file,
+                     chrom_sizes,bin_width,thresh,chrom_summ,thresh_summ,
+                     probe_out,region_out,pyramid_out=None,track_out=None):
+    """
+    This function bins the alignments of the final probes of a repeat
+    region once into a binding pyramid and writes the genome wide and
+    thresholded binding and the probe and repeat summaries of the region
+
+    Parameters
+    ----------
+    pairs_pdups : dataframe
+        alignments with the columns read by get_alignments
+    repeat_name : string
+        the repeat region, as chrom:start-end
+    repeat_bed : dataframe
+        chrom, start and end of the repeat region
+    probe_file : file
+        probe file of the repeat region from alignment_filter
+    chrom_sizes : dictionary
+        scaffold is key and its size is value
+    bin_width : int
+        width of the genomic bins summarized
+    thresh : string
+        pdups >= to subset
+    chrom_summ : file
+        chrom pdups summ file
+    thresh_summ : file
+        threshold summ file
+    probe_out : file
+        the probe file with the imaging target region appended
+    region_out : file
+        the repeat binding summary file
+    pyramid_out : file
+        optional, the binding pyramid file of the repeat region
+    track_out : file
+        optional, the indexed binding track of the repeat region
+
+    Returns
+    -------
+    merged : dataframe
+        chrom, start, stop, pdups sum and bin type of all genomic bins
+    """
+
+    derived_df = derived_bed(pairs_pdups)
+
+    pyramid = bp.build_pyramid(derived_df['chrom'].tolist(),
+                               derived_df['start'].values,
+                               derived_df['stop'].values,
+                               pairs_pdups['pdups'].values,
+                               chrom_sizes,repeat_name,
+                               sorted(set(bp.DEFAULT_LEVELS) | {bin_width}))
+
+    if pyramid_out is not None:
+        bp.write_pyramid(pyramid,pyramid_out)
+
+    if track_out is not None:
+        bt.write_track(pyramid,track_out)
+
+    merged = bp.level_table(pyramid,bin_width)
+
+    ga.generate_summary_table(merged,thresh,thresh_summ,chrom_summ)
+
+    #repeats longer than 150 kb are collapsed from the thresholded bins
+    repeat_chrom,repeat_start,repeat_stop = repeat_bed.iloc[0].tolist()
+
+    if repeat_stop - repeat_start > 150000:
+
+        range_df = merged.loc[merged['pdups'] >= float(thresh)]
+        range_df = range_df.reset_index(drop=True)
+        range_df.columns = ["chrom","start","end","score","region"]
+
+        region_coords = cr.collapse_repeat(range_df)
+
+    else:
+
+        align_df = pairs_pdups.copy()
+        align_df.columns = ['probe_coords','probe','align','chrom','start',
+                            'pdup']
+
+        region_coords = cr.chart_alignment(align_df,repeat_name)
+
+    cr.append_repeat(region_coords,probe_file,probe_out,region_out)
+
+    return merged
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Takes the alignments of the final probes of a repeat region and
+    writes the genome wide and thresholded binding, the binding map and the
+    probe and repeat summaries in one process, in place of the derived_beds,
+    get_region_bed, bedtools_intersect, get_alignments and map_region_coords
+    jobs. The alignments are binned once into a binding pyramid and the
+    files passed between these jobs are only written when an intermediate
+    directory is given."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the probe alignment file and alignment_filter probe file'
+        'of a repeat region and the genome bin file. Returns the binding'
+        'summaries, binding map and probe file of the repeat region.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-a', '--align_path', action='store',
+                               required=True, help='The alignment file'
+                               'of the final probes of the repeat region')
+    requiredNamed.add_argument('-p', '--probe_file_path', action='store',
+                               required=True, help='The probe file of the'
+                               'repeat region from alignment_filter')
+    requiredNamed.add_argument('-c_t', '--chrom_track', action='store',
+                               required=True, help='The genome bin file')
+    requiredNamed.add_argument('-t', '--thresh', action='store',
+                               required=True, help='pdups >= to subset')
+    requiredNamed.add_argument('-c_s', '--chrom_summ', action='store',
+                               required=True, help='chrom pdups summ file')
+    requiredNamed.add_argument('-t_s', '--thresh_summ', action='store',
+                               required=True, help='threshold summ file')
+    requiredNamed.add_argument('-po', '--probe_out_path', action='store',
+                               required=True, help='The probe file with the'
+                               'imaging target region appended')
+    requiredNamed.add_argument('-ro', '--region_out_path', action='store',
+                               required=True, help='The repeat binding'
+                               'summary file')
+    userInput.add_argument('-pl', '--out_plot', action='store', default=None,
+                           help='output genome plot, not drawn if not given;'
+                           ' default is None')
+    userInput.add_argument('-ba', '--bin_arrays', action='store',
+                           default=None, help='file of bin arrays, from which'
+                           ' plot_binding_maps draws the genome plot later;'
+                           ' default is None')
+    userInput.add_argument('-i', '--intermediate_dir', action='store',
+                           default=None, help='Directory where the derived'
+                           ' bed, repeat bed and bin intersect files are'
+                           ' written; default is None')
+    userInput.add_argument('-py', '--pyramid_out', action='store',
+                           default=None, help='The binding pyramid file of'
+                           ' the repeat region, read by binding_pyramid at'
+                           ' any bin width; default is None')
+    userInput.add_argument('-bt', '--track_out', action='store',
+                           default=None, help='The indexed binding track of'
+                           ' the repeat region, with a zoom level for each'
+                           ' pyramid level; default is None')
+
+    args = userInput.parse_args()
+
+    pairs_pdups = read_alignments(args.align_path)
+
+    repeat_name,repeat_bed = read_repeat_bed(args.probe_file_path)
+
+    colnames = ["chrom","bin_start","bin_stop"]
+    chr_track = pd.read_csv(args.chrom_track, names=colnames, header=None,
+                            sep='\t')
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    if args.intermediate_dir is not None:
+        derived_df = derived_bed(pairs_pdups)
+        chr_overlap = intersect_bins(derived_df,chr_track)
+        repeat_overlap = intersect_bins(repeat_bed,chr_track)
+        write_intermediates(args.intermediate_dir,repeat_name,derived_df,
+                            repeat_bed,chr_overlap,repeat_overlap)
+
+    #alignments are binned once, at the threshold width and each level
+    chrom_sizes,bin_width = bp.read_genome_bins(args.chrom_track)
+
+    merged = summarize_region(pairs_pdups,repeat_name,repeat_bed,
+                              args.probe_file_path,chrom_sizes,bin_width,
+                              args.thresh,args.chrom_summ,args.thresh_summ,
+                              args.probe_out_path,args.region_out_path,
+                              args.pyramid_out,args.track_out)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    if args.bin_arrays is not None:
+        ga.write_bins(merged,args.bin_arrays)
+
+    if args.out_plot is not None:
+        ga.generate_plot(merged,args.out_plot)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
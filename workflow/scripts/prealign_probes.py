@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "prealign_probes"
+
+#import libraries
+import time
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+import alignment_filter as af
+
+##############################################################################
+
+def collect_probes(probe_paths):
+    """
+    Reads the probe files of every repeat region and keeps one copy of each
+    candidate probe sequence, with the coordinates where it was first seen
+
+    Parameters
+    ----------
+    probe_paths : list
+        probe files or make_chrom_dir directories of probe files
+
+    Returns
+    -------
+    probe_coords : dict
+        probe sequence to the coordinates of its first occurrence
+    n_candidates : int
+        number of candidate probes read across all regions
+    """
+
+    probe_coords = {}
+    n_candidates = 0
+
+    for path in probe_paths:
+
+        if os.path.isdir(path):
+            region_files = sorted(glob.glob(os.path.join(path,"*.txt")))
+        else:
+            region_files = [path]
+
+        for region_file in region_files:
+
+            probe_df = af.read_probe_filter(region_file)
+            n_candidates += len(probe_df)
+
+            for probe,coords in zip(probe_df['probe'].tolist(),
+                                    probe_df['probe_coords'].tolist()):
+                probe_coords.setdefault(probe,coords)
+
+    return probe_coords,n_candidates
+
+##############################################################################
+
+def init_worker(model_temp):
+    """
+    Configures the NUPACK model once in each worker process
+    """
+
+    global NUPACK_MODEL
+    NUPACK_MODEL = af.nupack_model(model_temp)
+
+##############################################################################
+
+def align_probe(task):
+    """
+    Aligns a probe sequence and scores its pdups, storing the result in the
+    shared alignment cache if it is not already there
+
+    Parameters
+    ----------
+    task : tuple
+        probe sequence, its coordinates and the alignment settings
+
+    Returns
+    -------
+    probe : string
+        the probe sequence processed
+    """
+
+    probe,coords,bowtie_idx,bt2_k_val,seed_length,align_cache = task
+
+    if not os.path.exists(af.alignment_cache_file(probe,align_cache)):
+
+        af.cached_pairwise_df(probe,coords,bowtie_idx,af.BOWTIE_STRING,
+                              af.STRAND_CONC_A,af.STRAND_CONC_B,NUPACK_MODEL,
+                              bt2_k_val,seed_length,0,align_cache)
+
+    return probe
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Collects the unique candidate probe sequences of every repeat region
+    of every scaffold and aligns and scores each of them once, filling the
+    shared alignment cache read by alignment_filter. Identical candidates
+    designed in several regions or scaffolds share one alignment, while
+    their on and off target split is still computed for each region."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the probe files of repeat regions and the bowtie2 index.'
+        'Fills the shared alignment cache with the alignments and pdups'
+        'scores of each unique candidate probe sequence.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--probe_paths', action='store',
+                               required=True, nargs='+', help='The probe'
+                               'files, or directories of probe files, of'
+                               'the repeat regions')
+    requiredNamed.add_argument('-c', '--align_cache', action='store',
+                               required=True, help='The shared alignment'
+                               'cache directory')
+    requiredNamed.add_argument('-b', '--bowtie_index', action='store',
+                               required=True, help='The path to the bowtie'
+                               'index to run the alignment algorithm')
+    requiredNamed.add_argument('-k', '--bt2_max_align', action='store',
+                               required=True, help='The max number of'
+                               'alignments to be returned by bowtie')
+    requiredNamed.add_argument('-l', '--seed_length', action='store',
+                               required=True, help='Seed length when'
+                               'returning bt2 alignments')
+    requiredNamed.add_argument('-t', '--model_temp', action='store',
+                               required=True, help='NUPACK model temp, (C)')
+    requiredNamed.add_argument('-o', '--out_file', action='store',
+                               required=True, help='File written once every'
+                               'probe sequence is in the cache')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                           type=int, help='Number of probe sequences aligned'
+                           ' at once; default is 1')
+
+    args = userInput.parse_args()
+
+    probe_coords,n_candidates = collect_probes(args.probe_paths)
+
+    print("%s candidate probes, %s unique sequences" % (n_candidates,
+                                                        len(probe_coords)))
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    align_cache = (args.align_cache,af.alignment_cache_tag(args.bowtie_index,
+                                                           af.BOWTIE_STRING,
+                                                           args.bt2_max_align,
+                                                           args.seed_length,
+                                                           args.model_temp))
+
+    af.create_dir(args.align_cache)
+
+    tasks = [(probe,coords,args.bowtie_index,args.bt2_max_align,
+              args.seed_length,align_cache)
+             for probe,coords in probe_coords.items()]
+
+    with Pool(processes=max(1,args.threads), initializer=init_worker,
+              initargs=(args.model_temp,)) as pool:
+        for probe in pool.imap_unordered(align_probe,tasks):
+            pass
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    with open(args.out_file,"w") as out_f:
+        out_f.write("%s\t%s\n" % (n_candidates,len(probe_coords)))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
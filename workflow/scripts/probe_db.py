@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "probe_db"
+
+#import libraries
+import time
+import argparse
+import os
+import glob
+import sqlite3
+import pandas as pd
+
+#columns of the final probe file written by merge_chrom_mapping
+PROBE_COLS = ["probe_coords","repeat_coords","align_region_coords","probe",
+              "Tm","r_count","h_count","k_score","k_norm","on_target_sum",
+              "off_target_sum","on_target_prop"]
+
+#interval columns of each table, as (table, coordinate prefix)
+INTERVALS = [("probes",""),("probes","repeat_"),("probes","target_"),
+             ("repeats",""),("bins","")]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    assembly TEXT NOT NULL,
+    run_name TEXT NOT NULL,
+    output_dir TEXT,
+    loaded TEXT,
+    UNIQUE (assembly, run_name)
+);
+CREATE TABLE IF NOT EXISTS probes (
+    run_id INTEGER NOT NULL,
+    chrom TEXT, start INTEGER, stop INTEGER,
+    repeat_id TEXT, repeat_chrom TEXT, repeat_start INTEGER,
+    repeat_stop INTEGER,
+    target_id TEXT, target_chrom TEXT, target_start INTEGER,
+    target_stop INTEGER,
+    probe TEXT, Tm REAL, r_count INTEGER, h_count INTEGER, k_score REAL,
+    k_norm REAL, on_target_sum REAL, off_target_sum REAL,
+    on_target_prop REAL
+);
+CREATE TABLE IF NOT EXISTS repeats (
+    run_id INTEGER NOT NULL,
+    repeat_id TEXT, chrom TEXT, start INTEGER, stop INTEGER,
+    probe_count INTEGER, on_target_sum REAL, off_target_sum REAL
+);
+CREATE TABLE IF NOT EXISTS bins (
+    run_id INTEGER NOT NULL,
+    repeat_id TEXT, chrom TEXT, start INTEGER, stop INTEGER, pdups REAL
+);
+CREATE TABLE IF NOT EXISTS spans (
+    name TEXT PRIMARY KEY,
+    max_span INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_run ON probes (run_id);
+CREATE INDEX IF NOT EXISTS probes_coords ON probes (chrom, start);
+CREATE INDEX IF NOT EXISTS probes_repeat ON probes (repeat_chrom,
+                                                    repeat_start);
+CREATE INDEX IF NOT EXISTS probes_target ON probes (target_chrom,
+                                                    target_start);
+CREATE INDEX IF NOT EXISTS probes_repeat_id ON probes (repeat_id);
+CREATE INDEX IF NOT EXISTS probes_seq ON probes (probe);
+CREATE INDEX IF NOT EXISTS probes_prop ON probes (on_target_prop);
+CREATE INDEX IF NOT EXISTS repeats_run ON repeats (run_id);
+CREATE INDEX IF NOT EXISTS repeats_coords ON repeats (chrom, start);
+CREATE INDEX IF NOT EXISTS repeats_id ON repeats (repeat_id);
+CREATE INDEX IF NOT EXISTS bins_run ON bins (run_id);
+CREATE INDEX IF NOT EXISTS bins_coords ON bins (chrom, start);
+CREATE INDEX IF NOT EXISTS bins_repeat_id ON bins (repeat_id);
+"""
+
+##############################################################################
+
+def split_coords(coords):
+    """
+    This function splits coordinates written as chrom:start-stop
+
+    Parameters
+    ----------
+    coords : series
+        coordinates as chrom:start-stop
+
+    Returns
+    -------
+    coords_df : dataframe
+        chrom, start and stop of each coordinate
+    """
+
+    coords_df = coords.str.rsplit(':', n=1, expand=True)
+    start_stop = coords_df[1].str.split('-', n=1, expand=True)
+
+    coords_df = pd.DataFrame({'chrom': coords_df[0],
+                              'start': start_stop[0].astype(int),
+                              'stop': start_stop[1].astype(int)})
+
+    return coords_df
+
+##############################################################################
+
+def connect_db(db_file):
+    """
+    This function opens the probe database, creating its tables and indexes
+    if they do not exist
+
+    Parameters
+    ----------
+    db_file : file
+        path of the probe database
+
+    Returns
+    -------
+    conn : connection
+        connection to the probe database
+    """
+
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA)
+
+    return conn
+
+##############################################################################
+
+def read_final_probes(probe_file):
+    """
+    This function reads the final probe file of a run as the rows of the
+    probes table
+
+    Parameters
+    ----------
+    probe_file : file
+        final probe file written by merge_chrom_mapping
+
+    Returns
+    -------
+    probe_df : dataframe
+        probe, repeat and imaging target coordinates and scores of each
+        probe
+    """
+
+    probe_df = pd.read_csv(probe_file, delimiter='\t', names=PROBE_COLS,
+                           header=None)
+
+    coords = split_coords(probe_df['probe_coords'])
+    repeat = split_coords(probe_df['repeat_coords'])
+    target = split_coords(probe_df['align_region_coords'])
+
+    probe_df = pd.DataFrame({
+        'chrom': coords['chrom'], 'start': coords['start'],
+        'stop': coords['stop'],
+        'repeat_id': probe_df['repeat_coords'],
+        'repeat_chrom': repeat['chrom'], 'repeat_start': repeat['start'],
+        'repeat_stop': repeat['stop'],
+        'target_id': probe_df['align_region_coords'],
+        'target_chrom': target['chrom'], 'target_start': target['start'],
+        'target_stop': target['stop'],
+        'probe': probe_df['probe'], 'Tm': probe_df['Tm'],
+        'r_count': probe_df['r_count'], 'h_count': probe_df['h_count'],
+        'k_score': probe_df['k_score'], 'k_norm': probe_df['k_norm'],
+        'on_target_sum': probe_df['on_target_sum'],
+        'off_target_sum': probe_df['off_target_sum'],
+        'on_target_prop': probe_df['on_target_prop']})
+
+    return probe_df
+
+##############################################################################
+
+def read_summary(summary_file):
+    """
+    This function reads the final probe summary of a run as the rows of the
+    repeats table
+
+    Parameters
+    ----------
+    summary_file : file
+        final probe summary written by finish_summary
+
+    Returns
+    -------
+    repeat_df : dataframe
+        coordinates, probe count and binding sums of each repeat
+    """
+
+    summ_df = pd.read_csv(summary_file, delimiter='\t')
+
+    coords = split_coords(summ_df['repeat_coords'].astype(str))
+
+    repeat_df = pd.DataFrame({'repeat_id': summ_df['repeat_coords'],
+                              'chrom': coords['chrom'],
+                              'start': coords['start'],
+                              'stop': coords['stop'],
+                              'probe_count': summ_df['probe_count'],
+                              'on_target_sum': summ_df['on_target_sum'],
+                              'off_target_sum': summ_df['off_target_sum']})
+
+    return repeat_df
+
+##############################################################################
+
+def read_thresh_bins(thresh_dir):
+    """
+    This function reads the thresholded binding of every repeat region of a
+    run as the rows of the bins table
+
+    Parameters
+    ----------
+    thresh_dir : string
+        directory of thresholded binding files written by get_alignments or
+        post_alignment
+
+    Returns
+    -------
+    bin_df : dataframe
+        repeat region, coordinates and pdups sum of each bin
+    """
+
+    colnames = ["chrom","start","stop","pdups","bin_type"]
+
+    bin_list = []
+    thresh_files = sorted(glob.glob(os.path.join(thresh_dir,'**',
+                                                 '*_thresh_binding.txt'),
+                                    recursive=True))
+
+    for thresh_file in thresh_files:
+
+        if os.path.getsize(thresh_file) == 0:
+            continue
+
+        thresh_df = pd.read_csv(thresh_file, delimiter='\t', names=colnames,
+                                header=None)
+
+        repeat_id = os.path.basename(thresh_file)[:-len("_thresh_binding.txt")]
+        thresh_df.insert(0,'repeat_id',repeat_id)
+
+        bin_list.append(thresh_df.drop(columns=['bin_type']))
+
+    if not bin_list:
+        return pd.DataFrame(columns=["repeat_id","chrom","start","stop",
+                                     "pdups"])
+
+    return pd.concat(bin_list, ignore_index=True)
+
+##############################################################################
+
+def update_spans(conn):
+    """
+    This function records the longest interval of each coordinate column,
+    which bounds the index range read by interval queries
+
+    Parameters
+    ----------
+    conn : connection
+        connection to the probe database
+
+    Returns
+    -------
+    None. Updates the spans table.
+    """
+
+    for table,prefix in INTERVALS:
+
+        max_span = conn.execute("SELECT MAX(%sstop - %sstart) FROM %s" %
+                                (prefix,prefix,table)).fetchone()[0]
+
+        conn.execute("INSERT OR REPLACE INTO spans VALUES (?, ?)",
+                     (table + "." + prefix, int(max_span or 0)))
+
+##############################################################################
+
+def load_run(conn,output_dir,assembly,run_name):
+    """
+    This function loads the final probes, probe summary and thresholded
+    binding of a pipeline run into the probe database. A run that was
+    loaded before under the same assembly and run name is replaced, and
+    the rows of all other runs are kept.
+
+    Parameters
+    ----------
+    conn : connection
+        connection to the probe database
+    output_dir : string
+        pipeline_output directory of the run
+    assembly : string
+        assembly named in the config.yml of the run
+    run_name : string
+        name the run is stored under
+
+    Returns
+    -------
+    load_summ : dictionary
+        number of probes, repeats and bins loaded
+    """
+
+    core_dir = os.path.join(output_dir,"03_core_output")
+
+    probe_df = read_final_probes(os.path.join(core_dir,
+                                 "%s_final_probes.txt" % assembly))
+    repeat_df = read_summary(os.path.join(core_dir,
+                             "%s_final_probe_summary.txt" % assembly))
+    bin_df = read_thresh_bins(os.path.join(output_dir,
+                                           "04_supplementary_output",
+                                           "02_threshold_binding"))
+
+    with conn:
+
+        row = conn.execute("SELECT run_id FROM runs WHERE assembly = ? AND "
+                           "run_name = ?", (assembly,run_name)).fetchone()
+
+        if row is not None:
+            for table in ["probes","repeats","bins"]:
+                conn.execute("DELETE FROM %s WHERE run_id = ?" % table, row)
+            conn.execute("DELETE FROM runs WHERE run_id = ?", row)
+
+        run_id = conn.execute("INSERT INTO runs (assembly, run_name, "
+                              "output_dir, loaded) VALUES (?, ?, ?, "
+                              "datetime('now'))",
+                              (assembly,run_name,
+                               os.path.abspath(output_dir))).lastrowid
+
+        for table,table_df in [("probes",probe_df),("repeats",repeat_df),
+                               ("bins",bin_df)]:
+
+            table_df = table_df.copy()
+            table_df.insert(0,'run_id',run_id)
+
+            conn.executemany("INSERT INTO %s (%s) VALUES (%s)" %
+                             (table,", ".join(table_df.columns),
+                              ", ".join("?" * len(table_df.columns))),
+                             table_df.astype(object).values.tolist())
+
+        update_spans(conn)
+
+    load_summ = {'probes': len(probe_df), 'repeats': len(repeat_df),
+                 'bins': len(bin_df)}
+
+    return load_summ
+
+##############################################################################
+
+def query_table(conn,table,chrom=None,start=None,stop=None,by="",
+                assembly=None,run_name=None,filters=None,limit=None,
+                offset=0):
+    """
+    This function returns the rows of a table of the probe database whose
+    interval overlaps a window and that satisfy the filters given. Interval
+    queries read the coordinate index from the window start less the
+    longest stored interval, so only nearby rows are scanned.
+
+    Parameters
+    ----------
+    conn : connection
+        connection to the probe database
+    table : string
+        probes, repeats or bins
+    chrom : string
+        scaffold of the window, no interval query if None
+    start : int
+        start of the window
+    stop : int
+        end of the window
+    by : string
+        coordinate prefix of the interval, "", "repeat_" or "target_" for
+        probes
+    assembly : string
+        only rows of runs of this assembly if given
+    run_name : string
+        only rows of runs of this name if given
+    filters : list
+        (column, operator, value) conditions rows must satisfy
+    limit : int
+        max number of rows returned
+    offset : int
+        number of rows skipped before the rows returned
+
+    Returns
+    -------
+    result_df : dataframe
+        the assembly and run name and columns of each row
+    """
+
+    conditions = []
+    values = []
+
+    if chrom is not None:
+
+        row = conn.execute("SELECT max_span FROM spans WHERE name = ?",
+                           (table + "." + by,)).fetchone()
+        max_span = row[0] if row is not None else 0
+
+        conditions.append("t.{0}chrom = ? AND t.{0}start >= ? AND "
+                          "t.{0}start < ? AND t.{0}stop > ?".format(by))
+        values.extend([chrom,int(start) - max_span,int(stop),int(start)])
+
+    if assembly is not None:
+        conditions.append("r.assembly = ?")
+        values.append(assembly)
+
+    if run_name is not None:
+        conditions.append("r.run_name = ?")
+        values.append(run_name)
+
+    for column,operator,value in (filters or []):
+        if operator not in ("=","<","<=",">",">="):
+            raise ValueError("Unsupported operator %s" % operator)
+        conditions.append("t.%s %s ?" % (column,operator))
+        values.append(value)
+
+    sql = ("SELECT r.assembly, r.run_name, t.* FROM %s t JOIN runs r ON "
+           "t.run_id = r.run_id" % table)
+
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+
+    sql += " ORDER BY t.{0}chrom, t.{0}start, t.rowid".format(by)
+
+    if limit is not None:
+        sql += " LIMIT %d OFFSET %d" % (int(limit),int(offset))
+
+    result_df = pd.read_sql_query(sql, conn, params=values)
+
+    return result_df.drop(columns=['run_id'])
+
+##############################################################################
+
+def parse_window(window):
+    """
+    This function splits a window written as chrom:start-stop, or chrom for
+    a whole scaffold
+
+    Parameters
+    ----------
+    window : string
+        the window queried
+
+    Returns
+    -------
+    chrom,start,stop : tuple
+        scaffold, start and end of the window
+    """
+
+    if ':' not in window:
+        return window,0,2**62
+
+    chrom,coords = window.rsplit(':',1)
+    start,stop = coords.replace(',','').split('-')
+
+    return chrom,int(start),int(stop)
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Loads the final outputs of pipeline runs into a probe database and
+    queries probes, repeats and thresholded binding bins by interval and
+    attribute."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires a probe database file. Loads the final probes, probe'
+        'summary and thresholded binding of a pipeline run into it, or'
+        'returns the rows overlapping a window that satisfy the filters.')
+
+    subparsers = userInput.add_subparsers(dest='command')
+    subparsers.required = True
+
+    loadInput = subparsers.add_parser('load', help='Load a pipeline run')
+    requiredNamed = loadInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-d', '--db_file', action='store',
+                               required=True, help='The probe database')
+    requiredNamed.add_argument('-o', '--output_dir', action='store',
+                               required=True, help='The pipeline_output'
+                               'directory of the run')
+    requiredNamed.add_argument('-a', '--assembly', action='store',
+                               required=True, help='The assembly of the run')
+    loadInput.add_argument('-r', '--run_name', action='store', default=None,
+                           help='The name the run is stored under, a run'
+                           ' loaded before under this name is replaced;'
+                           ' default is the directory holding OUTPUT_DIR')
+    loadInput.add_argument('-l', '--load_summ', action='store', default=None,
+                           help='File of the number of rows loaded; default'
+                           ' is None')
+
+    queryInput = subparsers.add_parser('query', help='Query loaded runs')
+    requiredNamed = queryInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-d', '--db_file', action='store',
+                               required=True, help='The probe database')
+    queryInput.add_argument('-t', '--table', action='store',
+                            default='probes', choices=['probes','repeats',
+                                                       'bins'],
+                            help='The table queried; default is probes')
+    queryInput.add_argument('-w', '--window', action='store', default=None,
+                            help='Window as chrom:start-stop or chrom;'
+                            ' default is None')
+    queryInput.add_argument('-b', '--by', action='store', default='repeat',
+                            choices=['probe','repeat','target'],
+                            help='Probe interval overlapped with the window;'
+                            ' default is repeat')
+    queryInput.add_argument('-a', '--assembly', action='store', default=None,
+                            help='Only runs of this assembly; default is'
+                            ' None')
+    queryInput.add_argument('-r', '--run_name', action='store', default=None,
+                            help='Only runs of this name; default is None')
+    queryInput.add_argument('-ri', '--repeat_id', action='store',
+                            default=None, help='Only rows of this repeat'
+                            ' region; default is None')
+    queryInput.add_argument('-s', '--sequence', action='store', default=None,
+                            help='Only probes of this sequence; default is'
+                            ' None')
+    queryInput.add_argument('-p', '--min_on_target_prop', action='store',
+                            default=None, type=float, help='Only probes with'
+                            ' on_target_prop above this value; default is'
+                            ' None')
+    queryInput.add_argument('-n', '--limit', action='store', default=None,
+                            type=int, help='Max number of rows returned;'
+                            ' default is None')
+    queryInput.add_argument('-out', '--out_file', action='store',
+                            default=None, help='File the rows are written'
+                            ' to; default is stdout')
+
+    args = userInput.parse_args()
+
+    conn = connect_db(args.db_file)
+
+    if args.command == 'load':
+
+        run_name = args.run_name
+        if run_name is None:
+            run_name = os.path.basename(os.path.dirname(
+                os.path.abspath(args.output_dir)))
+
+        load_summ = load_run(conn,args.output_dir,args.assembly,run_name)
+
+        print("loaded %s: %s" % (run_name,load_summ))
+
+        if args.load_summ is not None:
+            pd.DataFrame([dict(assembly=args.assembly,run_name=run_name,
+                               **load_summ)]).to_csv(args.load_summ,
+                                                     index=False, sep="\t")
+
+    else:
+
+        chrom,start,stop = None,None,None
+        if args.window is not None:
+            chrom,start,stop = parse_window(args.window)
+
+        by = ""
+        if args.table == 'probes' and args.by != 'probe':
+            by = args.by + "_"
+
+        filters = []
+        if args.repeat_id is not None:
+            filters.append(('repeat_id','=',args.repeat_id))
+        if args.sequence is not None and args.table == 'probes':
+            filters.append(('probe','=',args.sequence.upper()))
+        if args.min_on_target_prop is not None and args.table == 'probes':
+            filters.append(('on_target_prop','>',args.min_on_target_prop))
+
+        result_df = query_table(conn,args.table,chrom,start,stop,by,
+                                args.assembly,args.run_name,filters,
+                                args.limit)
+
+        #rows written to stdout are not followed by the timing
+        if args.out_file is None:
+            print(result_df.to_csv(index=False, sep="\t"), end="")
+            conn.close()
+            return
+
+        result_df.to_csv(args.out_file, index=False, sep="\t")
+
+    conn.close()
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+if __name__ == '__main__':
+    main()
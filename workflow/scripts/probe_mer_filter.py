@@ -15,8 +15,11 @@ script_name = "probe_mer_filter"
 #load libraries used
 import time
 import argparse
+from multiprocessing import Pool
+import numpy as np
 import pandas as pd
 from itertools import groupby
+import kmer_filter as kf
 
 ##############################################################################
 
@@ -45,7 +48,29 @@ def read_region(file_path, ENRICH, COPY_NUM):
     
     #read as a dataframe
     region_df = pd.read_csv(file_path, delimiter = '\t', names = colnames)
-        
+
+    return filter_region(region_df, ENRICH, COPY_NUM)
+
+##############################################################################
+
+def filter_region(region_df, ENRICH, COPY_NUM):
+    """
+    Filters probes of a dataframe with normalized filter scores using the
+    ENRICH and COPY_NUM values, then sorts them by k_norm.
+
+    Parameters
+    ----------
+    region_df : dataframe
+        probes with pre-filter k_score and k_norm values.
+
+    Returns
+    -------
+    region_df : dataframe
+        filtered dataframe that contains the filtered probes based on user
+        specified arguments
+
+    """
+
     region_df['k_score']=region_df['k_score'].astype(float)
 
     #filters dataframe based on user parameters
@@ -59,38 +84,139 @@ def read_region(file_path, ENRICH, COPY_NUM):
 
 ##############################################################################
 
-def split_mers(region_df,MERLENGTH):
+def budget_candidates(region_df,budget,n_strata):
     """
-    Implements the generate_kmers function to add a column to the probe
-    dataframe that decomposes each probe into it's k-mers (length specified
-    by user)
+    Keeps at most budget candidate probes in each repeat region, after the
+    ENRICH and COPY_NUM filter so that no slot goes to a probe it removes.
+    The extent of a region is split into n_strata equal windows by probe
+    start, and probes are taken in turns from each window in order of k_norm,
+    so that the kept probes are spread across the region rather than crowded
+    into its best scoring part.
+
+    Parameters
+    ----------
+    region_df : dataframe
+        probes passing the ENRICH and COPY_NUM filter, with k_norm values
+    budget : int
+        max number of candidate probes kept in each repeat region
+    n_strata : int
+        number of windows each repeat region is split into
+
+    Returns
+    -------
+    region_df : dataframe
+        the kept probes, in the same order as before
+    budget_df : dataframe
+        number of candidates, kept and dropped probes and the lowest kept
+        and highest dropped k_norm of each repeat region. The highest
+        dropped k_norm is 0 for a region that drops no probe. As windows
+        are taken in turns, a dropped probe may score above a kept one.
+    """
+
+    grouped_regions = region_df.groupby('region',sort = False)
+
+    #window of each probe within the extent of its region
+    region_min = grouped_regions['p_start'].transform('min')
+    region_extent = grouped_regions['p_start'].transform('max') - region_min + 1
+    strata = ((region_df['p_start'] - region_min) *
+              max(1,n_strata)) // region_extent
+
+    #probes are taken in turns from each window, best scores first
+    strata_rank = region_df.groupby([region_df['region'],strata],
+                                    sort = False)['k_norm'].rank(
+                                        method='first', ascending=False)
+
+    turn_df = pd.DataFrame({'region': region_df['region'],
+                            'rank': strata_rank,
+                            'score': -region_df['k_norm']})
+    turn_df = turn_df.sort_values(by=['rank','score'], kind='mergesort')
+
+    kept = turn_df.groupby('region',sort = False).cumcount() < budget
+    kept = kept.reindex(region_df.index)
+
+    budget_rows = []
+    for name,group in region_df.groupby('region',sort = False):
+        group_kept = kept[group.index]
+        n_dropped = int((~group_kept).sum())
+
+        #a region that drops nothing has no dropped score to report
+        if n_dropped > 0:
+            max_dropped = group['k_norm'][~group_kept].max()
+        else:
+            max_dropped = 0
+
+        budget_rows.append([name,len(group),int(group_kept.sum()),
+                            n_dropped,group['k_norm'][group_kept].min(),
+                            max_dropped])
+
+    budget_df = pd.DataFrame(budget_rows, columns=['region','candidates',
+                                                   'kept','dropped',
+                                                   'min_kept_score',
+                                                   'max_dropped_score'])
+
+    return region_df[kept],budget_df
+
+##############################################################################
+
+def write_budget(budget_df,budget_file):
+    """
+    Writes the number of candidates dropped by the candidate budget and the
+    lowest kept and highest dropped k_norm of each repeat region
+
+    Parameters
+    ----------
+    budget_df : dataframe
+        candidate budget summary of each repeat region
+    budget_file : file
+        path of the tab separated summary file
+
+    Returns
+    -------
+    None. Writes the candidate budget summary.
+    """
+
+    budget_df.to_csv(str(budget_file), header=True, index=False, sep="\t")
+
+##############################################################################
+
+def split_mers(region_df,MERLENGTH,probe_codes=None):
+    """
+    Adds a column to the probe dataframe that decomposes each probe into the
+    2-bit integer codes of its k-mers (length specified by user). K-mers
+    holding bases other than A, C, G and T are given codes above those of
+    any A, C, G and T k-mer, one per distinct k-mer.
     
     Parameters
     ----------
     region_df : dataframe
         dataframe that contains the probe sequences
+    probe_codes : dictionary
+        optional, probe seq is key and the k-mer codes already built for it
+        by kmer_filter are val, so the probes are not encoded again
 
     Returns
     -------
     region_df : dataframe
-        dataframe that now contains a column that is a list of k-mers
+        dataframe that now contains a column that is an array of k-mer codes
         for the probe sequence
     """
 
     #make a list of the probes in the dataframe that have been filtered
     probe_list = region_df['probe'].tolist()
 
-    #make a list for the k-mers
-    all_mers_list = []
-    
-    #iterate over each probe in the list
-    for probe in probe_list:
-        #decompose the probe into k-mers of given length
-        mer_list = generate_kmers(probe,MERLENGTH)
-        #append list to list
-        all_mers_list.append(mer_list)
-
-    #add list of lists to appropriate dataframe rows
+    if probe_codes is not None:
+        all_mers_list = [probe_codes[probe] for probe in probe_list]
+    else:
+        #probes are joined by a base that is not coded, and every k-mer
+        #that spans two probes is dropped when the codes are split by probe
+        joined = "N".join(probe_list)
+        codes,rc_codes,valid = kf.sequence_kmer_codes(joined,MERLENGTH)
+
+        #make a list for the k-mer codes
+        all_mers_list = kf.probe_kmer_codes(probe_list,codes,valid,
+                                            MERLENGTH)
+
+    #add list of arrays to appropriate dataframe rows
     region_df['mers_list'] = all_mers_list
 
     return region_df
@@ -130,19 +256,65 @@ def generate_kmers(sequence,k_size):
 
 ##############################################################################
 
-def rm_shared_mer_probes(region_df,MER_CUTOFF):
+def shared_mer_probes(task):
+    """
+    Flags the probes of one repeat region that share at least MER_CUTOFF of
+    their k-mers with the higher ranking probes of the region. The keep set
+    holds the k-mers of every higher ranking probe whether or not it was
+    flagged, so a k-mer is shared exactly when its code first occurs earlier
+    in the probe ordered list of all the region's k-mers.
+
+    Parameters
+    ----------
+    task : tuple
+        list of probes in rank order, list of their k-mer code arrays and
+        MER_CUTOFF
+
+    Returns
+    -------
+    probe_to_remove : list
+        probes flagged to be removed
+    """
+
+    probes_list,max_mers_list,MER_CUTOFF = task
+
+    list_lens = np.array([len(mers) for mers in max_mers_list])
+    all_mers = np.concatenate(max_mers_list)
+
+    #index where each k-mer code first occurs in the region
+    first_seen,mer_inverse = np.unique(all_mers,return_index=True,
+                                       return_inverse=True)[1:]
+    shared = first_seen[mer_inverse] < np.arange(len(all_mers))
+
+    #number of k-mers of each probe that are in the keep set
+    in_counts = np.bincount(np.repeat(np.arange(len(list_lens)),list_lens),
+                            weights=shared,minlength=len(list_lens))
+
+    #compute proportion of shared k-mers
+    #if proportion is >= cutoff, then you want to cull
+    #the top ranking probe is always kept
+    cull = in_counts[1:] / list_lens[1:] >= MER_CUTOFF
+
+    return [probe for probe,flag in zip(probes_list[1:],cull) if flag]
+
+##############################################################################
+
+def rm_shared_mer_probes(region_df,MER_CUTOFF,threads=1):
     """
     For all repeat regions that have more than one probe in them, this
-    function will take the list of k-mers and add the top ranking probe
-    based on k_norm into a set. For all probes within the same repeat region,
-    if, it shares at least >= specified mer_cutoff (user specified prop), 
-    the probe is removed from the final probe set. This list column of each
-    probes k-mers is then dropped.
+    function will take the k-mers of the top ranking probe based on k_norm
+    into a keep set. For all probes within the same repeat region, if it
+    shares at least >= specified mer_cutoff (user specified prop) with the
+    keep set, the probe is removed from the final probe set, and its k-mers
+    join the keep set. The column of each probes k-mer codes is then
+    dropped.
 
     Parameters
     ----------
     region_df : dataframe
         contains relevant probes before mer filtering
+    threads : int
+        number of repeat regions filtered at once
 
     Returns
     -------
@@ -157,42 +329,14 @@ def rm_shared_mer_probes(region_df,MER_CUTOFF):
     
     #do a groupby over the repeat regions
     grouped_regions=region_df.groupby('region',sort=False)
-    
-    for name,group in grouped_regions:
-        #if there is more than one probe in a given repeat region
-        if len(group) > 1:
-            
-            #gets a list of all k-mers in each probe
-            max_mers_list = group['mers_list'].tolist()
-    
-            #defines top ranking "keep set of 18-mers"
-            keep_mers_set = set(max_mers_list[0])
-        
-            #get a list of all probes
-            probes_list = group['probe'].tolist()
-            
-            for i in range(1,len(max_mers_list)):
-                #will keep track of number of 18-mers within a given mers
-                #list in the keep set
-                
-                in_count = 0
-                #iterates starting with max_mers_list[1]
-                for mer in max_mers_list[i]:
-                    #checks if a mer is in the keep set
-                    if mer in keep_mers_set:
-                        #if so tally count
-                        in_count += 1
-                    if mer not in keep_mers_set:
-                        #if mer is unique add it to the keep set
-                        keep_mers_set.add(mer)
-        
-                #take the lengh of the given max_mer_list[i]
-                list_len = len(max_mers_list[i])
 
-                #compute proportion of shared 18-mers
-                #if proportion is >= cutoff, then you want to cull
-                if float(in_count/list_len) >= MER_CUTOFF:
-                    probe_to_remove.append(probes_list[i])
+    #only regions with more than one probe can lose a probe
+    tasks = [(group['probe'].tolist(),group['mers_list'].tolist(),MER_CUTOFF)
+             for name,group in grouped_regions if len(group) > 1]
+
+    with Pool(processes=max(1,threads)) as pool:
+        for region_remove in pool.imap(shared_mer_probes,tasks):
+            probe_to_remove.extend(region_remove)
     
     #remove rows of the dataframe that have probes that should be filtered
     region_df = region_df[~region_df['probe'].isin(probe_to_remove)]
@@ -253,6 +397,21 @@ def main():
                        'shared mers used to filter probes')
     userInput.add_argument('-k', '--merlength', action='store', default=18, 
                        required = True, type=int, help='The kmer length')
+    userInput.add_argument('-n', '--threads', action='store', default=1,
+                       type=int, help='Number of repeat regions filtered at'
+                       ' once; default is 1')
+    userInput.add_argument('-cb', '--candidate_budget', action='store',
+                       default=0, type=int, help='The max number of'
+                       ' candidate probes kept in each repeat region, 0'
+                       ' keeps every candidate; default is 0')
+    userInput.add_argument('-bs', '--budget_strata', action='store',
+                       default=10, type=int, help='The number of windows'
+                       ' across each repeat region the candidate budget'
+                       ' is spread over; default is 10')
+    userInput.add_argument('-bo', '--budget_out', action='store',
+                       default=None, help='File of candidates dropped and'
+                       ' lowest kept and highest dropped score of each'
+                       ' repeat region; default is None')
     
     args = userInput.parse_args()
     file_path = args.file_path
@@ -261,15 +420,28 @@ def main():
     COPY_NUM=args.copy_num
     MER_CUTOFF = args.mer_cutoff
     MERLENGTH = args.merlength
+    threads = args.threads
 
 
     region_df = read_region(file_path,ENRICH,COPY_NUM)
     print("---%s seconds ---"%(time.time()-start_time))
 
+    if args.candidate_budget > 0:
+
+        region_df,budget_df = budget_candidates(region_df,
+                                                args.candidate_budget,
+                                                args.budget_strata)
+
+        print("candidate budget: %s probes dropped" %
+              budget_df['dropped'].sum())
+
+        if args.budget_out is not None:
+            write_budget(budget_df,args.budget_out)
+
     region_df = split_mers(region_df,MERLENGTH)
     print("---%s seconds ---"%(time.time()-start_time))
 
-    region_df = rm_shared_mer_probes(region_df,MER_CUTOFF)
+    region_df = rm_shared_mer_probes(region_df,MER_CUTOFF,threads)
     print("---%s seconds ---"%(time.time()-start_time))
         
     write_file(region_df,out_path)
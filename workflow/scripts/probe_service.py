@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "probe_service"
+
+#import libraries
+import time
+import argparse
+import os
+import json
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+import probe_db as pdb
+
+#probe coordinates searched by each value of the by parameter
+COORD_PREFIX = {"probe": "", "repeat": "repeat_", "target": "target_"}
+
+##############################################################################
+
+def read_runs(output_dirs,assembly):
+    """
+    This function reads the final probes of one or more pipeline runs
+
+    Parameters
+    ----------
+    output_dirs : list
+        pipeline_output directories of the runs
+    assembly : string
+        assembly named in the config.yml of the runs
+
+    Returns
+    -------
+    probe_df : dataframe
+        the run name, coordinates and scores of each probe
+    """
+
+    run_list = []
+
+    for output_dir in output_dirs:
+
+        probe_file = os.path.join(output_dir,"03_core_output",
+                                  "%s_final_probes.txt" % assembly)
+
+        run_df = pdb.read_final_probes(probe_file)
+        run_df.insert(0,'run_name',os.path.basename(os.path.dirname(
+            os.path.abspath(output_dir))))
+        run_df.insert(0,'assembly',assembly)
+
+        run_list.append(run_df)
+
+    return pd.concat(run_list, ignore_index=True)
+
+##############################################################################
+
+def build_index(probe_df):
+    """
+    This function builds the in memory interval, repeat and sequence index
+    of the probes. For each scaffold and coordinate set the probe starts are
+    kept sorted, and the longest interval bounds the starts searched by a
+    window.
+
+    Parameters
+    ----------
+    probe_df : dataframe
+        the run name, coordinates and scores of each probe
+
+    Returns
+    -------
+    index : dictionary
+        probe records, interval index and repeat and sequence lookups
+    """
+
+    #records are serialized once, with missing values as null
+    records = probe_df.astype(object).where(pd.notnull(probe_df),None)
+    records = records.to_dict('records')
+
+    intervals = {}
+    for by,prefix in COORD_PREFIX.items():
+
+        intervals[by] = {}
+        chroms = probe_df[prefix + 'chrom'].values
+        starts = probe_df[prefix + 'start'].values.astype(np.int64)
+        stops = probe_df[prefix + 'stop'].values.astype(np.int64)
+
+        for chrom in pd.unique(chroms):
+
+            rows = np.flatnonzero(chroms == chrom)
+            rows = rows[np.argsort(starts[rows],kind='mergesort')]
+
+            intervals[by][chrom] = (rows,starts[rows],stops[rows],
+                                    int((stops[rows] - starts[rows]).max()))
+
+    index = {'records': records,
+             'intervals': intervals,
+             'repeat_id': probe_df.groupby('repeat_id',sort=False).indices,
+             'sequence': probe_df.groupby('probe',sort=False).indices}
+
+    return index
+
+##############################################################################
+
+def window_rows(index,chrom,start,stop,by="repeat"):
+    """
+    This function returns the probes whose interval overlaps a window
+
+    Parameters
+    ----------
+    index : dictionary
+        in memory index of the probes
+    chrom : string
+        scaffold of the window
+    start : int
+        start of the window
+    stop : int
+        end of the window
+    by : string
+        probe, repeat or target interval overlapped with the window
+
+    Returns
+    -------
+    rows : array
+        the probes overlapping the window, ordered by start
+    """
+
+    if chrom not in index['intervals'][by]:
+        return np.array([],dtype=np.int64)
+
+    rows,starts,stops,max_span = index['intervals'][by][chrom]
+
+    lo = np.searchsorted(starts,start - max_span,side='left')
+    hi = np.searchsorted(starts,stop,side='left')
+
+    in_window = stops[lo:hi] > start
+
+    return rows[lo:hi][in_window]
+
+##############################################################################
+
+def lookup(index,params):
+    """
+    This function returns a page of the probes matching a query
+
+    Parameters
+    ----------
+    index : dictionary
+        in memory index of the probes
+    params : dictionary
+        the window, by, repeat_id, sequence, min_on_target_prop, page and
+        page_size of the query
+
+    Returns
+    -------
+    response : dictionary
+        total number of matching probes and the probes of the page
+    """
+
+    if 'window' in params:
+        chrom,start,stop = pdb.parse_window(params['window'])
+        rows = window_rows(index,chrom,start,stop,params.get('by','repeat'))
+    elif 'repeat_id' in params:
+        rows = index['repeat_id'].get(params['repeat_id'],[])
+    elif 'sequence' in params:
+        rows = index['sequence'].get(params['sequence'].upper(),[])
+    else:
+        raise ValueError("A window, repeat_id or sequence is required")
+
+    records = [index['records'][i] for i in rows]
+
+    if 'min_on_target_prop' in params:
+        min_prop = float(params['min_on_target_prop'])
+        records = [r for r in records if r['on_target_prop'] is not None and
+                   r['on_target_prop'] > min_prop]
+
+    page = max(1,int(params.get('page',1)))
+    page_size = min(1000,max(1,int(params.get('page_size',100))))
+
+    response = {'total': len(records), 'page': page, 'page_size': page_size,
+                'probes': records[(page - 1) * page_size:page * page_size]}
+
+    return response
+
+##############################################################################
+
+def make_handler(index,cache_size):
+    """
+    This function returns the request handler of the probe service, with
+    the responses of the most recent queries kept in a cache
+
+    Parameters
+    ----------
+    index : dictionary
+        in memory index of the probes
+    cache_size : int
+        number of responses kept in the cache
+
+    Returns
+    -------
+    ProbeHandler : class
+        request handler of the probe service
+    """
+
+    @lru_cache(maxsize=cache_size)
+    def respond(query):
+
+        params = dict(query)
+
+        try:
+            return 200,json.dumps(lookup(index,params)).encode()
+        except (ValueError,KeyError) as error:
+            return 400,json.dumps({'error': str(error)}).encode()
+
+    class ProbeHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+
+            url = urlparse(self.path)
+
+            if url.path == '/health':
+                status,body = 200,json.dumps(
+                    {'probes': len(index['records'])}).encode()
+            elif url.path == '/probes':
+                query = tuple(sorted((k,v[0]) for k,v in
+                                     parse_qs(url.query).items()))
+                status,body = respond(query)
+            else:
+                status,body = 404,json.dumps({'error': 'not found'}).encode()
+
+            self.send_response(status)
+            self.send_header('Content-Type','application/json')
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self,format,*args):
+            return
+
+    ProbeHandler.respond = staticmethod(respond)
+
+    return ProbeHandler
+
+##############################################################################
+
+def warm_cache(index,handler):
+    """
+    This function fills the response cache with the first page of each
+    repeat region, the lookups most often made by a probe browser
+
+    Parameters
+    ----------
+    index : dictionary
+        in memory index of the probes
+    handler : class
+        request handler of the probe service
+
+    Returns
+    -------
+    None. Fills the response cache.
+    """
+
+    for repeat_id in index['repeat_id']:
+        handler.respond((('repeat_id',repeat_id),))
+
+##############################################################################
+
+def make_server(output_dirs,assembly,host,port,cache_size=4096):
+    """
+    This function reads the final probes of the runs, indexes them and
+    returns the probe service bound to host and port
+
+    Parameters
+    ----------
+    output_dirs : list
+        pipeline_output directories of the runs
+    assembly : string
+        assembly named in the config.yml of the runs
+    host : string
+        address the service listens on
+    port : int
+        port the service listens on, 0 picks a free port
+    cache_size : int
+        number of responses kept in the cache
+
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        the probe service, not yet serving
+    """
+
+    index = build_index(read_runs(output_dirs,assembly))
+
+    handler = make_handler(index,cache_size)
+
+    warm_cache(index,handler)
+
+    server = ThreadingHTTPServer((host,port),handler,bind_and_activate=False)
+
+    #a longer listen queue keeps bursts of connections from being retried
+    server.request_queue_size = 128
+    server.server_bind()
+    server.server_activate()
+
+    return server
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Serves the final probes of finished pipeline runs over HTTP as
+    paginated JSON, looked up by window, repeat region or sequence from an
+    in memory index, with no external services."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the pipeline_output directories of finished runs.'
+        'Serves probe lookups at /probes?window=chrom:start-stop,'
+        '/probes?repeat_id=chrom:start-stop or /probes?sequence=SEQ, with'
+        'optional by, min_on_target_prop, page and page_size parameters.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-o', '--output_dirs', action='store',
+                               nargs='+', required=True, help='The'
+                               'pipeline_output directories of the runs')
+    requiredNamed.add_argument('-a', '--assembly', action='store',
+                               required=True, help='The assembly of the runs')
+    userInput.add_argument('-host', '--host', action='store',
+                           default='127.0.0.1', help='Address the service'
+                           ' listens on; default is 127.0.0.1')
+    userInput.add_argument('-p', '--port', action='store', default=8000,
+                           type=int, help='Port the service listens on;'
+                           ' default is 8000')
+    userInput.add_argument('-c', '--cache_size', action='store',
+                           default=4096, type=int, help='Number of'
+                           ' responses kept in the cache; default is 4096')
+
+    args = userInput.parse_args()
+
+    server = make_server(args.output_dirs,args.assembly,args.host,args.port,
+                         args.cache_size)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("serving on http://%s:%s" % server.server_address[:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "probe_service_load"
+
+#import libraries
+import time
+import argparse
+import threading
+from multiprocessing.pool import ThreadPool
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from urllib.error import HTTPError
+import numpy as np
+import pandas as pd
+import probe_service as ps
+
+##############################################################################
+
+def make_queries(probe_df,n_requests,seed):
+    """
+    This function draws a mix of window, repeat region and sequence lookups
+    from the final probes, with windows of 10 kb to 10 Mb around probes
+
+    Parameters
+    ----------
+    probe_df : dataframe
+        the coordinates and sequences of the final probes
+    n_requests : int
+        number of queries drawn
+    seed : int
+        seed of the random draws
+
+    Returns
+    -------
+    queries : list
+        the url query of each request
+    """
+
+    rng = np.random.RandomState(seed)
+
+    queries = []
+    for i in rng.randint(0,len(probe_df),n_requests):
+
+        probe = probe_df.iloc[i]
+        kind = rng.randint(0,3)
+
+        if kind == 0:
+            width = int(10 ** rng.uniform(4,7))
+            start = max(0,int(probe['start']) - rng.randint(0,width))
+            params = {'window': "%s:%s-%s" % (probe['chrom'],start,
+                                              start + width),
+                      'by': ['probe','repeat','target'][rng.randint(0,3)]}
+        elif kind == 1:
+            params = {'repeat_id': probe['repeat_id'],
+                      'page_size': int(rng.choice([10,100]))}
+        else:
+            params = {'sequence': probe['probe']}
+
+        queries.append(urlencode(params))
+
+    return queries
+
+##############################################################################
+
+def timed_request(url):
+    """
+    This function requests a url and returns the latency of the response
+
+    Parameters
+    ----------
+    url : string
+        the url requested
+
+    Returns
+    -------
+    latency : tuple
+        latency in milliseconds and HTTP status of the response
+    """
+
+    start = time.perf_counter()
+
+    try:
+        with urlopen(url) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        status = error.code
+
+    return (time.perf_counter() - start) * 1000.0,status
+
+##############################################################################
+
+def summarize_latency(latencies,elapsed):
+    """
+    This function summarizes the latency of the requests made
+
+    Parameters
+    ----------
+    latencies : list
+        latency in milliseconds and HTTP status of each request
+    elapsed : float
+        wall time of all requests in seconds
+
+    Returns
+    -------
+    summ_df : dataframe
+        request count, errors, throughput and latency percentiles
+    """
+
+    ms = np.array([l for l,status in latencies])
+    errors = sum(1 for l,status in latencies if status != 200)
+
+    summ_df = pd.DataFrame([{'requests': len(ms), 'errors': errors,
+                             'requests_per_s': len(ms) / elapsed,
+                             'mean_ms': ms.mean(),
+                             'p50_ms': np.percentile(ms,50),
+                             'p99_ms': np.percentile(ms,99),
+                             'max_ms': ms.max()}])
+
+    return summ_df
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Sends a mix of window, repeat region and sequence lookups to the
+    probe service and reports the p50 and p99 latency. The service is
+    started within this process on the given runs unless a url is given."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires the pipeline_output directories of finished runs, such'
+        'as the CHM13 example outputs. Returns the p50 and p99 latency of'
+        'lookups made to the probe service.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-o', '--output_dirs', action='store',
+                               nargs='+', required=True, help='The'
+                               'pipeline_output directories of the runs')
+    requiredNamed.add_argument('-a', '--assembly', action='store',
+                               required=True, help='The assembly of the runs')
+    userInput.add_argument('-u', '--url', action='store', default=None,
+                           help='Url of a running probe service, one is'
+                           ' started on a free port if not given; default'
+                           ' is None')
+    userInput.add_argument('-n', '--requests', action='store', default=10000,
+                           type=int, help='Number of requests sent; default'
+                           ' is 10000')
+    userInput.add_argument('-c', '--concurrency', action='store', default=8,
+                           type=int, help='Number of requests sent at once;'
+                           ' default is 8')
+    userInput.add_argument('-s', '--seed', action='store', default=0,
+                           type=int, help='Seed of the queries drawn;'
+                           ' default is 0')
+    userInput.add_argument('-out', '--out_file', action='store',
+                           default=None, help='File the latency summary is'
+                           ' written to; default is None')
+
+    args = userInput.parse_args()
+
+    probe_df = ps.read_runs(args.output_dirs,args.assembly)
+
+    server = None
+    url = args.url
+    if url is None:
+        server = ps.make_server(args.output_dirs,args.assembly,'127.0.0.1',0)
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+        url = "http://127.0.0.1:%s" % server.server_address[1]
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    urls = [url.rstrip('/') + "/probes?" + query for query in
+            make_queries(probe_df,args.requests,args.seed)]
+
+    request_start = time.perf_counter()
+
+    with ThreadPool(processes=max(1,args.concurrency)) as pool:
+        latencies = pool.map(timed_request,urls)
+
+    summ_df = summarize_latency(latencies,time.perf_counter() - request_start)
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    print(summ_df.to_string(index=False))
+
+    if args.out_file is not None:
+        summ_df.to_csv(args.out_file, index=False, sep="\t")
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()
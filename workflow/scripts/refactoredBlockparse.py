@@ -29,6 +29,10 @@ from Bio.Alphabet import generic_dna
 # Import regex module.
 import re
 
+# Number of start positions scored at once by the vectorized scan. Each
+# position holds one value per allowed probe length, so this bounds memory.
+scanBlock = 200000
+
 class SequenceCrawler:
     def __init__(self, input_string,fasta_scaffold,chr_name, l, L, gcPercent, GCPercent, nn_table, tm, TM,
                  X, sal, form, sp, conc1, conc2, headerVal, bedVal,
@@ -86,6 +90,7 @@ class SequenceCrawler:
         # Declare complementary relationships.
         self.comps = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
         self.stackTable = self.reformatTable(nn_table)
+        self.buildScanTables()
 
         # Build parser for FASTA sequence block.
         """Change this into a generic seq object that expects a DNA string"""
@@ -111,6 +116,38 @@ class SequenceCrawler:
         return newTable
 
 
+    def buildScanTables(self):
+        """Builds the lookup arrays used by the vectorized scan. Bases are
+        encoded as A=0, C=1, G=2, T=3 and 4 for anything else, so that the
+        nearest neighbor stacks can be indexed by first * 5 + second and the
+        edge contributions by the code of the first or last base."""
+        self.baseCodes = np.full(256, 4, dtype=np.uint8)
+        for code, base in enumerate('ACGT'):
+            self.baseCodes[ord(base)] = code
+            self.baseCodes[ord(base.lower())] = code
+
+        self.stackH = np.zeros(25)
+        self.stackS = np.zeros(25)
+        for first, a in enumerate('ACGT'):
+            for second, b in enumerate('ACGT'):
+                if a + b in self.stackTable:
+                    self.stackH[first * 5 + second] = self.stackTable[a + b][self.dH]
+                    self.stackS[first * 5 + second] = self.stackTable[a + b][self.dS]
+
+        # Unknown bases fall through to the same branch as in getFrontVals
+        # and getBackVals.
+        self.edgeFrontH, self.edgeFrontS = (np.array(vals) for vals in
+                                            zip(*[self.getFrontVals(b) for b in 'ACGTN']))
+        self.edgeBackH, self.edgeBackS = (np.array(vals) for vals in
+                                          zip(*[self.getBackVals(b) for b in 'ACGTN']))
+
+        # The salt correction for saltcorr = 5 only depends on probe length.
+        self.saltVals = np.array([mt.salt_correction(Na=self.sal, K=0, Tris=0,
+                                                     Mg=0, dNTPs=0, method=5,
+                                                     seq='A' * n)
+                                  for n in range(int(self.l), int(self.L) + 1)])
+
+
     def getFrontVals(self, letter):
              """Get the energetic contributions based on the beginning of the
              sequence. These are based on the 'init_X/Y' values stored in the
@@ -499,12 +536,166 @@ class SequenceCrawler:
          bed_fcorrected = ('%0.2f' % mt.chem_correction(bedTmVal, fmd=self.form))
          return bed_fcorrected
 
-    def run(self):
-         """Runs the crawler through the given block sequence to identify probes
-         within the FASTA file satisfying the given constraints."""
-         """
-         Not needed because this modified version takes in a string and not a file object
-         """
+
+    def roundTm(self, tmVals):
+         """Rounds an array of melting temperatures to two decimals the same
+         way float('%0.2f' % tmval) does in probeTmOpt. Values sitting on a
+         rounding tie are formatted one at a time."""
+         rounded = np.round(tmVals, 2)
+         scaled = tmVals * 100
+         ties = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+         for idx in ties:
+             rounded.flat[idx] = float('%0.2f' % tmVals.flat[idx])
+         return rounded
+
+
+    def prohibitedEnds(self, first, stop):
+         """For each position of the block between first and stop, returns
+         the smallest end coordinate (relative to first) of a prohibited
+         sequence match starting at or after that position. A window contains
+         a prohibited sequence when this value does not exceed its end."""
+         segment = self.block[first:stop]
+         nextEnd = np.full(len(segment) + 1, len(segment) + 1, dtype=np.int64)
+         for pro in str(self.X).split(','):
+             # The lookahead reports overlapping matches at every start.
+             matches = [(m.start(), m.end(1)) for m in
+                        re.finditer('(?=(%s))' % pro, segment, re.I)]
+             if matches:
+                 starts, ends = zip(*matches)
+                 np.minimum.at(nextEnd, list(starts), list(ends))
+         return np.minimum.accumulate(nextEnd[::-1])[::-1]
+
+
+    def scanPositions(self, first, last, blockLen):
+         """Evaluates every probe start from first to last against every
+         allowed probe length at once. The nearest neighbor deltaH and deltaS,
+         G+C and 'N' base counts of each window are taken from prefix sums
+         over the block, and the checks follow probeCheck. blockLen is the
+         length of the sequence the block belongs to, as probes may not
+         reach its last base.
+
+         Returns, for each start, whether its minimum length window passes
+         the 'N' base and prohibited sequence checks, the index j of the
+         shortest passing probe (-1 if none) and that probe's Tm."""
+         l = int(self.l)
+         seg = np.frombuffer(self.block[first:last + int(self.L)].encode(),
+                             dtype=np.uint8)
+         codes = self.baseCodes[seg]
+
+         pairs = codes[:-1].astype(np.intp) * 5 + codes[1:]
+         cumH = np.concatenate(([0.0], np.cumsum(self.stackH[pairs])))
+         cumS = np.concatenate(([0.0], np.cumsum(self.stackS[pairs])))
+         cumGC = np.concatenate(([0], np.cumsum((codes == 1) | (codes == 2))))
+         cumN = np.concatenate(([0], np.cumsum(seg == ord('N'))))
+         nextEnd = self.prohibitedEnds(first, last + int(self.L))
+
+         # Rows are start positions and columns probe lengths.
+         pos = np.arange(last - first)[:, None]
+         lengths = np.arange(l, int(self.L) + 1)[None, :]
+         ends = pos + lengths
+         valid = (ends <= len(codes)) & (first + ends < blockLen)
+         ends = np.minimum(ends, len(codes))
+
+         seqClean = (cumN[ends] == cumN[pos]) & (nextEnd[pos] > ends)
+
+         numGC = cumGC[ends] - cumGC[pos]
+         noGC = numGC == 0
+         currdH = (cumH[ends - 1] - cumH[pos] + self.stackTable['init'][self.dH]
+                   + self.edgeFrontH[codes[pos]] + self.edgeBackH[codes[ends - 1]]
+                   + np.where(noGC, self.stackTable['init_allA/T'][self.dH],
+                              self.stackTable['init_oneG/C'][self.dH]))
+         currdS = (cumS[ends - 1] - cumS[pos] + self.stackTable['init'][self.dS]
+                   + self.edgeFrontS[codes[pos]] + self.edgeBackS[codes[ends - 1]]
+                   + np.where(noGC, self.stackTable['init_allA/T'][self.dS],
+                              self.stackTable['init_oneG/C'][self.dS]))
+
+         concval = (self.conc1 - (self.conc2 / 2.0)) * 1e-9
+         tmval = (1000.0 * currdH) / (currdS + self.saltVals + (1.987 * math.log(concval))) - 273.15
+         tmVals = mt.chem_correction(self.roundTm(tmval), fmd=self.form)
+
+         gcVals = numGC * 100.0 / lengths
+
+         passing = (valid & seqClean
+                    & (float(self.tm) < tmVals) & (tmVals < float(self.TM))
+                    & (float(self.gcPercent) <= gcVals)
+                    & (gcVals <= float(self.GCPercent)))
+
+         firstJ = np.where(passing.any(axis=1), passing.argmax(axis=1), -1)
+         probeTm = tmVals[np.arange(len(firstJ)), np.maximum(firstJ, 0)]
+
+         return seqClean[:, 0], firstJ.astype(np.intp), probeTm
+
+
+    def placeProbes(self, seqOk, firstJ, probeTm):
+         """Applies the non-overlap and spacing rules of the crawler in a
+         single pass over the start positions scored by scanPositions, jumping
+         straight to the next start with a passing probe. Returns the start,
+         end, sequence and Tm of each probe placed."""
+         cands = []
+         candPos = np.flatnonzero(firstJ >= 0)
+
+         # Starts that pass the sequence checks but hold no probe still move
+         # the crawler forward by the spacing.
+         stepSpacing = self.sp and not self.OverlapModeVal
+
+         i = 0
+         while i < len(firstJ):
+             if firstJ[i] < 0:
+                 if stepSpacing:
+                     i += 1 + self.sp if seqOk[i] else 1
+                     continue
+                 nextCand = np.searchsorted(candPos, i)
+                 if nextCand == len(candPos):
+                     break
+                 i = int(candPos[nextCand])
+
+             probeLen = int(self.l) + int(firstJ[i])
+             startPos = self.start + i
+             cands.append((str(startPos), str(startPos + probeLen - 1),
+                           str(self.block[i:i + probeLen]),
+                           '%0.2f' % float(probeTm[i])))
+             if self.verbocity:
+                 print ('Picking a candidate probe of %d bases starting '
+                        'at base %d' % (probeLen, startPos))
+
+             # Probes must be non-overlapping.
+             if self.OverlapModeVal:
+                 i += 1
+             else:
+                 i += probeLen + self.sp
+
+         return cands
+
+
+    def scanRange(self, first, last, blockLen):
+         """Scores the start positions from first to last with scanPositions,
+         scanBlock positions at a time."""
+         scans = [self.scanPositions(start, min(start + scanBlock, last), blockLen)
+                  for start in range(first, last, scanBlock)]
+         if not scans:
+             return (np.zeros(0, dtype=bool), np.zeros(0, dtype=np.intp),
+                     np.zeros(0))
+         return tuple(np.concatenate(vals) for vals in zip(*scans))
+
+
+    def crawl(self):
+         """Scans the block with the vectorized engine and places probes
+         along it."""
+         blockLen = len(self.block)
+         nPos = max(blockLen - int(self.l), 0)
+         return self.placeProbes(*self.scanRange(0, nPos, blockLen))
+
+
+    def probeRows(self, chrom, cands):
+         """Formats the probes found in the block as rows of the output
+         file."""
+         return [[chrom, start, end, seq, tmVal, self.fasta_scaffold]
+                 for (start, end, seq, tmVal) in cands]
+
+
+    def parseHeader(self):
+         """Parses the chromosome name and start coordinate of the block from
+         its FASTA header or the custom header."""
          # Parse out FASTA coordinate, scaffold info.
          if self.headerVal is None:
              headerParse = (self.fasta_scaffold).split(':')
@@ -532,17 +723,13 @@ class SequenceCrawler:
              stop = str(self.headerVal).split(':')[1].split('-')[1]
              #print(self.start)
 
-         # Make lists to hold Report info if desired.
-         if self.reportVal:
-             self.reportList = []
-             self.N_int_fail = []
-             self.N_block_fail = []
-             self.prohib_fail = []
-             self.Tm_fail_low = []
-             self.Tm_fail_high = []
-             self.gc_fail_low = []
-             self.gc_fail_high = []
+         return chrom
 
+
+    def crawlWindows(self):
+         """Crawls the block one start position at a time, checking each
+         window in turn so that the reason for every failure can be reported
+         or printed. Returns the start, end, sequence and Tm of each probe."""
          # Determine the size range the probe sequence can vary over.
          sizeRange = int(self.L) - int(self.l) + 1
 
@@ -631,13 +818,32 @@ class SequenceCrawler:
              else:
                  i += 1
 
-         outList=[]
+         return [(start, end, seq, self.BedprobeTm(seq)) for (start, end, seq) in cands]
+
+
+    def run(self):
+         """Runs the crawler through the given block sequence to identify probes
+         within the FASTA file satisfying the given constraints. The vectorized
+         scan is used unless a report of each window is requested."""
+         chrom = self.parseHeader()
 
-         for i, (start, end, seq) in enumerate(cands):
-                 outList.append('%s\t%s\t%s\t%s\t%s\t%s' % (chrom, start, end, seq,
-                                                        self.BedprobeTm(seq),self.fasta_scaffold))
+         # Make lists to hold Report info if desired.
+         if self.reportVal:
+             self.reportList = []
+             self.N_int_fail = []
+             self.N_block_fail = []
+             self.prohib_fail = []
+             self.Tm_fail_low = []
+             self.Tm_fail_high = []
+             self.gc_fail_low = []
+             self.gc_fail_high = []
+
+         if self.reportVal or self.debugVal:
+             cands = self.crawlWindows()
+         else:
+             cands = self.crawl()
 
-         output_df = pd.DataFrame([sub.split("\t") for sub in outList])
+         output_df = pd.DataFrame(self.probeRows(chrom, cands))
 
          with open(str(self.out_path), 'a+') as f:
                  output_df.to_csv(f, sep='\t',header=None, index=False)
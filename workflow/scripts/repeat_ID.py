@@ -36,308 +36,472 @@ from collections import Counter
 import itertools
 import re
 
+#approximate memory used per k-mer held in a scanning block, in bytes
+BYTES_PER_KMER = 64
+
 ##############################################################################
 
-def open_index_file(index_file,chrom):
+def check_threshold(count,THRESHOLD):
     """
-    This function will take the two columns from the normal ranges DF and then 
-    append these ranges to a list. This list is then written out as a file    
-
+    This function will generate a binary mask based on whether the count value 
+    passes the defined threshold
+    
     Parameters
     ----------
-    index_file : file
-        file containing the index location of ATCG bases in the
-        genome
-        
+    count : array
+        array containing k-mer count values
+    THRESHOLD : user argument (int)
+        min val of k-mer count to be flagged as enrchiched
+
     Returns
     -------
-    kmer_indices : list
-        file is read into a list
+    pass_thresh_mask : array
+        uint8 array where (1) means k-mer count value is >= threshold,
+        else assigned 0
     """
-    
-    if str(index_file[-4:]) != ".txt":
 
-        index_file = str(index_file) + "/" + str(chrom) + "_index.txt"
+    pass_thresh_mask = (np.asarray(count,dtype=np.int64) >=
+                        THRESHOLD).astype(np.uint8)
 
-    #open index file and add to list
-    with open(index_file, "r") as idx_f:
-        kmer_indices = [line.rstrip('\n') for line in idx_f]
+    return pass_thresh_mask
 
-    if len(kmer_indices) == 0:
-        print("Jellyfish count file provided not valid. Exiting...")
+##############################################################################
 
-    return kmer_indices
+def cumulative_pass(pass_thresh_mask):
+    """
+    This function will take the cumulative sum over the threshold mask so that
+    the number of passing k-mers in any window is a single subtraction
 
+    Parameters
+    ----------
+    pass_thresh_mask : array
+        uint8 array where (1) means k-mer count value is >= threshold,
+        else assigned 0
+
+    Returns
+    -------
+    cum_pass : array
+        cumulative sum of the mask with a leading 0
+    """
+
+    cum_pass = np.zeros(len(pass_thresh_mask)+1,dtype=np.int64)
+    np.cumsum(pass_thresh_mask,out=cum_pass[1:])
+
+    return cum_pass
 
 ##############################################################################
 
-def generate_kmer_count_lists(jf_count,chrom):
+def find_passing_runs(cum_pass,WINDOW,COMPOSITION):
     """
-    This function will store the values from the jf query file into a list for 
-    the k_mers and the corresponding count
-    
+    The purpose of this function is to score every window of the size you
+    define from the cumulative sum over the threshold mask, then collapse the
+    passing windows into continuous ranges of k-mer ordinals
+
     Parameters
     ----------
-    jf_count : file
-        file derived from jellyfish count providing count of k-mers in whole
-        genome
+    cum_pass : array
+        cumulative sum of the threshold mask from cumulative_pass()
+    WINDOW : user argument (int)
+        the length of the window to be searched in the pass_thresh_mask
+    COMPOSITION : user argument (float)
+        the percentage of k-mers in the list that must be flagged as >=
+        composition score
 
     Returns
     -------
-    k_mer : list
-        list containing specific k-mers
-    count : list
-        list containing k-mer count values
-        
+    run_starts : array
+        k-mer ordinal of the first k-mer in each passing range
+    run_ends : array
+        k-mer ordinal of the last k-mer in each passing range
+
     """
-    
-    k_mer=[]
-    count=[]
-    
-    if str(jf_count[-4:]) != ".txt":
 
-        jf_count = str(jf_count) + "/" + str(chrom) + "_jf_temp.txt"
+    #the sum of each window is the difference of two cumulative sums
+    iter_sum = cum_pass[WINDOW:] - cum_pass[:-WINDOW]
+
+    #note that these are not their true indices in sequence 
+    #(basically which number k-mer in order they appear)
+    pass_w = np.zeros(len(iter_sum)+2,dtype=np.int8)
+    pass_w[1:-1] = iter_sum/WINDOW>=COMPOSITION
 
-    with open(jf_count, "r") as jf:
-        for line in jf:
-            k_mer.append(line.replace(" ","\t").split()[0])
-            count.append(line.replace(" ","\t").split()[1])
+    #edges of each run of passing windows
+    edges = np.diff(pass_w)
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1) - 1 + WINDOW - 1
 
-    return k_mer,count
+    return run_starts,run_ends
 
 ##############################################################################
 
-def check_threshold(count,THRESHOLD):
+def find_candidate_segments(cum_pass,WINDOW,COMPOSITION,first,block_size):
     """
-    This function will generate a binary list based on whether the count value 
-    passes the defined threshold
-    
+    This function will make a coarse pass over blocks of window starts. The
+    number of passing k-mers across every position a block's windows can
+    reach bounds the sum of any one of those windows, so blocks whose bound
+    falls below composition cannot hold a passing window and are skipped.
+    Neighbouring candidate blocks are joined into segments
+
     Parameters
     ----------
-    count : list
-        list containing k-mer count values
-    THRESHOLD : user argument (int)
-        min val of k-mer count to be flagged as enrchiched
+    cum_pass : array
+        cumulative sum of the threshold mask from cumulative_pass()
+    WINDOW : user argument (int)
+        the length of the window to be searched in the pass_thresh_mask
+    COMPOSITION : user argument (float)
+        the percentage of k-mers in the list that must be flagged as >=
+        composition score
+    first : int
+        first window start to be scored
+    block_size : int
+        number of window starts summarized by each block
 
     Returns
     -------
-    pass_thresh_list : list
-        binary list where (1) means k-mer count value is >= threshold,
-        else assigned 0
+    seg_starts : array
+        first window start of each segment
+    seg_ends : array
+        window start following the last one of each segment
     """
-    
-    pass_thresh_list=[]
-    
-    for i in count:
-        if int(i)>=THRESHOLD:
-            pass_thresh_list.append(1)
-        else:
-            pass_thresh_list.append(0)
 
-    return pass_thresh_list
+    n_kmers = len(cum_pass) - 1
+    n_windows = n_kmers - WINDOW + 1
+
+    block_starts = np.arange(first,n_windows,block_size)
+    block_ends = np.minimum(block_starts + block_size,n_windows)
+
+    #passing k-mers over all positions covered by the windows of each block
+    bound = (cum_pass[block_ends - 1 + WINDOW] - cum_pass[block_starts])
+
+    is_candidate = np.zeros(len(block_starts)+2,dtype=np.int8)
+    is_candidate[1:-1] = bound/WINDOW>=COMPOSITION
+
+    edges = np.diff(is_candidate)
+    seg_starts = block_starts[np.flatnonzero(edges == 1)]
+    seg_ends = block_ends[np.flatnonzero(edges == -1) - 1]
+
+    return seg_starts,seg_ends
 
 ##############################################################################
 
-def convolve_successes(pass_thresh_list,WINDOW,COMPOSITION):
+def find_block_runs(cum_pass,WINDOW,COMPOSITION,first,block_size):
     """
-    The purpose of this function is to convolve over the array in the size of 
-    the window you define, then generate a dataframe of all passing ranges   
+    This function will score the windows starting at or after first, only
+    running the exact scan inside the segments left by the coarse pass.
+    Every window outside of them is known to fail, so the runs found are the
+    same as scoring every window
 
     Parameters
     ----------
-    pass_thresh_list : list
-        binary list where (1) means k-mer count value is >= threshold,
-        else assigned 0
+    cum_pass : array
+        cumulative sum of the threshold mask from cumulative_pass()
     WINDOW : user argument (int)
-        the length of the window to be searched in the pass_thresh_list
+        the length of the window to be searched in the pass_thresh_mask
     COMPOSITION : user argument (float)
         the percentage of k-mers in the list that must be flagged as >=
         composition score
+    first : int
+        first window start to be scored
+    block_size : int
+        number of window starts summarized by each block, or 0 to score
+        every window
 
     Returns
     -------
-    pass_w : tuple
-        Windows of sequence to map repetitive region locations.
-
+    run_starts : array
+        k-mer ordinal of the first k-mer in each passing range
+    run_ends : array
+        k-mer ordinal of the last k-mer in each passing range
     """
-    #convert list of binary k-mer count vals into array
-    iter_data = np.array(pass_thresh_list)
 
-    #iterate through array over length of specific WINDOW
-    iter_vals_convolve=np.convolve(iter_data,np.ones(WINDOW,dtype=int),
-                                   'valid')
+    if block_size <= 0:
+        run_starts,run_ends=find_passing_runs(cum_pass[first:],WINDOW,
+                                              COMPOSITION)
+        return run_starts+first,run_ends+first
 
-    #list of values in sum values in sliding window casted as float
-    iter_list=[(float(element)) for element in iter_vals_convolve]
+    seg_starts,seg_ends=find_candidate_segments(cum_pass,WINDOW,COMPOSITION,
+                                                first,block_size)
 
-    #this is the sum of all the counts of the k-mers
-    #the most important column here is the row_span_start,
-    #this will tell you which k-mer it is
-    #this casts to dataframe
-    w_sum=pd.DataFrame(list(iter_list),columns=['iter_sum'])
+    run_starts=[np.zeros(0,dtype=np.int64)]
+    run_ends=[np.zeros(0,dtype=np.int64)]
 
-    #the length of the list represents the start values
-    w_sum['sliding_win_start']=np.arange(len(w_sum))
+    for seg_start,seg_end in zip(seg_starts,seg_ends):
 
-    #the location of the end of each sliding window
-    w_sum['sliding_win_end']=w_sum['sliding_win_start']+WINDOW-1
-    
-    #these are all the k-mers that pass the range you specified
-    #note that these are not their true indices in sequence 
-    #(basically which number k-mer in order they appear)
-    pass_w = w_sum.loc[(w_sum['iter_sum']/WINDOW>=COMPOSITION)]
+        seg_cum = cum_pass[seg_start:seg_end + WINDOW]
 
-    return pass_w
+        seg_run_starts,seg_run_ends=find_passing_runs(seg_cum,WINDOW,
+                                                      COMPOSITION)
+
+        run_starts.append(seg_run_starts+seg_start)
+        run_ends.append(seg_run_ends+seg_start)
+
+    return np.concatenate(run_starts),np.concatenate(run_ends)
 
 ##############################################################################
 
-def obtain_repeat_indices(pass_w):
+def read_count_chunks(jf_count,index_file,chrom,chunk_size):
     """
-    This function will collapse the dataframe into continuous ranges, and then 
-    append those to a seperate dataframe, then stored as seperate lists
-    
+    This function will read the jellyfish query file and the index file in
+    parallel, yielding blocks of k-mer counts and k-mer base positions so
+    that only chunk_size k-mers are held in memory at once
+
     Parameters
     ----------
-    pass_w : dataframe
-        subset of the dataframe containing only the rows that pass the 
-        composition score from surveying the sliding window
+    jf_count : file
+        file derived from jellyfish count providing count of k-mers in whole
+        genome
+    index_file : file
+        file containing the index location of ATCG bases in the
+        genome
+    chrom : user arg string
+        given scaffold to report bed file
+    chunk_size : int
+        number of k-mers read per block
 
-    Returns
+    Yields
     -------
-    indices_to_parse : dataframe
-        
+    counts : array
+        k-mer count values for the block
+    kmer_indices : array
+        base location of each k-mer in the block
     """
-    
-    #lists for the continuous ranges of start and end values that will
-    #be used to identify the repeat regions
-    min_ranges=[]
-    max_ranges=[]
 
-    start_index=[]
-    end_index=[]
-    
-    for k,g in pass_w.groupby(pass_w['sliding_win_start'] -
-                              np.arange(pass_w.shape[0])):
-            min_ranges.append(min(g['sliding_win_start']))
-            max_ranges.append(max(g['sliding_win_end']))
+    if str(jf_count[-4:]) != ".txt":
+
+        jf_count = str(jf_count) + "/" + str(chrom) + "_jf_temp.txt"
 
-    #add these two values into a dataframe where we can scan the
-    #indices of jellyfish count
-    indices_to_parse = pd.DataFrame(list(zip(min_ranges, max_ranges)),
-                                    columns =['start_index_range',
-                                              'end_index_range'])
+    if str(index_file[-4:]) != ".txt":
+
+        index_file = str(index_file) + "/" + str(chrom) + "_index.txt"
+
+    #only the count column is parsed from the jellyfish query file
+    count_chunks = pd.read_csv(jf_count, sep=" ", header=None, usecols=[1],
+                               dtype=np.int64, chunksize=chunk_size)
+
+    index_chunks = pd.read_csv(index_file, header=None, dtype=np.int64,
+                               chunksize=chunk_size)
 
-    start_index = indices_to_parse['start_index_range'].tolist()
-    end_index = indices_to_parse['end_index_range'].tolist()
+    #the index file may hold a few more positions than there are k-mers
+    for count_df,index_df in zip(count_chunks,index_chunks):
 
-    return indices_to_parse
+        block_len = min(len(count_df),len(index_df))
+
+        yield (count_df[1].to_numpy()[:block_len],
+               index_df[0].to_numpy()[:block_len])
 
 ##############################################################################
 
-def find_repeats(indices_to_parse,kmer_indices,mer_length):
+def scan_count_chunks(chunks,settings,mer_length,block_size=0):
     """
-    This function will refer to the indices to parse and append to a list, 
-    then at that index, the start val in kmer_indices is appended, this is 
-    also done for end sequences.
-    
+    This function will scan the blocks of k-mer counts with the sliding
+    window of each setting, keeping the last (WINDOW - 1) k-mers of each block
+    for the largest window so that windows spanning block boundaries are
+    evaluated. Runs of passing windows that continue into the next block are
+    carried over, so the ranges reported are the same as when the whole
+    scaffold is scanned at once. Settings sharing a threshold share the same
+    mask and cumulative sum
+
     Parameters
     ----------
-    indices_to_parse : datafrane
-        contains continous start and end coordinates
-    kmer_indices : list
-        contains the index derived from jellyfish files
-        
-    Returns
+    chunks : iterable
+        blocks of (counts, kmer_indices) from read_count_chunks()
+    settings : list
+        (WINDOW, THRESHOLD, COMPOSITION) tuples to scan with
+    mer_length : int
+        size of k-mers used
+    block_size : int
+        number of window starts summarized by each block of the coarse pass,
+        or 0 to score every window
+
+    Yields
     -------
-    kmer_start_seq : list
-        list containing start coords of k-mer
-    kmer_end_seq : list
-        list containing ned coords of k-mer
-    index_start : list
-        list of where start indices were noted from parsing sliding window
-    index_end : list
-        list of where end indices were noted from parsing sliding window
-
+    setting, r_start, r_end : int
+        position of the setting in settings with the nucleotide start and end
+        of each run of passing windows, in order for each setting
     """
 
-    #list of indices of all valid ATCG bases that represent k-mer location
-    kmer_start=[]
-    kmer_end=[]
+    max_window = max(window for window,_,_ in settings)
 
-    #index of regions found as valid in k-mer sliding window
-    index_start=[]
-    index_end=[]
-    
-    for item in indices_to_parse['start_index_range']:
-        index_start.append(int(item))
-        start=kmer_indices[item]
-        kmer_start.append(int(start))
+    #settings are grouped by threshold to share the mask between them
+    thresh_groups = defaultdict(list)
+    for i,(_,threshold,_) in enumerate(settings):
+        thresh_groups[threshold].append(i)
+
+    carry_counts = np.zeros(0,dtype=np.int64)
+    carry_indices = np.zeros(0,dtype=np.int64)
+
+    #ordinal of the first k-mer held in the current block
+    block_start = 0
+
+    #ordinal of the next window to be scored for each setting
+    next_window = [0] * len(settings)
+
+    #the open run as [first window, last window, nucleotide start, end]
+    open_runs = [None] * len(settings)
+
+    for counts,kmer_indices in chunks:
+
+        counts = np.concatenate([carry_counts,counts])
+        kmer_indices = np.concatenate([carry_indices,kmer_indices])
+
+        for THRESHOLD,setting_ids in thresh_groups.items():
+
+            cum_pass=cumulative_pass(check_threshold(counts,THRESHOLD))
 
-    repeat_starts_df=pd.DataFrame(list(zip(kmer_start,index_start)),
-                                  columns=['r_start','r_index_start'])
+            for i in setting_ids:
 
-    for item in indices_to_parse['end_index_range']:
-        index_end.append(int(item))
-        end=kmer_indices[item]
-        kmer_end.append(int(int(end) + int(mer_length)))
-     
-    repeat_ends_df=pd.DataFrame(list(zip(kmer_end,index_end)),
-                                columns=['r_end','r_index_end'])
+                WINDOW,_,COMPOSITION = settings[i]
+                first = next_window[i] - block_start
 
-    repeat_indices=pd.concat([repeat_starts_df, repeat_ends_df], axis=1)
+                #not enough k-mers yet to fill a new window
+                if len(counts) - WINDOW < first:
+                    continue
 
-    return kmer_start,kmer_end,index_start,index_end
+                run_starts,run_ends=find_block_runs(cum_pass,WINDOW,
+                                                    COMPOSITION,first,
+                                                    block_size)
+
+                next_window[i] = block_start + len(counts) - WINDOW + 1
+
+                for start,end in zip(run_starts,run_ends):
+
+                    first_window = block_start + int(start)
+                    last_window = block_start + int(end) - WINDOW + 1
+                    r_end = int(kmer_indices[end]) + int(mer_length)
+
+                    #a run starting at the first new window may be the
+                    #continuation of the run left open by the previous block
+                    open_run = open_runs[i]
+                    if open_run is not None and first_window == open_run[1]+1:
+                        open_run[1] = last_window
+                        open_run[3] = r_end
+                        continue
+
+                    if open_run is not None:
+                        yield i,open_run[2],open_run[3]
+
+                    open_runs[i] = [first_window,last_window,
+                                    int(kmer_indices[start]),r_end]
+
+        #the last (WINDOW - 1) k-mers start windows not yet complete
+        keep = min(len(counts),max_window-1)
+        carry_counts = counts[len(counts)-keep:]
+        carry_indices = kmer_indices[len(kmer_indices)-keep:]
+        block_start += len(counts) - keep
+
+    for i,open_run in enumerate(open_runs):
+        if open_run is not None:
+            yield i,open_run[2],open_run[3]
 
 ##############################################################################
 
-def nucleotide_range(kmer_start,kmer_end,index_start,index_end,bed_file,chrom):
+def write_collapsed_beds(tagged_ranges,bed_files,chrom):
     """
-    This function will take the start and end lists and then map this back 
-    to the regions in sequence
-    
+    This function will merge overlapping nucleotide ranges as they arrive,
+    so that ranges which overlap or touch are reported as one region, and
+    write them to the bed file of their setting one row at a time
+
     Parameters
     ----------
-    kmer_start : list
-        location of start of k-mer
-    kmer_end : list
-        location of end of k-mer
-    index_start : list
-        start index of k-mer sliding window
-    index_end : list
-        end index of k-mer sliding window
-    bed_file : file
-        path and name of output bed file
+    tagged_ranges : iterable
+        (setting, r_start, r_end) from scan_count_chunks()
+    bed_files : list
+        path and name of output bed file for each setting
     chrom : user arg string
         given scaffold to report bed file
 
     Returns
     -------
-    None. The output bed file is written at specified path
+    region_summary : list
+        region count, total bp and largest region for each setting
+    """
+
+    bed_fs = [open(bed_file, "w") for bed_file in bed_files]
+
+    collapsed = [None] * len(bed_files)
+    region_summary = [[0,0,0] for bed_file in bed_files]
+
+    def write_region(i):
+        r_start,r_end = collapsed[i]
+        bed_fs[i].write(str(chrom) + "\t" + str(r_start) + "\t" +
+                        str(r_end) + "\n")
+        region_summary[i][0] += 1
+        region_summary[i][1] += r_end - r_start
+        region_summary[i][2] = max(region_summary[i][2],r_end - r_start)
+
+    for i,r_start,r_end in tagged_ranges:
+
+        if collapsed[i] is not None and r_start <= collapsed[i][1]:
+            collapsed[i][1] = r_end
+            continue
+
+        if collapsed[i] is not None:
+            write_region(i)
+
+        collapsed[i] = [r_start,r_end]
+
+    for i,bed_f in enumerate(bed_fs):
+        if collapsed[i] is not None:
+            write_region(i)
+        bed_f.close()
 
+    return region_summary
+
+##############################################################################
+
+def parse_grid(grid_vals,default,cast):
+    """
+    This function will read a comma seperated list of sweep values
+
+    Parameters
+    ----------
+    grid_vals : string
+        comma seperated values, or None if not provided
+    default : int or float
+        value used if no list was provided
+    cast : type
+        type each value is converted to
+
+    Returns
+    -------
+    list of sweep values
     """
 
-    #zip the two lists together and this should get you the start and end 
-    #nucleotides of where that 18mer pattern was
-    seq_range = pd.DataFrame(list(zip(kmer_start, kmer_end)), 
-                                    columns =['r_start', 'r_end'])
+    if grid_vals is None:
+        return [default]
 
-    seq_index_range = pd.DataFrame(list(zip(index_start,index_end)),
-                                   columns =['r_index_start','r_index_end'])
+    return [cast(val) for val in str(grid_vals).split(",") if val]
 
-    #let's add a column to the dataframe that will contain the
-    #chromosome information
-    seq_range['chr']=chrom
-    seq_index_range['chr']=chrom
+##############################################################################
 
-    #let's now merge by the chromosome to collapse overlapping regions
-    collapsed_nucleotide_range=seq_range.groupby((seq_range.r_end.shift() - 
-                                                  seq_range.r_start).lt(0).cumsum()).agg(
-        {'r_start': 'first','chr': 'first', 'r_end': 'last'})
+def write_sweep_summary(settings,bed_files,region_summary,summary_file):
+    """
+    This function will write the table comparing the regions found by each
+    setting of the sweep
+
+    Parameters
+    ----------
+    settings : list
+        (WINDOW, THRESHOLD, COMPOSITION) tuples scanned
+    bed_files : list
+        bed file written for each setting
+    region_summary : list
+        region count, total bp and largest region for each setting
+    summary_file : file
+        path and name of the summary table
 
-    collapsed_nucleotide_range=collapsed_nucleotide_range[["chr","r_start","r_end"]]
+    Returns
+    -------
+    None. The summary table is written at specified path
+    """
 
-    collapsed_nucleotide_range.to_csv(bed_file, header=None, index=None, sep='\t')
+    summary_df = pd.DataFrame([list(setting) + summary + [bed_file] for
+                               setting,summary,bed_file in
+                               zip(settings,region_summary,bed_files)],
+                              columns=['window','threshold','composition',
+                                       'region_count','total_bp',
+                                       'largest_region','bed_file'])
 
+    summary_df.to_csv(summary_file, index=None, sep='\t')
 
 ##############################################################################
 
@@ -389,6 +553,32 @@ def main():
                                'file of kmer rich regions; default is')
     requiredNamed.add_argument('-m', '--mer_length', action='store',
                                required=True, help='Size of k-mers used')
+    userInput.add_argument('-cs', '--chunk_size', action='store',
+                           default=10000000, type=int, help='The number of'
+                           ' k-mers held in memory at once while scanning;'
+                           ' default is 10000000')
+    userInput.add_argument('-mm', '--max_memory', action='store',
+                           default=None, type=float, help='Approximate'
+                           ' memory limit in GB for the scan, used in place'
+                           ' of chunk_size when given')
+    userInput.add_argument('-bs', '--block_size', action='store',
+                           default=1000, type=int, help='The number of'
+                           ' window starts summarized by each block of the'
+                           ' coarse pass that skips k-mer poor stretches, 0'
+                           ' scores every window; default is 1000')
+    userInput.add_argument('-g_w', '--grid_windows', action='store',
+                           default=None, help='Comma seperated window'
+                           ' lengths to sweep; default is window_length')
+    userInput.add_argument('-g_t', '--grid_thresholds', action='store',
+                           default=None, help='Comma seperated thresholds'
+                           ' to sweep; default is threshold')
+    userInput.add_argument('-g_c', '--grid_compositions', action='store',
+                           default=None, help='Comma seperated composition'
+                           ' scores to sweep; default is composition_score')
+    userInput.add_argument('-g_o', '--grid_out', action='store',
+                           default=None, help='Directory for the bed file of'
+                           ' each sweep setting and the sweep summary; the'
+                           ' sweep is only run if this is given')
 
     #Import user-specified command line values.
     args = userInput.parse_args()
@@ -401,44 +591,50 @@ def main():
     START=args.start
     bed_file = args.bed_file
     mer_length = args.mer_length
+    chunk_size = args.chunk_size
 
-    #a list for the regions and scaffold sequences 
-    name_list=[]
-    sequence_list=[]
-    zipped_list=[]
-    bases_dist_start=[]
+    #size the blocks from the memory limit if one is given
+    if args.max_memory is not None:
+        chunk_size = int(args.max_memory * 1e9 / BYTES_PER_KMER)
 
-    #the names of output files to be generated
-    
-    kmer_indices=open_index_file(index_file,chrom)
-    
-    print("---%s seconds ---"%(time.time()-start_time))
+    #the given setting is always written to the bed file
+    settings = [(WINDOW,THRESHOLD,COMPOSITION)]
+    bed_files = [bed_file]
 
-    k_mer,count=generate_kmer_count_lists(jf_count,chrom)
+    if args.grid_out is not None:
 
-    print("---%s seconds ---"%(time.time()-start_time))
+        if not os.path.exists(args.grid_out):
+            os.makedirs(args.grid_out)
 
-    pass_thresh_list=check_threshold(count,THRESHOLD)
+        for setting in itertools.product(
+                parse_grid(args.grid_windows,WINDOW,int),
+                parse_grid(args.grid_thresholds,THRESHOLD,int),
+                parse_grid(args.grid_compositions,COMPOSITION,float)):
 
-    print("---%s seconds ---"%(time.time()-start_time))
+            if setting not in settings:
+                settings.append(setting)
+                bed_files.append(os.path.join(args.grid_out,
+                    "%s_w%s_t%s_c%s_regions.bed" % ((chrom,) + setting)))
 
-    pass_w=convolve_successes(pass_thresh_list,WINDOW,COMPOSITION)
+    #a block must at least hold one full window
+    chunk_size = max([chunk_size] + [window for window,_,_ in settings])
 
-    print("---%s seconds ---"%(time.time()-start_time))
+    chunks = read_count_chunks(jf_count,index_file,chrom,chunk_size)
 
-    indices_to_parse=obtain_repeat_indices(pass_w)
+    tagged_ranges = scan_count_chunks(chunks,settings,mer_length,
+                                      args.block_size)
 
-    print("---%s seconds ---"%(time.time()-start_time))
-
-    kmer_start,kmer_end,index_start,index_end=find_repeats(indices_to_parse,
-                                                           kmer_indices,
-                                                           mer_length)
+    region_summary = write_collapsed_beds(tagged_ranges,bed_files,chrom)
 
     print("---%s seconds ---"%(time.time()-start_time))
 
-    nucleotide_range(kmer_start,kmer_end,index_start,index_end,bed_file,chrom)
+    if args.grid_out is not None:
 
-    print("---%s seconds ---"%(time.time()-start_time))
+        write_sweep_summary(settings,bed_files,region_summary,
+                            os.path.join(args.grid_out,
+                                         str(chrom) + "_sweep_summary.txt"))
+
+        print("---%s seconds ---"%(time.time()-start_time))
     
     print("Done")
 
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##############################################################################
+
+# Tigerfish
+# repeat_discovery.py
+
+"""
+Beliveau and Noble Labs
+University of Washington | Department of Genome Sciences
+"""
+##############################################################################
+
+#specific script name
+script_name = "repeat_discovery"
+
+#import libraries
+import time
+import argparse
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import generate_jf_idx as jf_idx
+import repeat_ID as rid
+
+#import biopython libraries
+from Bio import SeqIO
+
+##############################################################################
+
+def create_dir(dir):
+    """
+    This function will create a directory if it does not exist
+    """
+
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+##############################################################################
+
+def split_scaffolds(fa_file,samples,fasta_dir,genome_buffer):
+    """
+    Reads the genome fasta file once, writing the fasta file of each scaffold
+    of interest and packing their sequences into a single buffer file that
+    the workers memory map
+
+    Parameters
+    ----------
+    fa_file : fasta file
+        Multi lined Genome fasta file.
+    samples : list
+        scaffolds to process
+    fasta_dir : string
+        directory where the fasta file of each scaffold is written
+    genome_buffer : file
+        file holding the concatenated scaffold sequences
+
+    Returns
+    -------
+    seq_offsets : dict
+        scaffold name to the (offset, length) of its sequence in the buffer
+    """
+
+    seq_offsets = {}
+    offset = 0
+
+    with open(genome_buffer, "wb") as buffer_f:
+
+        for fasta in SeqIO.parse(open(fa_file),'fasta'):
+
+            if fasta.id not in samples:
+                continue
+
+            SeqIO.write(fasta,os.path.join(fasta_dir,fasta.id + ".fa"),
+                        "fasta")
+
+            seq_bytes = str(fasta.seq).encode()
+            buffer_f.write(seq_bytes)
+
+            seq_offsets[fasta.id] = (offset,len(seq_bytes))
+            offset += len(seq_bytes)
+
+    return seq_offsets
+
+##############################################################################
+
+def write_index_files(range_starts,range_ends,index_out,index_npy,
+                      chunk_size):
+    """
+    Writes the scaffold index file from the ranges of ATCG bases, and a
+    memory mapped copy of the same positions used for the repeat scan
+
+    Parameters
+    ----------
+    range_starts : array
+        start of each continuous range of ATCG bases
+    range_ends : array
+        last index value written for each range
+    index_out : file
+        scaffold index file, one k-mer position per line
+    index_npy : file
+        memory mapped array of the same k-mer positions
+    chunk_size : int
+        number of positions written at once
+
+    Returns
+    -------
+    kmer_indices : memmap
+        k-mer positions in the order of the jellyfish query file
+    """
+
+    range_lens = np.maximum(range_ends - range_starts + 1,0)
+
+    kmer_indices = np.lib.format.open_memmap(index_npy, mode='w+',
+                                             dtype=np.int64,
+                                             shape=(int(range_lens.sum()),))
+
+    pos = 0
+
+    with open(index_out, "w") as k_file:
+
+        for start,range_len in zip(range_starts,range_lens):
+
+            #long ranges are written in pieces to bound memory
+            for piece in range(0,int(range_len),chunk_size):
+
+                piece_len = min(chunk_size,int(range_len) - piece)
+                positions = np.arange(start + piece,start + piece + piece_len,
+                                      dtype=np.int64)
+
+                kmer_indices[pos:pos + piece_len] = positions
+                pos += piece_len
+
+                k_file.write("\n".join(map(str,positions.tolist())) + "\n")
+
+    kmer_indices.flush()
+
+    return np.load(index_npy, mmap_mode='r')
+
+##############################################################################
+
+def count_index_chunks(jf_out,kmer_indices,chunk_size):
+    """
+    Yields blocks of k-mer counts from the jellyfish query file alongside the
+    matching positions of the memory mapped index
+
+    Parameters
+    ----------
+    jf_out : file
+        jellyfish query file of the scaffold
+    kmer_indices : memmap
+        k-mer positions in the order of the jellyfish query file
+    chunk_size : int
+        number of k-mers read per block
+
+    Yields
+    -------
+    counts : array
+        k-mer count values for the block
+    kmer_indices : array
+        base location of each k-mer in the block
+    """
+
+    pos = 0
+
+    count_chunks = pd.read_csv(jf_out, sep=" ", header=None, usecols=[1],
+                               dtype=np.int64, chunksize=chunk_size)
+
+    for count_df in count_chunks:
+
+        #the index may hold a few more positions than there are k-mers
+        block_len = min(len(count_df),len(kmer_indices) - pos)
+
+        yield (count_df[1].to_numpy()[:block_len],
+               np.asarray(kmer_indices[pos:pos + block_len]))
+
+        pos += block_len
+
+##############################################################################
+
+def discover_scaffold(task):
+    """
+    Runs the jellyfish query, index file and repeat scan of one scaffold.
+    The scaffold sequence is read from the shared genome buffer
+
+    Parameters
+    ----------
+    task : dict
+        scaffold name, its place in the genome buffer and run parameters
+
+    Returns
+    -------
+    chrom : string
+        scaffold processed
+    region_summary : list
+        region count, total bp and largest region found
+    """
+
+    chrom = task["chrom"]
+    offset,seq_len = task["seq_offset"]
+
+    scaffold_fa = os.path.join(task["fasta_dir"],chrom + ".fa")
+    jf_out = os.path.join(task["jf_dir"],chrom + "_jf_temp.txt")
+    index_out = os.path.join(task["index_dir"],chrom + "_index.txt")
+    index_npy = os.path.join(task["tmp_dir"],chrom + "_index.npy")
+    bed_file = os.path.join(task["bed_dir"],chrom + "_regions.bed")
+
+    jf_idx.jf_query(task["jf_idx"],scaffold_fa,jf_out)
+
+    #the scaffold sequence is shared read only between the workers
+    sequence = np.memmap(task["genome_buffer"], dtype=np.uint8, mode='r',
+                         offset=offset, shape=(seq_len,))
+
+    range_starts,range_ends = jf_idx.compute_index_ranges(sequence,
+                                                          task["mer_l"])
+
+    del sequence
+
+    kmer_indices = write_index_files(range_starts,range_ends,index_out,
+                                     index_npy,task["chunk_size"])
+
+    chunks = count_index_chunks(jf_out,kmer_indices,task["chunk_size"])
+
+    tagged_ranges = rid.scan_count_chunks(chunks,[task["setting"]],
+                                          task["mer_l"],task["block_size"])
+
+    region_summary = rid.write_collapsed_beds(tagged_ranges,[bed_file],chrom)
+
+    del kmer_indices
+    os.remove(index_npy)
+
+    return chrom,region_summary[0]
+
+##############################################################################
+
+def main():
+
+    start_time=time.time()
+
+    """Reads a genome fasta file and genome wide jellyfish index once to
+    generate the jellyfish count, scaffold index and scaffold fasta files
+    of every scaffold, then identifies repeat regions in each of them. The
+    scaffolds are processed in parallel by a pool of workers that memory map
+    a shared buffer of the scaffold sequences, writing the same files as
+    running generate_jf_idx and repeat_ID for each scaffold."""
+
+    userInput = argparse.ArgumentParser(description=\
+        '%Requires a genome FASTA file as input'
+        'And Jellyfish Index file of genome'
+        'and the scaffolds to be searched for repeat regions.')
+
+    requiredNamed = userInput.add_argument_group('required arguments')
+
+    requiredNamed.add_argument('-f', '--fasta_file', action='store',
+                               required=True,
+                               help='The genomic fasta file')
+    requiredNamed.add_argument('-j', '--jf_indexfile', action='store',
+                               required=True,
+                               help='The jf file of a given genome')
+    requiredNamed.add_argument('-s', '--samples', action='store',
+                               required=True, nargs='+',
+                               help='The scaffolds to be searched')
+    requiredNamed.add_argument('-m', '--mer_val', action='store',
+                               required=True, type=int,
+                               help='length of k-mers queried')
+    requiredNamed.add_argument('-f_o', '--scaffold_fa_dir', action='store',
+                               required=True,
+                               help='directory of scaffold fasta files')
+    requiredNamed.add_argument('-j_o', '--jf_out_dir', action='store',
+                               required=True,
+                               help='directory of jellyfish query files')
+    requiredNamed.add_argument('-i', '--index_out_dir', action='store',
+                               required=True,
+                               help='directory of scaffold index files')
+    requiredNamed.add_argument('-o_b', '--bed_dir', action='store',
+                               required=True,
+                               help='directory of repeat region bed files')
+    requiredNamed.add_argument('-w', '--window_length', action='store',
+                               default=3000, type=int, help='The length of'
+                               'the scanning window for kmer enriched'
+                               'regions; default is 3000')
+    requiredNamed.add_argument('-t', '--threshold', action='store',
+                               default=10, type=int, help='The minimum number'
+                               'of counts that defines a kmer enriched'
+                               'region; default is 10')
+    requiredNamed.add_argument('-c', '--composition_score', action='store',
+                               default=0.5,type=float,help='The minimum'
+                               'percentage of kmers that pass threshold'
+                               'in window; default is 0.5')
+    userInput.add_argument('-cs', '--chunk_size', action='store',
+                           default=10000000, type=int, help='The number of'
+                           ' k-mers held in memory at once by each worker;'
+                           ' default is 10000000')
+    userInput.add_argument('-bs', '--block_size', action='store',
+                           default=1000, type=int, help='The number of'
+                           ' window starts summarized by each block of the'
+                           ' coarse pass, 0 scores every window; default is'
+                           ' 1000')
+    userInput.add_argument('-n', '--threads', action='store',
+                           default=1, type=int, help='Number of scaffolds'
+                           ' processed at once; default is 1')
+
+    args = userInput.parse_args()
+    fa_file = args.fasta_file
+    samples = args.samples
+    WINDOW = args.window_length
+    THRESHOLD = args.threshold
+    COMPOSITION = args.composition_score
+
+    for out_dir in [args.scaffold_fa_dir,args.jf_out_dir,args.index_out_dir,
+                    args.bed_dir]:
+        create_dir(out_dir)
+
+    #the shared scaffold buffer and index arrays live next to the beds
+    tmp_dir = tempfile.mkdtemp(prefix="repeat_discovery_",dir=args.bed_dir)
+    genome_buffer = os.path.join(tmp_dir,"genome.buffer")
+
+    seq_offsets = split_scaffolds(fa_file,set(samples),args.scaffold_fa_dir,
+                                  genome_buffer)
+
+    print("---%s seconds ---"%(time.time()-start_time))
+
+    missing = [chrom for chrom in samples if chrom not in seq_offsets]
+    if missing:
+        print("Scaffolds not found in fasta file: " + ", ".join(missing))
+
+    tasks = [{"chrom": chrom,
+              "seq_offset": seq_offsets[chrom],
+              "genome_buffer": genome_buffer,
+              "tmp_dir": tmp_dir,
+              "jf_idx": args.jf_indexfile,
+              "fasta_dir": args.scaffold_fa_dir,
+              "jf_dir": args.jf_out_dir,
+              "index_dir": args.index_out_dir,
+              "bed_dir": args.bed_dir,
+              "mer_l": args.mer_val,
+              "setting": (WINDOW,THRESHOLD,COMPOSITION),
+              "chunk_size": max(args.chunk_size,WINDOW),
+              "block_size": args.block_size}
+             for chrom in samples if chrom in seq_offsets]
+
+    #largest scaffolds are started first so the pool finishes together
+    tasks.sort(key=lambda task: -task["seq_offset"][1])
+
+    with Pool(processes=max(1,args.threads)) as pool:
+        for chrom,summary in pool.imap_unordered(discover_scaffold,tasks):
+            print("%s: %s regions, %s bp, largest %s bp" % ((chrom,) +
+                                                            tuple(summary)))
+            print("---%s seconds ---"%(time.time()-start_time))
+
+    shutil.rmtree(tmp_dir)
+
+    print("Done")
+
+if __name__ == '__main__':
+    main()